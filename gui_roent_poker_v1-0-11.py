@@ -6,7 +6,6 @@
 # 依存: dearpygui>=1.11  (pip install dearpygui)
 
 import os, re, time, math, threading, importlib.util
-from types import MethodType
 from threading import Event
 import dearpygui.dearpygui as dpg
 
@@ -59,6 +58,9 @@ class PokerGUI:
         self.winners_pid = set()
         self.p1_class_text = ""
         self.p1_draw_text  = ""
+        self.p1_equity_text = ""
+        self.texture_text = ""
+        self._p1_equity_key = None
 
         # ★ ショーダウン解析中フラグ（初期化忘れ対策）
         self._in_showdown = False
@@ -152,6 +154,7 @@ class PokerGUI:
             dpg.add_text("Board:", color=(190, 200, 210))
             with dpg.group(horizontal=True):
                 self.board_tok = [dpg.add_text("", color=(220,220,220)) for _ in range(5)]
+            self.txt_texture = dpg.add_text("", color=(170,180,190))
             dpg.add_spacer(height=8)
             dpg.add_text("Player1:", color=(190, 200, 210))
             with dpg.group(horizontal=True):
@@ -160,6 +163,7 @@ class PokerGUI:
             dpg.add_text("P1 hand class / draws:", color=(190, 200, 210))
             self.txt_p1_class = dpg.add_text("")
             self.txt_p1_draws = dpg.add_text("")
+            self.txt_p1_equity = dpg.add_text("", color=(220,210,160))
             dpg.add_spacer(height=8)
             self.txt_handno = dpg.add_text("")
 
@@ -310,6 +314,8 @@ class PokerGUI:
         self._set_colored_tokens(self.p1_tok, [t for t in self.seat_info[0].get("hole","").split() if t][:2])
         dpg.set_value(self.txt_p1_class, self.p1_class_text or "")
         dpg.set_value(self.txt_p1_draws, self.p1_draw_text or "")
+        dpg.set_value(self.txt_p1_equity, self.p1_equity_text or "")
+        dpg.set_value(self.txt_texture, self.texture_text or "")
 
     def _append_log(self, line: str):
         dpg.add_text(line, parent=self.log_panel)
@@ -449,32 +455,53 @@ class PokerGUI:
 
         try:
             if g.public_actions:
-                e = g.public_actions[-1]; pid=e.get("by")
+                e = g.public_actions[-1]; pid=e.by
                 if pid:
-                    at=e.get("type",""); amt=e.get("amount")
+                    at=self.engine.ACTION_TYPES[e.type]; amt=e.amount
                     text = at + (f" {amt}" if (amt and str(amt)!="0") else "")
                     self._persist_action(pid, text, at.lower())
         except: pass
 
+        # ボードテクスチャ（表引き）
+        try:
+            self.texture_text = self.engine.texture_label(g.board_ctx.texture()) if len(g.board) >= 3 else ""
+        except: pass
+
         # P1 class/draws
         try:
-            cards = list(g.players[0].hole) + list(g.board)
-            if cards and len(cards)>=2:
-                sc,_ = self.engine.best_of_seven(cards) if len(cards)>=5 else (None,None)
+            hole = g.players[0].hole
+            ctx = g.board_ctx
+            if hole and len(hole)==2:
+                sc = ctx.strength(hole) if len(ctx.cards)>=3 else None
                 self.p1_class_text = f"{self.engine.hand_label(sc)}" if sc else "-"
                 if g.street in ("FLOP","TURN"):
-                    fd  = self.engine.has_flush_draw(cards)
-                    oes = self.engine.has_4run_oesd(cards)
-                    gut = self.engine.has_gutshot_draw(cards)
-                    dr = []
-                    if fd: dr.append("FlushDraw")
-                    if oes: dr.append("OESD")
-                    if gut: dr.append("Gutshot")
-                    self.p1_draw_text = " / ".join(dr) if dr else "No draw"
+                    info = ctx.draws(hole)
+                    dr = self.engine.draw_labels(info)
+                    self.p1_draw_text = (" / ".join(dr) + f"  (outs {info.outs})") if dr else "No draw"
                 else:
                     self.p1_draw_text = ""
         except: pass
 
+        # P1 equity（ボードか相手人数が変わったときだけ再計算。~50ms 上限）
+        try:
+            p1 = g.players[0]
+            n_opp = len(g.in_hand_players()) - 1
+            key = (g.hand_id, len(g.board), n_opp)
+            if key != self._p1_equity_key:
+                self._p1_equity_key = key
+                eq = None
+                if p1.hole and len(p1.hole)==2 and not p1.is_folded and n_opp >= 1 and not g.board:
+                    eq = self.engine.preflop_equity(p1.hole, n_opp + 1)   # 事前計算表（あれば即答）
+                if eq is not None:
+                    self.p1_equity_text = f"Equity vs {n_opp}: {eq*100:.1f}% (table)"
+                elif p1.hole and len(p1.hole)==2 and not p1.is_folded and n_opp >= 1:
+                    r = self.engine.equity_mc(p1.hole, g.board, n_opponents=n_opp,
+                                              samples=5000, time_budget=0.05)
+                    self.p1_equity_text = f"Equity vs {n_opp}: {r.equity*100:.1f}% (±{1.96*r.stderr*100:.1f})"
+                else:
+                    self.p1_equity_text = ""
+        except: pass
+
         self._update_side(); self._redraw_table()
 
     # ===================== Play panel helpers =====================
@@ -538,6 +565,7 @@ class PokerGUI:
                 sb=self.engine.SB, bb=self.engine.BB,
                 human_ids=set(),  # ここでは差し替えで人間化
                 max_rebuys=self.engine.MAX_REBUYS,
+                config=self.engine.GameConfig(verbose=False),  # 表示は GuiSink がログ欄に出す
             )
 
             # Playerモードなら Player1 をGUI操作に差し替え
@@ -545,9 +573,10 @@ class PokerGUI:
                 class HumanGUI(self.engine.PolicyBase):
                     def __init__(self_outer, gui_ref): self_outer.gui = gui_ref
                     def act(self_outer, g, player):
-                        legal = list(g.legal_actions(player.id))
+                        opts = g.turn_options(player.id)
+                        legal = list(opts.legal)
                         my_bet = g.bet_in_round.get(player.id, 0)
-                        to_call = max(0, g.current_max_bet - my_bet)
+                        to_call = opts.to_call
                         min_raise = max(g.last_raise_size, g.bb)
                         pot = sum(g.committed_total.values())
                         ctx = {"to_call":to_call,"pot":pot,"min_raise":min_raise,
@@ -560,31 +589,21 @@ class PokerGUI:
                         return (act, to_total)
                 game.policies[1] = HumanGUI(self)
 
-            def out_bound(_, msg): self._gui_out(game, msg)
-            game.out = MethodType(out_bound, game)
-
-            def run_wrapper(this, hands=None):
-                hands = hands or self.engine.ROUNDS
-                for _ in range(hands):
-                    if getattr(this, "_gui_stop", False): break
-                    if len(this.alive_players()) < 2:
-                        this.out("Game ends: less than 2 players remain."); break
-                    ok = this.play_hand()
-                    if not ok:
-                        this.out("Game ends."); break
+            # 表示行は GuiSink 経由で受け取り、ファイル出力はエンジン既定の sink に任せる
+            class GuiSink(self.engine.HandSink):
+                def line(self_outer, g, msg): self._gui_out(g, msg)
+                def add(self_outer, g, result):
                     # ★ AUTOモードのとき、次のハンドが始まる直前に1秒ポーズ
-                    if self.mode == "auto" and not getattr(this, "_gui_stop", False):
+                    if self.mode == "auto" and not getattr(g, "_gui_stop", False):
                         time.sleep(1.0)
-                try: this._save_final_policies_and_winner()
-                except Exception as e: this.out(f"[GUI] finalize error: {e}")
-                for f in this.logs.values():
-                    try: f.flush(); f.close()
-                    except: pass
-                try: this.training_log.flush(); this.training_log.close()
-                except: pass
-
-            game.run = MethodType(run_wrapper, game)
-            game.run(self.engine.ROUNDS)
+            game.sinks = game.default_sinks() + [GuiSink()]
+            try:
+                for _ in game.simulate(self.engine.ROUNDS):
+                    if getattr(game, "_gui_stop", False): break
+            finally:
+                for sink in game.sinks:
+                    try: sink.close(game)
+                    except Exception as e: self._append_log(f"[GUI] finalize error: {e}")
 
         except Exception as e:
             self._append_log(f"[GUI] Engine error: {e}")
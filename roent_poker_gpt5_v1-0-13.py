@@ -7,13 +7,26 @@
 
 import random
 import os
+import bisect
 import sys
 import json
 import time
 import re
 import math
-from itertools import combinations
-from collections import Counter, deque, defaultdict
+import mmap
+import sqlite3
+import multiprocessing
+import multiprocessing.connection
+import threading
+from array import array
+from itertools import accumulate, combinations, permutations, product, groupby
+from collections import deque, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import numpy as np       # 任意: 一括評価のベクトル化にのみ使用（無ければ純 Python）
+except ImportError:
+    np = None
 
 # ======== 設定 ========
 NUM_PLAYERS = 6          # 初期プレイ人数
@@ -25,14 +38,24 @@ MAX_REBUYS = 2           # リバイの数の設定
 HUMAN_IDS = set()        # プレイヤーを追加する場合 set({1})
 LOG_DIR = "logs"
 POSTAI_DIR = "postai"
+TABLE_DIR = os.environ.get("ROENT_POKER_TABLE_DIR", "tables")   # 役評価などの事前計算テーブル置き場（初回の使用時に作る）
 REVEAL_IF_ALL_AI = True
 VERBOSE = True
+HEADLESS = False             # True: 表示・テキストログ・観測 JSON を一切組み立てない高速自己対戦
+HEADLESS_SAVE_EVERY = 100    # ヘッドレス時の policy_memory_latest 保存間隔（ハンド）
+PARALLEL_SYNC_EVERY = 200    # 並列学習でワーカーが学習テーブルを合流させる間隔（ワーカーごとのハンド数）
+PARALLEL_SAVE_SECONDS = 30   # 並列学習の親が policy_memory_latest を保存する間隔（秒）
+ALLIN_RUNOUT_EQUITY = False  # True: オールインで手番が閉じた時点の各自のエクイティ（全列挙）を Game.runout_equity に記録
+SEARCH_IDS = set()           # 探索ポリシー（ISMCTS）で打たせるプレイヤー 例: set({2})
+SEARCH_TIME_BUDGET = 0.05    # 探索ポリシーの 1 判断あたりの時間（秒）
+SEARCH_SEEDED_ITERS = 300    # seed 指定の卓では時間でなくこの反復回数で探索を打ち切る（再現性のため）
+SEARCH_BET_FRACS = (0.5, 1.0)   # 探索で試すベット/レイズ額（ポット比）
+POLICY_KEY_FORMAT = 3        # 新規ポリシーの状態キー形式（1: 接尾辞なし / 2: ポストフロップに |<テクスチャ> / 3: さらに強さバケット |B<n>）
 
 # 実行固定タイムスタンプ（yyMMddhhmmss）
 RUN_TS = time.strftime("%y%m%d%H%M%S", time.localtime())
 
 # ログ・ポリシーパス
-TRAINING_LOG_PATH = os.path.join(LOG_DIR, "training.jsonl")
 ALL_LOG           = os.path.join(LOG_DIR, "all.log")
 END_PREFLOP_LOG   = os.path.join(LOG_DIR, "end_preflop.log")
 END_FLOP_LOG      = os.path.join(LOG_DIR, "end_flop.log")
@@ -43,6 +66,14 @@ ALLIN_LOG         = os.path.join(LOG_DIR, "allin.log")
 WINNER_POLICY_PATH   = os.path.join(POSTAI_DIR, "policy_memory_winner.json")
 WINNER_HISTORY_PATH  = os.path.join(POSTAI_DIR, "winner_history.jsonl")
 
+EVAL_RANK_TABLE_PATH = os.path.join(TABLE_DIR, "eval_rank_table.bin")
+EQUITY_CACHE_PATH    = os.path.join(TABLE_DIR, "equity_exact.sqlite")
+PREFLOP_EQUITY_PATH  = os.path.join(TABLE_DIR, "preflop_equity.bin")
+HU_EQUITY_1326_PATH  = os.path.join(TABLE_DIR, "hu_equity_1326.bin")
+HU_EQUITY_169_PATH   = os.path.join(TABLE_DIR, "hu_equity_169.bin")
+BOARD_TEXTURE_PATH   = os.path.join(TABLE_DIR, "board_texture.bin")
+BUCKET_STREETS       = {"FLOP": 3, "TURN": 4, "RIVER": 5}   # tables/ehs_flop.bin, tables/buckets_flop.bin など
+
 # プリフロップ・サイズグリッド（bb単位）
 OPEN_SIZE_BB = [2.2, 2.5, 3.0, 3.5]
 THREEBET_SIZE_BB_IP  = [8.5, 9.5, 11.0]
@@ -53,10 +84,12 @@ FOURBET_SIZE_BB = [20.0, 24.0, 28.0]
 BET_SIZES_POT = [0.33, 0.50, 0.66, 0.80, 1.00, 1.50]
 RAISE_SIZES   = ["min", "2.5x", "3x", "allin"]
 
-# 実行ごとに乱数シードを変える
-random.seed(int.from_bytes(os.urandom(8), "little") ^ time.time_ns())
-os.makedirs(LOG_DIR, exist_ok=True)
-os.makedirs(POSTAI_DIR, exist_ok=True)
+# logs/ と postai/ は persist する卓（Game / ResultLogSink / PolicySink）が書くときにだけ作る
+
+def _open_table_for_write(path):
+    """事前計算テーブルの書き込み用（置き場のディレクトリは書くときにだけ作る）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return open(path, "wb")
 
 # 標準出力を行バッファに
 try:
@@ -73,80 +106,218 @@ HAND_NAMES = [
 ]
 RANK_TO_CHAR = {14:"A",13:"K",12:"Q",11:"J",10:"T",9:"9",8:"8",7:"7",6:"6",5:"5",4:"4",3:"3",2:"2"}
 
+# カード = 0..51 の整数（(ランク-2)*4 + スート番号, スート順 "shdc"）。
+# 文字列化は表示・ログの端（card_to_str）でのみ行う。
+SUIT_CHARS = "shdc"
+CARD_RANK = [(c >> 2) + 2 for c in range(52)]   # 2..14
+CARD_SUIT = [c & 3 for c in range(52)]          # 0..3
+RANK_BIT  = [1 << (c >> 2) for c in range(52)]  # 13bit ランク面（bit i = ランク i+2）
+CARD_BIT  = [1 << c for c in range(52)]         # 52bit カード集合
+CARD_STR  = [f"{RANKS_STR.get(CARD_RANK[c], str(CARD_RANK[c]))}{SUIT_STR[SUIT_CHARS[CARD_SUIT[c]]]}"
+             for c in range(52)]
+CARD_ASCII = [RANK_TO_CHAR[CARD_RANK[c]] + SUIT_CHARS[CARD_SUIT[c]] for c in range(52)]  # 'As' 形式（キャッシュキー用）
+
+def make_card(rank, suit_char):
+    return (rank - 2) * 4 + SUIT_CHARS.index(suit_char)
+
 def card_to_str(c):
-    r, s = c
-    rs = RANKS_STR.get(r, str(r))
-    return f"{rs}{SUIT_STR[s]}"
-
-def eval5(cards5):
-    ranks = sorted([r for r, s in cards5], reverse=True)
-    suits = [s for r, s in cards5]
-    cnt = Counter(ranks)
-    by_count = sorted(cnt.items(), key=lambda x: (x[1], x[0]), reverse=True)
-    is_flush = len(set(suits)) == 1
-
-    uniq_desc = sorted(set(ranks), reverse=True)
-    if 14 in uniq_desc:
-        uniq_desc = uniq_desc + [1]
-    run = 1
-    straight_high = None
-    for i in range(len(uniq_desc) - 1):
-        if uniq_desc[i] - 1 == uniq_desc[i + 1]:
-            run += 1
-            if run >= 5:
-                straight_high = uniq_desc[i - 3]
-                break
-        else:
-            run = 1
-
-    if is_flush and straight_high is not None:
-        return (8, (straight_high,))
-    if by_count[0][1] == 4:
-        four = by_count[0][0]
-        kicker = max([r for r in ranks if r != four])
-        return (7, (four, kicker))
-    if by_count[0][1] == 3 and by_count[1][1] >= 2:
-        three = by_count[0][0]
-        pair = by_count[1][0]
-        return (6, (three, pair))
-    if is_flush:
-        return (5, tuple(sorted(ranks, reverse=True)))
-    if straight_high is not None:
-        return (4, (straight_high,))
-    if by_count[0][1] == 3:
-        three = by_count[0][0]
-        kickers = [r for r in ranks if r != three][:2]
-        return (3, (three, *kickers))
-    if by_count[0][1] == 2 and by_count[1][1] == 2:
-        pair_high = max(by_count[0][0], by_count[1][0])
-        pair_low = min(by_count[0][0], by_count[1][0])
-        kicker = max([r for r in ranks if r != pair_high and r != pair_low])
-        return (2, (pair_high, pair_low, kicker))
-    if by_count[0][1] == 2:
-        pair = by_count[0][0]
-        kickers = [r for r in ranks if r != pair][:3]
-        return (1, (pair, *kickers))
-    return (0, tuple(sorted(ranks, reverse=True)))
+    return CARD_STR[c]
+
+def cards_mask(cards):
+    """カード列を 52bit 整数に（ボードの比較・ハッシュ用）"""
+    m = 0
+    for c in cards:
+        m |= CARD_BIT[c]
+    return m
+
+# 強さ = 役クラス << 20 | 比較用ランク 5 枠（4bit ずつ左詰め）。整数の大小がそのまま役の強弱。
+STRENGTH_CLASS_SHIFT = 20
+
+def pack_strength(cls, ranks):
+    v = cls
+    for i in range(5):
+        v = (v << 4) | (ranks[i] if i < len(ranks) else 0)
+    return v
+
+def hand_class(strength):
+    return strength >> STRENGTH_CLASS_SHIFT
+
+def strength_ranks(strength):
+    """強さ整数から比較用ランク列を取り出す（0 埋めは除く）"""
+    out = []
+    for i in range(4, -1, -1):
+        r = (strength >> (4 * i)) & 0xF
+        if r:
+            out.append(r)
+    return out
 
 def pretty_used5(used5):
     return " ".join(card_to_str(c) for c in used5)
 
-def hand_label(score_tuple):
-    return HAND_NAMES[score_tuple[0]]
+def hand_label(strength):
+    return HAND_NAMES[hand_class(strength)]
+
+def _straight_high_of_mask(mask):
+    # mask: bit i = ランク i+2（13bit）
+    for hi in range(12, 3, -1):
+        m = 0x1F << (hi - 4)
+        if mask & m == m:
+            return hi + 2
+    if mask & 0x100F == 0x100F:   # A-2-3-4-5
+        return 5
+    return 0
+
+def _mask_ranks_desc(mask):
+    return [i + 2 for i in range(12, -1, -1) if mask >> i & 1]
+
+def _eval_rank_counts(counts):
+    """ランク別枚数（index 0 = ランク2）から非フラッシュ時の強さを求める"""
+    desc = [(i + 2, counts[i]) for i in range(12, -1, -1) if counts[i]]
+    quads = [r for r, c in desc if c == 4]
+    trips = [r for r, c in desc if c == 3]
+    pairs = [r for r, c in desc if c == 2]
+    if quads:
+        q = quads[0]
+        return pack_strength(7, (q, max(r for r, _ in desc if r != q)))
+    if trips and (len(trips) >= 2 or pairs):
+        t = trips[0]
+        return pack_strength(6, (t, max(trips[1:] + pairs)))
+    mask = 0
+    for r, _ in desc:
+        mask |= 1 << (r - 2)
+    sh = STRAIGHT_HIGH[mask]
+    if sh:
+        return pack_strength(4, (sh,))
+    if trips:
+        t = trips[0]
+        return pack_strength(3, [t] + [r for r, _ in desc if r != t][:2])
+    if len(pairs) >= 2:
+        hp, lp = pairs[0], pairs[1]
+        return pack_strength(2, (hp, lp, max(r for r, _ in desc if r != hp and r != lp)))
+    if pairs:
+        p = pairs[0]
+        return pack_strength(1, [p] + [r for r, _ in desc if r != p][:3])
+    return pack_strength(0, [r for r, _ in desc][:5])
+
+def _eval_flush_mask(mask):
+    sh = STRAIGHT_HIGH[mask]
+    if sh:
+        return pack_strength(8, (sh,))
+    return pack_strength(5, _mask_ranks_desc(mask)[:5])
+
+def _build_rank_table():
+    # 5〜7 枚のランク多重集合（各ランク最大4枚）を列挙し、ニブル詰めヒストグラムをキーにする
+    table = {}
+    counts = [0] * 13
+    def rec(i, left, key):
+        if i == 13:
+            if left <= 2:
+                table[key] = _eval_rank_counts(counts)
+            return
+        for c in range(min(4, left) + 1):
+            counts[i] = c
+            rec(i + 1, left - c, key + (c << (4 * i)))
+        counts[i] = 0
+    rec(0, 7, 0)
+    return table
+
+EVAL_TABLE_MAGIC = b"RPE1"
+
+def _load_or_build_rank_table(path=EVAL_RANK_TABLE_PATH):
+    """初回のみ構築して TABLE_DIR に保存。2 回目以降はファイルから数ミリ秒で読み込む（最初の eval7 で呼ばれる）"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) == EVAL_TABLE_MAGIC:
+                n = int.from_bytes(f.read(4), "little")
+                keys, vals = array("Q"), array("I")
+                keys.fromfile(f, n)
+                vals.fromfile(f, n)
+                return dict(zip(keys, vals))
+    except (OSError, EOFError, ValueError):
+        pass
+    table = _build_rank_table()
+    try:
+        with _open_table_for_write(path) as f:
+            f.write(EVAL_TABLE_MAGIC)
+            f.write(len(table).to_bytes(4, "little"))
+            array("Q", table.keys()).tofile(f)
+            array("I", table.values()).tofile(f)
+    except OSError:
+        pass
+    return table
+
+STRAIGHT_HIGH = [_straight_high_of_mask(m) for m in range(8192)]
+FLUSH_TABLE = [(_eval_flush_mask(m) if bin(m).count("1") >= 5 else 0) for m in range(8192)]
+class _LazyRankTable(dict):
+    """import 時には空。最初の参照で表を読み込み（なければ構築し）、グローバルの RANK_TABLE を本物の dict に差し替える"""
+    def __missing__(self, key):
+        return rank_table()[key]
+
+RANK_TABLE = _LazyRankTable()
+
+def rank_table():
+    global RANK_TABLE
+    if type(RANK_TABLE) is _LazyRankTable:
+        RANK_TABLE = _load_or_build_rank_table()
+    return RANK_TABLE
+
+# カード -> ランク部(16bit 以上)とスート部(下位16bit)を足し込むキー
+CARD_EVAL_KEY = [(1 << (16 + 4 * (c >> 2))) | (1 << (4 * (c & 3))) for c in range(52)]
+
+def eval7(cards):
+    """5〜7 枚の最強役を 1 つの整数で返す（テーブル参照のみ）"""
+    k = sum(map(CARD_EVAL_KEY.__getitem__, cards))
+    f = (k + 0x3333) & 0x8888            # どこかのスートが 5 枚以上
+    if f:
+        s = (f.bit_length() - 4) >> 2
+        mask = 0
+        for c in cards:
+            if c & 3 == s:
+                mask |= RANK_BIT[c]
+        return FLUSH_TABLE[mask]
+    return RANK_TABLE[k >> 16]
+
+def used_five(cards, strength):
+    """強さに対応する 5 枚を cards の並び順で返す（同ランクは先頭側を優先）"""
+    cls = hand_class(strength)
+    rs = strength_ranks(strength)
+    if cls in (4, 8):
+        hi = rs[0]
+        need = [hi - i if hi - i >= 2 else 14 for i in range(5)]
+        need = {r: 1 for r in need}
+    elif cls == 7:
+        need = {rs[0]: 4, rs[1]: 1}
+    elif cls == 6:
+        need = {rs[0]: 3, rs[1]: 2}
+    elif cls == 3:
+        need = {rs[0]: 3, rs[1]: 1, rs[2]: 1}
+    elif cls == 2:
+        need = {rs[0]: 2, rs[1]: 2, rs[2]: 1}
+    elif cls == 1:
+        need = {rs[0]: 2, rs[1]: 1, rs[2]: 1, rs[3]: 1}
+    else:
+        need = {r: 1 for r in rs}
+    suit = None
+    if cls in (5, 8):
+        sc = [0, 0, 0, 0]
+        for c in cards:
+            sc[c & 3] += 1
+        suit = sc.index(max(sc))
+    used = []
+    for c in cards:
+        r = CARD_RANK[c]
+        if need.get(r, 0) > 0 and (suit is None or c & 3 == suit):
+            need[r] -= 1
+            used.append(c)
+    return tuple(used)
 
 def best_of_seven(cards):
-    best = None
-    best5 = None
-    for comb in combinations(cards, 5):
-        score = eval5(comb)
-        if best is None or score > best:
-            best = score
-            best5 = comb
-    return best, best5
-
-def make_deck():
-    deck = [(r, s) for r in range(2, 15) for s in "shdc"]
-    random.shuffle(deck)
+    sc = eval7(cards)
+    return sc, used_five(cards, sc)
+
+def make_deck(rng):
+    deck = list(range(52))
+    rng.shuffle(deck)
     return deck
 
 def preflop_positions_for_n(n):
@@ -161,32 +332,1224 @@ def preflop_positions_for_n(n):
     if n == 10: return ["UTG", "UTG+1", "UTG+2", "UTG+3", "LJ", "HJ", "CO", "BTN", "SB", "BB"]
     raise ValueError("n must be 2..10")
 
-# ======== ドロー検出 ========
-def suits_count(cards):
-    return Counter([s for _, s in cards])
+# ======== 一括評価（ショーダウン / What-if） ========
+# NumPy があり、入力が ndarray の場合のみベクトル化する
+# （Python のリストを配列へ変換するコストで、リスト入力では純 Python 版の方が速いため）
+_NP_EVAL = None
+
+def _np_eval_tables():
+    """NumPy 用の評価テーブル（ソート済みランクキー/値、カード別キー）を遅延構築"""
+    global _NP_EVAL
+    if _NP_EVAL is None:
+        table = rank_table()
+        keys = sorted(table)
+        _NP_EVAL = (
+            np.array(keys, dtype=np.int64),
+            np.array([table[k] for k in keys], dtype=np.int64),
+            np.array([k >> 16 for k in CARD_EVAL_KEY], dtype=np.int64),
+            np.array([k & 0xFFFF for k in CARD_EVAL_KEY], dtype=np.int64),
+        )
+    return _NP_EVAL
+
+def _is_ndarray(x):
+    return np is not None and isinstance(x, np.ndarray)
+
+def _eval_keys_np(rk, sk, cards_of_row):
+    """ランクキー/スートキー配列から強さを引く。フラッシュ行だけ eval7 で評価し直す"""
+    keys, vals, _, _ = _np_eval_tables()
+    out = vals[np.searchsorted(keys, rk)].tolist()
+    for i in np.flatnonzero((sk + 0x3333) & 0x8888).tolist():
+        out[i] = eval7(cards_of_row(i))
+    return out
+
+def eval_board_batch(board, holes):
+    """
+    1 つのボードに対する複数ホールの強さをまとめて返す（ボード部分の集計は 1 回だけ）。
+    holes に (N, 2) の ndarray を渡すと NumPy でベクトル化する
+    """
+    if _is_ndarray(holes):
+        _, _, rank_key, suit_key = _np_eval_tables()
+        h = holes.astype(np.int64).reshape(-1, 2)
+        rk = rank_key[h[:, 0]] + rank_key[h[:, 1]] + sum(CARD_EVAL_KEY[c] >> 16 for c in board)
+        sk = suit_key[h[:, 0]] + suit_key[h[:, 1]] + sum(CARD_EVAL_KEY[c] & 0xFFFF for c in board)
+        return _eval_keys_np(rk, sk, lambda i: h[i].tolist() + list(board))
+    bk = 0
+    bsuit = [0, 0, 0, 0]
+    for c in board:
+        bk += CARD_EVAL_KEY[c]
+        bsuit[c & 3] |= RANK_BIT[c]
+    out = []
+    for h0, h1 in holes:
+        k = bk + CARD_EVAL_KEY[h0] + CARD_EVAL_KEY[h1]
+        f = (k + 0x3333) & 0x8888
+        if f:
+            s = (f.bit_length() - 4) >> 2
+            m = bsuit[s]
+            if h0 & 3 == s: m |= RANK_BIT[h0]
+            if h1 & 3 == s: m |= RANK_BIT[h1]
+            out.append(FLUSH_TABLE[m])
+        else:
+            out.append(RANK_TABLE[k >> 16])
+    return out
+
+def eval_rows_batch(rows):
+    """各行 5〜7 枚のカード列をまとめて評価。(N, k) の ndarray ならベクトル化"""
+    if _is_ndarray(rows):
+        _, _, rank_key, suit_key = _np_eval_tables()
+        r = rows.astype(np.int64)
+        return _eval_keys_np(rank_key[r].sum(axis=1), suit_key[r].sum(axis=1),
+                             lambda i: r[i].tolist())
+    return [eval7(row) for row in rows]
+
+def eval_pairs_batch(pairs):
+    """(hole, board) の組を多数まとめて評価する"""
+    return [eval7((*h, *b)) for h, b in pairs]
+
+def winners_of(strengths, pids):
+    """strengths {pid: 強さ} のうち pids の中での勝者（同点は全員）と最強値"""
+    best, winners = None, []
+    for pid in pids:
+        sc = strengths.get(pid)
+        if sc is None:
+            continue
+        if best is None or sc > best:
+            best, winners = sc, [pid]
+        elif sc == best:
+            winners.append(pid)
+    return winners, best
+
+def showdown_batch(board, holes, groups=()):
+    """
+    holes: {pid: hole}。全員の強さを 1 回の一括評価で求め、
+    groups（pid 列のリスト）ごとの (勝者, 最強値) も返す
+    """
+    pids = list(holes)
+    strengths = dict(zip(pids, eval_board_batch(board, [holes[pid] for pid in pids])))
+    return strengths, [winners_of(strengths, g) for g in groups]
+
+# ======== ドロー検出（ランクマスク表引き） ========
+# DRAW_TABLE[13bit ランクマスク] に、ストレートを完成させるランク（13bit）と
+# 4 連続 / 5 枠中 4 枚 / バックドアの各フラグを詰めて持つ。OESD / ダブルガット / ガットショットは
+# ホールが関わる完成ランクの数で draw_info が決める
+DRAW_RUN4          = 1 << 13   # 4 連続（従来の "O"。A-2-3-4, J-Q-K-A も含む）
+DRAW_WINDOW4       = 1 << 14   # 5 枠中 4 枚（従来の "G"）
+DRAW_BD_STRAIGHT   = 1 << 15   # 5 枠中 3 枚（ランナーランナー）
+DRAW_OUT_RANKS     = (1 << 13) - 1
+
+DrawInfo = namedtuple("DrawInfo", [
+    "flush4",            # 同スート 4 枚以上（従来の "F"）
+    "run4",              # 従来の "O"
+    "window4",           # 従来の "G"
+    "flush_draw",        # ちょうど 4 枚（未完成のフラッシュドロー。フラッシュ系はホールがそのスートを含むときだけ）
+    "oesd",              # 4 連続で完成ランクが 2 つ
+    "double_gutter",     # 4 連続ではないが完成ランクが 2 つ
+    "gutshot",           # 完成ランクが 1 つ（完成ランクはホールを使うストレートになるものだけ）
+    "backdoor_flush",    # フロップで同スート 3 枚
+    "backdoor_straight", # フロップで 5 枠中 3 枚（ストレートドローなし）
+    "outs",              # ストレート + フラッシュのアウツ（重複除く）
+])
+
+def rank_mask(cards):
+    m = 0
+    for c in cards:
+        m |= RANK_BIT[c]
+    return m
+
+def wheel_mask(m):
+    """13bit ランクマスク -> bit i = ランク i+1 の 14bit マスク（A は 1 と 14 の両方）"""
+    return (m << 1) | (m >> 12)
+
+def _draw_entry(mask):
+    m14 = wheel_mask(mask)
+    windows = [bin((m14 >> sh) & 0x1F).count("1") for sh in range(10)]
+    made = STRAIGHT_HIGH[mask]
+    outs = 0
+    for i in range(13):
+        b = 1 << i
+        if not mask & b and STRAIGHT_HIGH[mask | b] > made:
+            outs |= b
+    v = outs
+    if m14 & (m14 >> 1) & (m14 >> 2) & (m14 >> 3):
+        v |= DRAW_RUN4
+    if 4 in windows:
+        v |= DRAW_WINDOW4
+    if not made and not outs and 3 in windows:
+        v |= DRAW_BD_STRAIGHT
+    return v
+
+DRAW_TABLE = [_draw_entry(m) for m in range(8192)]
+
+def draw_info(rmask, suit_counts, n_cards, board_rmask, hole_suits):
+    """
+    ランクマスクとスート枚数（ホール+ボード）からドロー特徴をまとめて返す（n_cards==5 のときのみバックドア）。
+    ホールが 1 枚も関わらないドロー（ボードだけで 4 枚のフラッシュ / ボードだけで完成するストレート）は数えない
+    """
+    v = DRAW_TABLE[rmask]
+    v &= ~(DRAW_TABLE[board_rmask] & (DRAW_RUN4 | DRAW_WINDOW4 | DRAW_BD_STRAIGHT))
+    made = STRAIGHT_HIGH[rmask]
+    out_ranks = 0
+    for r in MASK_RANKS[v & DRAW_OUT_RANKS]:
+        b = 1 << r
+        if STRAIGHT_HIGH[rmask | b] > max(made, STRAIGHT_HIGH[board_rmask | b]):
+            out_ranks |= b
+    n_out = bin(out_ranks).count("1")
+    top = max(suit_counts)
+    if suit_counts.index(top) not in hole_suits:
+        top = 0
+    flush_draw = top == 4
+    flop = n_cards == 5
+    outs = 4 * n_out
+    if flush_draw:
+        outs += 9 - n_out    # 完成ランクのうちフラッシュスートの 1 枚は重複
+    run4 = bool(v & DRAW_RUN4)
+    return DrawInfo(
+        top >= 4, run4, bool(v & DRAW_WINDOW4), flush_draw,
+        n_out >= 2 and run4, n_out >= 2 and not run4, n_out == 1,
+        flop and top == 3, flop and not n_out and bool(v & DRAW_BD_STRAIGHT), outs,
+    )
+
+def analyze_draws(hole, board):
+    """ホール 2 枚 + ボードのドロー特徴を 1 回で求める"""
+    sc = [0, 0, 0, 0]
+    m = 0
+    for c in board:
+        sc[c & 3] += 1
+        m |= RANK_BIT[c]
+    bm = m
+    for c in hole:
+        sc[c & 3] += 1
+        m |= RANK_BIT[c]
+    return draw_info(m, sc, len(hole) + len(board), bm, {c & 3 for c in hole})
+
+def draw_labels(dr):
+    """表示用のドロー名リスト"""
+    out = []
+    if dr.flush_draw: out.append("FlushDraw")
+    if dr.oesd: out.append("OESD")
+    if dr.double_gutter: out.append("DoubleGutter")
+    if dr.gutshot: out.append("Gutshot")
+    if dr.backdoor_flush: out.append("BD-Flush")
+    if dr.backdoor_straight: out.append("BD-Straight")
+    return out
+
+# ======== ボード文脈（ストリート間で増分更新） ========
+class BoardContext:
+    """
+    ボード側の集計（評価キー=ランクヒストグラム+スート枚数、ランク/スート別マスク）を
+    reveal_board のたびに増分更新して全員で共有する。
+    各プレイヤーの役クラスとドローはホール 2 枚を足し込むだけで求まる。
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.cards = []
+        self.mask = 0                    # 52bit カード集合（比較・ハッシュ用）
+        self.key = 0                     # CARD_EVAL_KEY の和
+        self.rank_mask = 0               # 13bit
+        self.suit_masks = [0, 0, 0, 0]   # スート別 13bit ランクマスク
+        self.suit_counts = [0, 0, 0, 0]
+        self._strength_cache = {}        # (h0, h1) -> 強さ（ストリート内のみ有効）
+        self._draw_cache = {}            # (h0, h1) -> ドロー
+        self._bucket_cache = {}          # (h0, h1) -> 強さバケット（表が無ければ None）
+
+    def add(self, c):
+        self.cards.append(c)
+        self.mask |= CARD_BIT[c]
+        self.key += CARD_EVAL_KEY[c]
+        self.rank_mask |= RANK_BIT[c]
+        self.suit_masks[c & 3] |= RANK_BIT[c]
+        self.suit_counts[c & 3] += 1
+        self._strength_cache.clear()
+        self._draw_cache.clear()
+        self._bucket_cache.clear()
+
+    def strength(self, hole):
+        """ホール 2 枚 + ボード（3 枚以上）の強さ"""
+        h0, h1 = hole
+        sc = self._strength_cache.get((h0, h1))
+        if sc is not None:
+            return sc
+        k = self.key + CARD_EVAL_KEY[h0] + CARD_EVAL_KEY[h1]
+        f = (k + 0x3333) & 0x8888
+        if f:
+            s = (f.bit_length() - 4) >> 2
+            m = self.suit_masks[s]
+            if h0 & 3 == s: m |= RANK_BIT[h0]
+            if h1 & 3 == s: m |= RANK_BIT[h1]
+            sc = FLUSH_TABLE[m]
+        else:
+            sc = RANK_TABLE[k >> 16]
+        self._strength_cache[(h0, h1)] = sc
+        return sc
+
+    def hand_class(self, hole):
+        return hand_class(self.strength(hole))
+
+    def draws(self, hole):
+        """DrawInfo をホール 2 枚の合成（ランクマスク OR + スート枚数加算）だけで求める"""
+        h0, h1 = hole
+        dr = self._draw_cache.get((h0, h1))
+        if dr is not None:
+            return dr
+        sc = list(self.suit_counts)
+        sc[h0 & 3] += 1
+        sc[h1 & 3] += 1
+        dr = draw_info(self.rank_mask | RANK_BIT[h0] | RANK_BIT[h1], sc, len(self.cards) + 2,
+                       self.rank_mask, (h0 & 3, h1 & 3))
+        self._draw_cache[(h0, h1)] = dr
+        return dr
+
+    def texture(self):
+        """現ボード（3 枚以上）の BoardTexture。表引きなのでキャッシュ不要"""
+        return board_texture(self.cards)
+
+    def bucket(self, hole):
+        """オフライン生成の強さバケット（正規番号 1 回 + mmap 1 バイト読み）。表が無ければ None"""
+        key = tuple(hole)
+        if key not in self._bucket_cache:
+            self._bucket_cache[key] = strength_bucket(hole, self.cards)
+        return self._bucket_cache[key]
+
+# ======== スート同型インデクサ（ホール + ボードの正規番号） ========
+NCR = [[math.comb(n, k) for k in range(14)] for n in range(60)]
+MASK_RANKS = [[r for r in range(13) if m >> r & 1] for m in range(8192)]
+
+def _colex_rank(mask, used):
+    """used を除いた残りランク中での mask の位置集合を組合せ数系で順位付け"""
+    r = t = pos = 0
+    for rank in range(13):
+        if used >> rank & 1:
+            continue
+        if mask >> rank & 1:
+            t += 1
+            r += NCR[pos][t]
+        pos += 1
+    return r
+
+def _colex_unrank(r, t, used):
+    free = [rank for rank in range(13) if not used >> rank & 1]
+    mask = 0
+    p = len(free)
+    for i in range(t, 0, -1):
+        p -= 1
+        while NCR[p][i] > r:
+            p -= 1
+        r -= NCR[p][i]
+        mask |= 1 << free[p]
+    return mask
+
+def _multiset_rank(vals):
+    """昇順の値列（重複可）-> 重複組合せの順位"""
+    return sum(NCR[v + i][i + 1] if v + i < 60 else math.comb(v + i, i + 1) for i, v in enumerate(vals))
+
+def _multiset_unrank(r, k):
+    out = [0] * k
+    for i in range(k - 1, -1, -1):
+        lo, hi = i, i + 1                # comb(lo, i+1) <= r < comb(hi, i+1) となる lo を二分探索
+        while math.comb(hi, i + 1) <= r:
+            lo, hi = hi, hi * 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if math.comb(mid, i + 1) <= r:
+                lo = mid
+            else:
+                hi = mid
+        r -= math.comb(lo, i + 1)
+        out[i] = lo - i
+    return out
 
-def has_flush_draw(cards):
-    return max(suits_count(cards).values(), default=0) >= 4
+class HandIndexer:
+    """
+    ラウンドごとの枚数（例 (2, 3) = ホール + フロップ）を指定し、スート同型類に 0..size-1 の番号を振る。
+    各スートの「ラウンド別ランク集合の列」を順位付けし、枚数構成が同じスート同士は多重集合として数える。
+    (2,) = 169 / (2, 3) = 1,286,792 / (2, 4) = 13,960,050 / (2, 5) = 123,156,254
+    """
+    def __init__(self, cards_per_round):
+        self.rounds = tuple(cards_per_round)
+        configs = set()
+        def rec(r, per_suit):
+            if r == len(self.rounds):
+                configs.add(tuple(sorted(per_suit, reverse=True)))
+                return
+            n = self.rounds[r]
+            for split in product(range(n + 1), repeat=4):
+                if sum(split) == n:
+                    nxt = [ps + (x,) for ps, x in zip(per_suit, split)]
+                    if all(sum(v) <= 13 for v in nxt):
+                        rec(r + 1, nxt)
+        rec(0, [()] * 4)
+        self.configs = sorted(configs, reverse=True)
+        self.config_id = {c: i for i, c in enumerate(self.configs)}
+        self.groups, self.offsets = [], []
+        total = 0
+        for c in self.configs:
+            groups = []
+            for counts, g in groupby(c):
+                k = len(list(g))
+                suit_size, left = 1, 13
+                for n in counts:
+                    suit_size *= NCR[left][n]
+                    left -= n
+                groups.append((counts, k, suit_size, math.comb(suit_size + k - 1, k)))
+            self.groups.append(groups)
+            self.offsets.append(total)
+            size = 1
+            for g in groups:
+                size *= g[3]
+            total += size
+        self.size = total
+
+    def _suit_rank(self, masks):
+        idx, mult, used = 0, 1, 0
+        for m in masks:
+            idx += _colex_rank(m, used) * mult
+            mult *= NCR[13 - bin(used).count("1")][bin(m).count("1")]
+            used |= m
+        return idx
+
+    def _suit_unrank(self, idx, counts):
+        masks, used = [], 0
+        for n in counts:
+            base = NCR[13 - bin(used).count("1")][n]
+            m = _colex_unrank(idx % base, n, used)
+            idx //= base
+            masks.append(m)
+            used |= m
+        return masks
+
+    def index(self, cards):
+        """ラウンド順に並んだカード列（例 hole + flop）-> 正規番号"""
+        masks = [[0] * len(self.rounds) for _ in range(4)]
+        i = 0
+        for r, n in enumerate(self.rounds):
+            for c in cards[i:i + n]:
+                masks[c & 3][r] |= RANK_BIT[c]
+            i += n
+        suits = sorted(((tuple(bin(m).count("1") for m in ms), ms) for ms in masks),
+                       key=lambda x: x[0], reverse=True)
+        ci = self.config_id[tuple(cnt for cnt, _ in suits)]
+        idx, mult, j = 0, 1, 0
+        for counts, k, _, gsize in self.groups[ci]:
+            ranks = sorted(self._suit_rank(ms) for _, ms in suits[j:j + k])
+            idx += _multiset_rank(ranks) * mult
+            mult *= gsize
+            j += k
+        return self.offsets[ci] + idx
+
+    def unindex(self, idx):
+        """正規番号 -> 代表のカード列（ラウンド順、各ラウンド内は昇順）"""
+        ci = bisect.bisect_right(self.offsets, idx) - 1
+        rem = idx - self.offsets[ci]
+        per_suit = []
+        for counts, k, _, gsize in self.groups[ci]:
+            for sr in _multiset_unrank(rem % gsize, k):
+                per_suit.append(self._suit_unrank(sr, counts))
+            rem //= gsize
+        out = []
+        for r in range(len(self.rounds)):
+            out.extend(sorted(rank * 4 + s for s, ms in enumerate(per_suit) for rank in MASK_RANKS[ms[r]]))
+        return out
+
+_HAND_INDEXERS = {}
+BOARD_ROUNDS = {0: (2,), 3: (2, 3), 4: (2, 4), 5: (2, 5)}   # ボードは 1 ラウンド扱い（ストリート順は区別しない）
+
+def hand_indexer(n_board):
+    """ボード枚数（0/3/4/5）に対応する共有インデクサ（初回のみ構築）"""
+    ix = _HAND_INDEXERS.get(n_board)
+    if ix is None:
+        ix = _HAND_INDEXERS[n_board] = HandIndexer(BOARD_ROUNDS[n_board])
+    return ix
+
+def hand_index(hole, board=()):
+    """(hole, board) のスート同型番号。事前計算テーブル・メモ化キャッシュ共通のキー空間"""
+    return hand_indexer(len(board)).index((*hole, *board))
+
+def canonical_hand(hole, board=()):
+    """(hole, board) の正規代表 -> (hole, board)"""
+    cards = hand_indexer(len(board)).unindex(hand_index(hole, board))
+    return tuple(cards[:2]), tuple(cards[2:])
+
+# ======== ボードテクスチャ（全フロップ 22,100 / 全ターン 270,725 を 16bit に詰めた表） ========
+# bit 0-1: ペア度（0=なし 1=ペア 2=ツーペア 3=トリップス以上） / bit 2-3: 最多スート枚数-1（0=レインボー）
+# bit 4-5: 5 ランク幅に入る最大ランク数-1（3 まで） / bit 6-7: ハイカード帯（0=9以下 1=T-J 2=Q-K 3=A）
+# bit 8: フラッシュ可能 / bit 9: ストレート可能 / bit 10: フラッシュドロー可能
+BoardTexture = namedtuple("BoardTexture", ["pairing", "suited", "connect", "high",
+                                           "flush_possible", "straight_possible", "flush_draw_possible"])
+TEXTURE_MAGIC = b"RPT1"
+RANK_WINDOWS = [0b1111 | (1 << 12)] + [0b11111 << i for i in range(9)]   # A-5 と 5 連続のランク窓
+
+def _texture_code(cards):
+    counts = [0] * 13
+    suits = [0, 0, 0, 0]
+    m = 0
+    for c in cards:
+        counts[c >> 2] += 1
+        suits[c & 3] += 1
+        m |= RANK_BIT[c]
+    top = max(counts)
+    pairs = sum(1 for x in counts if x >= 2)
+    pairing = 3 if top >= 3 else min(pairs, 2)
+    s = max(suits)
+    w = max(bin(m & win).count("1") for win in RANK_WINDOWS)
+    hi = m.bit_length() + 1                      # 最上位ランク（2..14）
+    high = 3 if hi == 14 else (2 if hi >= 12 else (1 if hi >= 10 else 0))
+    return (pairing | (s - 1) << 2 | min(3, w - 1) << 4 | high << 6
+            | (s >= 3) << 8 | (w >= 3) << 9 | (s == 2 and len(cards) < 5) << 10)
+
+def board_index(cards):
+    """3/4 枚のボード -> カード集合の組合せ番号（並び順は無関係）"""
+    return sum(NCR[c][i + 1] for i, c in enumerate(sorted(cards)))
+
+def _load_or_build_texture_tables(path=BOARD_TEXTURE_PATH):
+    """フロップ表・ターン表（array('H')）。初回のみ構築して TABLE_DIR に保存（最初の texture_code で呼ばれる）"""
+    sizes = (NCR[52][3], NCR[52][4])
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) == TEXTURE_MAGIC:
+                out = []
+                for n in sizes:
+                    t = array("H")
+                    t.fromfile(f, n)
+                    out.append(t)
+                return out
+    except (OSError, EOFError, ValueError):
+        pass
+    out = []
+    for k, n in zip((3, 4), sizes):
+        t = array("H", [0]) * n
+        for b in combinations(range(52), k):
+            t[board_index(b)] = _texture_code(b)
+        out.append(t)
+    try:
+        with _open_table_for_write(path) as f:
+            f.write(TEXTURE_MAGIC)
+            for t in out:
+                t.tofile(f)
+    except OSError:
+        pass
+    return out
+
+FLOP_TEXTURE = TURN_TEXTURE = None
+TEXTURE_DECODE = [BoardTexture(c & 3, (c >> 2 & 3) + 1, (c >> 4 & 3) + 1, c >> 6 & 3,
+                               bool(c >> 8 & 1), bool(c >> 9 & 1), bool(c >> 10 & 1)) for c in range(2048)]
+
+def texture_code(board):
+    """ボード（3〜5 枚）のテクスチャを 16bit で。フロップ/ターンは表引き、リバーはその場で計算"""
+    global FLOP_TEXTURE, TURN_TEXTURE
+    n = len(board)
+    if FLOP_TEXTURE is None and n < 5:
+        FLOP_TEXTURE, TURN_TEXTURE = _load_or_build_texture_tables()
+    if n == 3:
+        return FLOP_TEXTURE[board_index(board)]
+    if n == 4:
+        return TURN_TEXTURE[board_index(board)]
+    return _texture_code(board)
+
+def board_texture(board):
+    return TEXTURE_DECODE[texture_code(board)]
+
+def texture_class(t):
+    """状態キー用の 1 文字: m=3 枚以上同スート / p=ペア / w=ツートーンか連結 / d=ドライ"""
+    if t.suited >= 3:
+        return "m"
+    if t.pairing:
+        return "p"
+    if t.suited == 2 or t.straight_possible:
+        return "w"
+    return "d"
+
+TEXTURE_CLASS_NAMES = {"m": "monotone", "p": "paired", "w": "wet", "d": "dry"}
+
+def texture_label(t):
+    """表示・統計用のラベル（例: 'paired-twotone-A'）"""
+    pair = ("unpaired", "paired", "twopair", "trips")[t.pairing]
+    suit = ("rainbow", "twotone", "monotone", "fourflush")[t.suited - 1]
+    conn = "connected" if t.straight_possible else "disconnected"
+    return f"{pair}-{suit}-{conn}-{'LMHA'[t.high]}"
+
+# ======== エクイティ（モンテカルロ） ========
+EquityResult = namedtuple("EquityResult", ["win", "tie", "equity", "samples", "stderr"])
+EQUITY_BATCH = 500           # 1 バッチのサンプル数（打ち切り判定・プロセス分配の単位）
+CHAR_TO_RANK = {v: k for k, v in RANK_TO_CHAR.items()}
+
+def parse_cards(text):
+    """'As Kd' / 'AsKd' / 'A♠K♦' -> [card, ...]（解析スクリプト・CLI 向け）"""
+    t = text.replace(" ", "").replace(",", "")
+    for sym, ch in (("♠", "s"), ("♥", "h"), ("♦", "d"), ("♣", "c")):
+        t = t.replace(sym, ch)
+    t = t.replace("10", "T")
+    if len(t) % 2:
+        raise ValueError(f"bad card string: {text!r}")
+    return [make_card(CHAR_TO_RANK[t[i].upper()], t[i + 1].lower()) for i in range(0, len(t), 2)]
+
+def expand_combo(label):
+    """'AKs' / 'AKo' / 'QQ' -> その 169 分類に属するホール一覧"""
+    a, b = CHAR_TO_RANK[label[0]], CHAR_TO_RANK[label[1]]
+    out = []
+    for s1 in SUIT_CHARS:
+        for s2 in SUIT_CHARS:
+            c1, c2 = make_card(a, s1), make_card(b, s2)
+            if a == b:
+                if c1 < c2:
+                    out.append((c1, c2))
+            elif (label[2:] == "s") == (s1 == s2):
+                out.append((c1, c2))
+    return out
+
+def weighted_range(spec):
+    """{'AKs': 1.0, 'QQ': 0.5, ...} -> [(hole, weight), ...]"""
+    return [(h, float(w)) for label, w in spec.items() for h in expand_combo(label) if w > 0]
+
+def _equity_mc_batch(hole, board, opp_fixed, opp_ranges, n_random, n, seed):
+    """n 回のランアウトを試行して (n, 勝ち, 引分, 分配込み合計, 二乗和) を返す（プロセスプール用）"""
+    rng = random.Random(seed)
+    dead = set(hole) | set(board)
+    for h in opp_fixed:
+        dead.update(h)
+    live = [c for c in range(52) if c not in dead]
+    ranges = []
+    for rg in opp_ranges:
+        rg = [(h, w) for h, w in rg if h[0] not in dead and h[1] not in dead]
+        if not rg:
+            raise ValueError("opponent range is empty after removing dead cards")
+        ranges.append(([h for h, _ in rg], list(accumulate(w for _, w in rg))))
+    need_board = 5 - len(board)
+    need = need_board + 2 * n_random
+    extra = 2 * len(ranges)
+    board = list(board)
+    me = list(hole)
+    wins = ties = 0
+    eq = eq2 = 0.0
+    for _ in range(n):
+        used = set()
+        opps = list(opp_fixed)
+        for holes, cw in ranges:
+            for _ in range(1000):
+                h = rng.choices(holes, cum_weights=cw)[0]
+                if h[0] not in used and h[1] not in used:
+                    break
+            else:
+                raise ValueError("opponent ranges cannot be dealt without card conflicts")
+            used.add(h[0]); used.add(h[1])
+            opps.append(h)
+        draw = rng.sample(live, need + extra)
+        if used:
+            draw = [c for c in draw if c not in used]
+        full = board + draw[:need_board]
+        k = need_board
+        for _ in range(n_random):
+            opps.append((draw[k], draw[k + 1]))
+            k += 2
+        scores = eval_board_batch(full, [me] + opps)
+        mine = scores[0]
+        best = max(scores[1:])
+        if mine > best:
+            wins += 1
+            eq += 1.0
+            eq2 += 1.0
+        elif mine == best:
+            share = 1.0 / (1 + scores[1:].count(best))
+            ties += 1
+            eq += share
+            eq2 += share * share
+    return n, wins, ties, eq, eq2
+
+def equity_mc(hole, board=(), n_opponents=1, opp_holes=(), opp_ranges=(),
+              samples=20000, time_budget=None, target_ci=None, workers=1, seed=None):
+    """
+    hole のエクイティをモンテカルロで推定する。
+    - opp_holes: 既知の相手ホール / opp_ranges: 相手ごとのレンジ [(hole, weight), ...]
+      （weighted_range で作成）。残りの相手（合計 n_opponents 人まで）はランダムなホール
+    - samples: 上限サンプル数 / time_budget: 秒 / target_ci: 95% 信頼区間の半幅がこれ以下で打ち切り
+    - workers > 1 で concurrent.futures のプロセスプールにバッチを分配する
+    """
+    opp_fixed = [tuple(h) for h in opp_holes]
+    opp_ranges = [list(r) for r in opp_ranges]
+    n_random = max(0, n_opponents - len(opp_fixed) - len(opp_ranges))
+    if not (opp_fixed or opp_ranges or n_random):
+        raise ValueError("at least one opponent is required")
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "little")
+    seeds = random.Random(seed)
+    args = (tuple(hole), tuple(board), opp_fixed, opp_ranges, n_random)
+    t0 = time.perf_counter()
+    tot = [0, 0, 0, 0.0, 0.0]
+
+    def add(res):
+        for i in range(5):
+            tot[i] += res[i]
+
+    def done():
+        n = tot[0]
+        if n >= samples:
+            return True
+        if time_budget is not None and time.perf_counter() - t0 >= time_budget:
+            return True
+        if target_ci is not None and n >= 2 * EQUITY_BATCH:
+            m = tot[3] / n
+            var = max(0.0, tot[4] / n - m * m)
+            return 1.96 * math.sqrt(var / n) <= target_ci
+        return False
+
+    if workers is None or workers <= 1:
+        while not done():
+            add(_equity_mc_batch(*args, min(EQUITY_BATCH, samples - tot[0]), seeds.getrandbits(64)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            pending, submitted = set(), 0
+            while True:
+                while len(pending) < 2 * workers and submitted < samples:
+                    n = min(EQUITY_BATCH, samples - submitted)
+                    pending.add(ex.submit(_equity_mc_batch, *args, n, seeds.getrandbits(64)))
+                    submitted += n
+                if not pending:
+                    break
+                fin, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in fin:
+                    add(f.result())
+                if done():
+                    for f in pending:
+                        f.cancel()
+                    break
+    n = max(1, tot[0])
+    m = tot[3] / n
+    stderr = math.sqrt(max(0.0, tot[4] / n - m * m) / n)
+    return EquityResult(tot[1] / n, tot[2] / n, m, tot[0], stderr)
+
+# ======== エクイティ（全列挙 + 永続キャッシュ） ========
+SUIT_PERMS = list(permutations(range(4)))
+
+def canonical_showdown(holes, board):
+    """
+    (holes, board) をスート同型で正規化する。
+    24 通りのスート置換のうち (ボード昇順, 各ホール昇順, ホール列昇順) が最小になるものを採用し、
+    (キー文字列, order) を返す。order[i] は正規形の i 番目のホールが元の何番目か
+    """
+    best = None
+    for perm in SUIT_PERMS:
+        b = tuple(sorted((c & ~3) | perm[c & 3] for c in board))
+        hs = sorted((tuple(sorted((c & ~3) | perm[c & 3] for c in h)), i) for i, h in enumerate(holes))
+        cand = (b, tuple(h for h, _ in hs))
+        if best is None or cand < best[0]:
+            best = (cand, [i for _, i in hs])
+    (b, hs), order = best
+    key = "".join(map(CARD_ASCII.__getitem__, b)) + "|" + "|".join("".join(map(CARD_ASCII.__getitem__, h)) for h in hs)
+    return key, order
+
+class ExactEquityCache:
+    """全列挙エクイティの永続キャッシュ（sqlite3、キーは canonical_showdown の正規形）。複数スレッドの卓から共有可"""
+    def __init__(self, path=EQUITY_CACHE_PATH):
+        self.path = path
+        self.mem = {}
+        self.db = None
+        self.lock = threading.Lock()
+
+    def _conn(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA synchronous=OFF")
+            self.db.execute("CREATE TABLE IF NOT EXISTS equity (key TEXT PRIMARY KEY, n INTEGER, result TEXT)")
+        return self.db
+
+    def get(self, key):
+        hit = self.mem.get(key)
+        if hit is None:
+            try:
+                with self.lock:
+                    row = self._conn().execute("SELECT n, result FROM equity WHERE key=?", (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None:
+                hit = (row[0], json.loads(row[1]))
+                self.mem[key] = hit
+        return hit
+
+    def put(self, key, n, result):
+        self.mem[key] = (n, result)
+        try:
+            with self.lock:
+                db = self._conn()
+                db.execute("INSERT OR REPLACE INTO equity VALUES (?, ?, ?)", (key, n, json.dumps(result)))
+                db.commit()
+        except sqlite3.Error:
+            pass
 
-def ranks_with_wheel(cards):
-    rs = set(r for r, _ in cards)
-    if 14 in rs: rs = rs | {1}
-    return rs
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+_EXACT_CACHE = None
+
+def exact_equity_cache():
+    global _EXACT_CACHE
+    if _EXACT_CACHE is None:
+        _EXACT_CACHE = ExactEquityCache()
+    return _EXACT_CACHE
+
+def _equity_enumerate(holes, board):
+    """残りのランアウトを全列挙して [(勝ち数, 引分数, 分配込み合計), ...] とランアウト数を返す"""
+    dead = set(board)
+    for h in holes:
+        dead.update(h)
+    live = [c for c in range(52) if c not in dead]
+    bk = sum(CARD_EVAL_KEY[c] for c in board)
+    base = []
+    for h0, h1 in holes:
+        sm = [0, 0, 0, 0]
+        for c in (h0, h1, *board):
+            sm[c & 3] |= RANK_BIT[c]
+        base.append((bk + CARD_EVAL_KEY[h0] + CARD_EVAL_KEY[h1], sm))
+    acc = [[0, 0, 0.0] for _ in holes]
+    n = 0
+    for run in combinations(live, 5 - len(board)):
+        rk = 0
+        rs = [0, 0, 0, 0]
+        for c in run:
+            rk += CARD_EVAL_KEY[c]
+            rs[c & 3] |= RANK_BIT[c]
+        scores = []
+        for k, sm in base:
+            k += rk
+            f = (k + 0x3333) & 0x8888
+            if f:
+                s = (f.bit_length() - 4) >> 2
+                scores.append(FLUSH_TABLE[sm[s] | rs[s]])
+            else:
+                scores.append(RANK_TABLE[k >> 16])
+        best = max(scores)
+        nb = scores.count(best)
+        for i, sc in enumerate(scores):
+            if sc == best:
+                a = acc[i]
+                if nb == 1:
+                    a[0] += 1
+                    a[2] += 1.0
+                else:
+                    a[1] += 1
+                    a[2] += 1.0 / nb
+        n += 1
+    return acc, n
 
-def has_4run_oesd(cards):
-    rs = sorted(list(ranks_with_wheel(cards)))
-    if not rs: return False
-    for i in range(len(rs) - 3):
-        if rs[i]+1 in rs and rs[i]+2 in rs and rs[i]+3 in rs:
-            return True
-    return False
+def equity_exact(holes, board=(), cache=True):
+    """
+    既知のホール同士のエクイティを残りランアウトの全列挙で厳密に求める（ホール順の EquityResult 列）。
+    フロップ HU で 990 通り、ターンで 44 通り。プリフロップは 171 万通りで数秒かかる。
+    結果はスート同型の正規形をキーに tables/ の sqlite3 に保存し、次回以降の実行でも即答する
+    """
+    holes = [tuple(h) for h in holes]
+    board = tuple(board)
+    if len(holes) < 2 or len(board) > 5:
+        raise ValueError("equity_exact needs at least two holes and at most 5 board cards")
+    key, order = canonical_showdown(holes, board)
+    store = exact_equity_cache() if cache else None
+    hit = store.get(key) if store is not None else None
+    if hit is None:
+        acc, n = _equity_enumerate([holes[i] for i in order], board)
+        hit = (n, acc)
+        if store is not None:
+            store.put(key, n, acc)
+    n, acc = hit
+    out = [None] * len(holes)
+    for j, i in enumerate(order):
+        w, t, e = acc[j]
+        out[i] = EquityResult(w / n, t / n, e / n, n, 0.0)
+    return out
+
+# ======== 169 分類（ホール -> コンボ番号） ========
+# 169 分類は 13×13 グリッド順（行 A..2 × 列 A..2、対角=ペア / 右上=スーテッド / 左下=オフスート）
+GRID_RANKS = "AKQJT98765432"
+COMBO_LABELS = [
+    (a + b if i == j else (a + b + "s" if i < j else b + a + "o"))
+    for i, a in enumerate(GRID_RANKS) for j, b in enumerate(GRID_RANKS)
+]
+COMBO_INDEX = {label: i for i, label in enumerate(COMBO_LABELS)}
 
-def has_gutshot_draw(cards):
-    rs = ranks_with_wheel(cards)
-    for hi in range(5, 15):
-        if len({hi-4,hi-3,hi-2,hi-1,hi} & rs) == 4:
-            return True
-    return False
+def _pair_combo(c1, c2):
+    i, j = 14 - CARD_RANK[c1], 14 - CARD_RANK[c2]     # グリッド上の行/列（A=0）
+    if i > j:
+        i, j = j, i
+    return i * 13 + j if (c1 & 3) == (c2 & 3) and i != j else j * 13 + i
+
+# (c1, c2) -> コンボ番号。c1*52+c2 で引く（順不同、同一カードは 255）
+PAIR_COMBO = array("B", (255 if c1 == c2 else _pair_combo(c1, c2) for c1 in range(52) for c2 in range(52)))
+
+def combo_id(hole):
+    return PAIR_COMBO[hole[0] * 52 + hole[1]]
+
+def hole_to_combo(hole):
+    return COMBO_LABELS[PAIR_COMBO[hole[0] * 52 + hole[1]]]
+
+def range_bits(labels):
+    """コンボ名の集合 -> 169bit のビットマップ（判定は bits >> combo_id & 1）"""
+    b = 0
+    for label in labels:
+        b |= 1 << COMBO_INDEX[label]
+    return b
+
+# ======== プリフロップ・エクイティ表（169 分類 × 2〜10 人） ========
+PREFLOP_EQ_MIN_N, PREFLOP_EQ_MAX_N = 2, 10
+PREFLOP_EQ_MAGIC = b"RPQ1"
+
+def _preflop_equity_cell(ci, n_players, samples, seed):
+    """1 分類 × 1 人数のエクイティ（プロセスプール用）。ランダム相手に対してはスート代表 1 つで十分"""
+    hole = expand_combo(COMBO_LABELS[ci])[0]
+    n, _, _, eq, _ = _equity_mc_batch(hole, (), [], [], n_players - 1, samples, seed)
+    return ci, n_players, eq / n
+
+def build_preflop_equity_table(samples=20000, workers=None, path=PREFLOP_EQUITY_PATH, seed=None):
+    """
+    169 分類 × 2〜10 人のマルチウェイ・エクイティを計算して path に保存する（オフライン生成）。
+    形式: magic 'RPQ1' + n_min, n_max, samples (各 4byte LE) + array('f') [分類][人数]
+    """
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "little")
+    rng = random.Random(seed)
+    width = PREFLOP_EQ_MAX_N - PREFLOP_EQ_MIN_N + 1
+    table = array("f", [0.0]) * (len(COMBO_LABELS) * width)
+    jobs = [(ci, n, samples, rng.getrandbits(64))
+            for n in range(PREFLOP_EQ_MIN_N, PREFLOP_EQ_MAX_N + 1) for ci in range(len(COMBO_LABELS))]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        results = (_preflop_equity_cell(*j) for j in jobs)
+    else:
+        ex = ProcessPoolExecutor(max_workers=workers)
+        results = ex.map(_preflop_equity_cell, *zip(*jobs), chunksize=8)
+    t0 = time.perf_counter()
+    try:
+        for k, (ci, n, eq) in enumerate(results, 1):
+            table[ci * width + n - PREFLOP_EQ_MIN_N] = eq
+            if k % 169 == 0:
+                print(f"  preflop equity: {k}/{len(jobs)} cells ({time.perf_counter() - t0:.0f}s)")
+    finally:
+        if workers > 1:
+            ex.shutdown()
+    with _open_table_for_write(path) as f:
+        f.write(PREFLOP_EQ_MAGIC)
+        for v in (PREFLOP_EQ_MIN_N, PREFLOP_EQ_MAX_N, samples):
+            f.write(v.to_bytes(4, "little"))
+        table.tofile(f)
+    global _PREFLOP_EQ
+    _PREFLOP_EQ = None
+    return table
+
+_PREFLOP_EQ = None
+
+def _preflop_equity_table():
+    """表を遅延ロード（無ければ False を覚えておき、以降はルールベースのみで動く）"""
+    global _PREFLOP_EQ
+    if _PREFLOP_EQ is None:
+        _PREFLOP_EQ = False
+        try:
+            with open(PREFLOP_EQUITY_PATH, "rb") as f:
+                if f.read(4) == PREFLOP_EQ_MAGIC:
+                    lo, hi, _ = (int.from_bytes(f.read(4), "little") for _ in range(3))
+                    t = array("f")
+                    t.fromfile(f, len(COMBO_LABELS) * (hi - lo + 1))
+                    _PREFLOP_EQ = (lo, hi, t)
+        except (OSError, EOFError, ValueError):
+            pass
+    return _PREFLOP_EQ
+
+def preflop_equity(combo, n_players):
+    """169 分類（番号・ラベル・hole のいずれか）の n 人卓でのエクイティ。表が無ければ None"""
+    tab = _preflop_equity_table()
+    if not tab:
+        return None
+    lo, hi, t = tab
+    ci = combo if isinstance(combo, int) else (COMBO_INDEX[combo] if isinstance(combo, str) else combo_id(combo))
+    n = min(max(n_players, lo), hi)
+    return t[ci * (hi - lo + 1) + n - lo]
+
+def preflop_equity_ratio(combo, n_players):
+    """エクイティ / 公平な取り分（1/n）。1.0 が平均、表が無ければ None"""
+    eq = preflop_equity(combo, n_players)
+    return None if eq is None else eq * min(max(n_players, PREFLOP_EQ_MIN_N), PREFLOP_EQ_MAX_N)
+
+# ======== ヘッズアップ・プリフロップ行列（169×169 / 1326×1326、mmap） ========
+# 1326 ホール番号: c1 < c2 として c2*(c2-1)/2 + c1
+HOLES_1326 = [(c1, c2) for c2 in range(52) for c1 in range(c2)]
+HU_MATRIX_MAGIC = b"RPH1"
+HU_UNDEFINED = -1.0          # カードが衝突する組など
+
+def hole_index(hole):
+    c1, c2 = hole
+    if c1 > c2:
+        c1, c2 = c2, c1
+    return c2 * (c2 - 1) // 2 + c1
+
+def _hu_preflop_class(h1, h2):
+    """HU プリフロップの組をスート同型で正規化（canonical_showdown の 4 枚専用の軽量版）。(キー, 入替有無)"""
+    best = None
+    for perm in SUIT_PERMS:
+        a0, a1 = (h1[0] & ~3) | perm[h1[0] & 3], (h1[1] & ~3) | perm[h1[1] & 3]
+        b0, b1 = (h2[0] & ~3) | perm[h2[0] & 3], (h2[1] & ~3) | perm[h2[1] & 3]
+        a = (a0, a1) if a0 < a1 else (a1, a0)
+        b = (b0, b1) if b0 < b1 else (b1, b0)
+        cand = (a + b, False) if a < b else (b + a, True)
+        if best is None or cand[0] < best[0]:
+            best = cand
+    return best
+
+def _hu_equity_cell(h1, h2, samples, seed):
+    """正規形 1 つ分の h1 vs h2 エクイティ（samples=0 で全列挙、プロセスプール用）"""
+    if samples <= 0:
+        acc, n = _equity_enumerate([h1, h2], ())
+        return acc[0][2] / n
+    n, _, _, eq, _ = _equity_mc_batch(h1, (), [h2], [], 0, samples, seed)
+    return eq / n
+
+def _write_hu_matrix(path, n, samples, values):
+    with _open_table_for_write(path) as f:
+        f.write(HU_MATRIX_MAGIC)
+        f.write(n.to_bytes(4, "little"))
+        f.write(samples.to_bytes(4, "little"))
+        values.tofile(f)
+
+def build_headsup_matrices(samples=20000, workers=None, seed=None):
+    """
+    ヘッズアップのプリフロップ・オールイン行列を生成する（オフライン）。
+    スート同型で 1326×1326 の組を正規形（47,008 通り）にまとめて 1 回ずつ計算し、
+    1326 行列と、それを衝突しない組で平均した 169 行列を保存する。samples=0 は全列挙（非常に重い）
+    """
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "little")
+    rng = random.Random(seed)
+    class_id, reps = {}, []
+    pair_cls, pair_flip = array("i"), bytearray()
+    for j, h2 in enumerate(HOLES_1326):
+        for i in range(j):
+            h1 = HOLES_1326[i]
+            if h1[0] in h2 or h1[1] in h2:
+                continue
+            key, flip = _hu_preflop_class(h1, h2)
+            k = class_id.get(key)
+            if k is None:
+                k = class_id[key] = len(reps)
+                reps.append((key[:2], key[2:]))
+            pair_cls.append(k)
+            pair_flip.append(flip)
+    print(f"  heads-up matrix: {len(reps)} suit-isomorphic matchups")
+    workers = workers or os.cpu_count() or 1
+    seeds = [rng.getrandbits(64) for _ in reps]
+    if workers <= 1:
+        results = map(_hu_equity_cell, [a for a, _ in reps], [b for _, b in reps], [samples] * len(reps), seeds)
+    else:
+        ex = ProcessPoolExecutor(max_workers=workers)
+        results = ex.map(_hu_equity_cell, [a for a, _ in reps], [b for _, b in reps],
+                         [samples] * len(reps), seeds, chunksize=64)
+    eqs = array("d")
+    t0 = time.perf_counter()
+    try:
+        for eq in results:
+            eqs.append(eq)
+            if len(eqs) % 2000 == 0:
+                print(f"  heads-up matrix: {len(eqs)}/{len(reps)} ({time.perf_counter() - t0:.0f}s)")
+    finally:
+        if workers > 1:
+            ex.shutdown()
+
+    m1326 = array("f", [HU_UNDEFINED]) * (1326 * 1326)
+    sum169 = [0.0] * (169 * 169)
+    cnt169 = [0] * (169 * 169)
+    cidx = [combo_id(h) for h in HOLES_1326]
+    k = 0
+    for j, h2 in enumerate(HOLES_1326):
+        for i in range(j):
+            h1 = HOLES_1326[i]
+            if h1[0] in h2 or h1[1] in h2:
+                continue
+            e = eqs[pair_cls[k]]
+            if pair_flip[k]:
+                e = 1.0 - e
+            k += 1
+            m1326[i * 1326 + j] = e
+            m1326[j * 1326 + i] = 1.0 - e
+            a, b = cidx[i], cidx[j]
+            sum169[a * 169 + b] += e; cnt169[a * 169 + b] += 1
+            sum169[b * 169 + a] += 1.0 - e; cnt169[b * 169 + a] += 1
+    m169 = array("f", (sv / c if c else HU_UNDEFINED for sv, c in zip(sum169, cnt169)))
+    _write_hu_matrix(HU_EQUITY_1326_PATH, 1326, samples, m1326)
+    _write_hu_matrix(HU_EQUITY_169_PATH, 169, samples, m169)
+    _HU_MATRIX.clear()
+    return m169, m1326
+
+_HU_MATRIX = {}
+
+def _hu_matrix(path):
+    """行列ファイルを mmap して float ビューを返す（無ければ False を覚えておく）"""
+    m = _HU_MATRIX.get(path)
+    if m is None:
+        m = False
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            n = int.from_bytes(mm[4:8], "little")
+            if mm[:4] == HU_MATRIX_MAGIC and len(mm) >= 12 + 4 * n * n:
+                m = (n, memoryview(mm)[12:12 + 4 * n * n].cast("f"))
+            else:
+                mm.close()
+        except (OSError, ValueError):
+            pass
+        _HU_MATRIX[path] = m
+    return m
+
+def headsup_equity(hole_a, hole_b):
+    """プリフロップ・オールインでの hole_a のエクイティ（1326 行列、無ければ None）"""
+    m = _hu_matrix(HU_EQUITY_1326_PATH)
+    if not m:
+        return None
+    e = m[1][hole_index(hole_a) * 1326 + hole_index(hole_b)]
+    return None if e < 0 else e
+
+def headsup_equity_169(combo_a, combo_b):
+    """169 分類同士の平均エクイティ（ラベルまたは hole、無ければ None）"""
+    m = _hu_matrix(HU_EQUITY_169_PATH)
+    if not m:
+        return None
+    a = COMBO_INDEX[combo_a] if isinstance(combo_a, str) else combo_id(combo_a)
+    b = COMBO_INDEX[combo_b] if isinstance(combo_b, str) else combo_id(combo_b)
+    e = m[1][a * 169 + b]
+    return None if e < 0 else e
+
+# ======== 手の強さバケット（EHS / EHS² -> 正規番号ごとのバケット、mmap） ========
+EHS_MAGIC = b"RPS1"
+BUCKET_MAGIC = b"RPK1"
+EHS_CHUNK = 2000             # プロセスプールに渡す 1 ジョブの正規番号数
+
+def _street_path(kind, street):
+    return os.path.join(TABLE_DIR, f"{kind}_{street.lower()}.bin")
+
+def _ehs_chunk(n_board, start, end, rollouts, opponents, seed):
+    """正規番号 start..end-1 の (EHS, EHS²) を交互に並べた array('f')（プロセスプール用）"""
+    ix = hand_indexer(n_board)
+    rng = random.Random(seed)
+    out = array("f")
+    n_roll = 1 if n_board == 5 else rollouts
+    for i in range(start, end):
+        cards = ix.unindex(i)
+        hole, board = cards[:2], cards[2:]
+        live = [c for c in range(52) if c not in cards]
+        hs_sum = hs2_sum = 0.0
+        for _ in range(n_roll):
+            run = rng.sample(live, 5 - n_board)
+            full = board + run
+            rest = [c for c in live if c not in run] if run else live
+            opps = [rng.sample(rest, 2) for _ in range(opponents)]   # 1 人のランダム相手を opponents 回
+            scores = eval_board_batch(full, [hole] + opps)
+            me = scores[0]
+            hs = sum(1.0 if sc < me else (0.5 if sc == me else 0.0) for sc in scores[1:]) / opponents
+            hs_sum += hs
+            hs2_sum += hs * hs
+        out.append(hs_sum / n_roll)
+        out.append(hs2_sum / n_roll)
+    return start, out
+
+def build_ehs_table(street="FLOP", rollouts=30, opponents=30, workers=None, seed=None):
+    """
+    street の全正規番号について EHS（期待ハンド強度）と EHS²（リバー時点の強度の二乗平均）を
+    ランアウト rollouts 回 × ランダム相手 opponents 人でサンプリングし tables/ehs_<street>.bin に保存（オフライン）
+    """
+    n_board = BUCKET_STREETS[street]
+    size = hand_indexer(n_board).size
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "little")
+    rng = random.Random(seed)
+    jobs = [(n_board, a, min(size, a + EHS_CHUNK), rollouts, opponents, rng.getrandbits(64))
+            for a in range(0, size, EHS_CHUNK)]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        results = (_ehs_chunk(*j) for j in jobs)
+    else:
+        ex = ProcessPoolExecutor(max_workers=workers)
+        results = ex.map(_ehs_chunk, *zip(*jobs))
+    table = array("f", [0.0]) * (2 * size)
+    t0 = time.perf_counter()
+    try:
+        for k, (a, vals) in enumerate(results, 1):
+            table[2 * a:2 * a + len(vals)] = vals
+            if k % 50 == 0:
+                print(f"  EHS {street}: {k}/{len(jobs)} chunks ({time.perf_counter() - t0:.0f}s)")
+    finally:
+        if workers > 1:
+            ex.shutdown()
+    with _open_table_for_write(_street_path("ehs", street)) as f:
+        f.write(EHS_MAGIC)
+        f.write(n_board.to_bytes(4, "little"))
+        f.write(size.to_bytes(4, "little"))
+        table.tofile(f)
+    return table
+
+def cluster_buckets(street="FLOP", n_buckets=8, iters=30):
+    """
+    ehs_<street>.bin の EHS² を 1 次元 k-means（1000 ビンのヒストグラム上、分位点で初期化）で
+    n_buckets 個にまとめ、弱い順のバケット番号を uint8 で tables/buckets_<street>.bin に保存する
+    """
+    with open(_street_path("ehs", street), "rb") as f:
+        if f.read(4) != EHS_MAGIC:
+            raise ValueError("bad EHS table")
+        f.read(4)
+        size = int.from_bytes(f.read(4), "little")
+        table = array("f")
+        table.fromfile(f, 2 * size)
+    ehs2 = table[1::2]
+    nbins = 1000
+    hist = [0] * nbins
+    for v in ehs2:
+        hist[min(nbins - 1, int(v * nbins))] += 1
+    mids = [(b + 0.5) / nbins for b in range(nbins)]
+    cum = list(accumulate(hist))
+    centers = [mids[bisect.bisect_left(cum, (j + 0.5) * size / n_buckets)] for j in range(n_buckets)]
+    for _ in range(iters):
+        sw, sx = [0] * n_buckets, [0.0] * n_buckets
+        for x, w in zip(mids, hist):
+            if w:
+                j = min(range(n_buckets), key=lambda j: abs(x - centers[j]))
+                sw[j] += w
+                sx[j] += w * x
+        new = sorted(sx[j] / sw[j] if sw[j] else centers[j] for j in range(n_buckets))
+        if new == centers:
+            break
+        centers = new
+    bin_bucket = bytes(min(range(n_buckets), key=lambda j: abs(x - centers[j])) for x in mids)
+    buckets = bytes(bin_bucket[min(nbins - 1, int(v * nbins))] for v in ehs2)
+    with _open_table_for_write(_street_path("buckets", street)) as f:
+        f.write(BUCKET_MAGIC)
+        f.write(n_buckets.to_bytes(4, "little"))
+        f.write(size.to_bytes(4, "little"))
+        f.write(buckets)
+    _BUCKETS.pop(street, None)
+    return centers
+
+_BUCKETS = {}
+
+def _bucket_table(street):
+    """バケット表を mmap（無ければ False を覚えておき、状態キーは従来どおり）"""
+    t = _BUCKETS.get(street)
+    if t is None:
+        t = False
+        try:
+            with open(_street_path("buckets", street), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            size = int.from_bytes(mm[8:12], "little")
+            if mm[:4] == BUCKET_MAGIC and size == hand_indexer(BUCKET_STREETS[street]).size and len(mm) >= 12 + size:
+                t = mm
+            else:
+                mm.close()
+        except (OSError, ValueError):
+            pass
+        _BUCKETS[street] = t
+    return t
+
+def strength_bucket(hole, board):
+    """(hole, board) の強さバケット（0 = 最弱）。表が無ければ None"""
+    street = {3: "FLOP", 4: "TURN", 5: "RIVER"}.get(len(board))
+    t = _bucket_table(street) if street else False
+    if not t:
+        return None
+    return t[12 + hand_index(hole, board)]
 
 # ======== ユーティリティ（ポリシーファイル） ========
 POLICY_NAME_RE = re.compile(r"^policy_memory_(\d{12})_p(\d{2})_No(\d{8})\.json$")
@@ -197,12 +1560,14 @@ def parse_policy_filename(fn):
     ts, p2, no = m.group(1), m.group(2), m.group(3)
     return {"ts": ts, "p": p2, "no": no}
 
-def list_policy_files_for_player(p2):
+def list_policy_files_for_player(p2, postai_dir=POSTAI_DIR):
     files = []
-    for fn in os.listdir(POSTAI_DIR):
+    if not os.path.isdir(postai_dir):
+        return files
+    for fn in os.listdir(postai_dir):
         m = POLICY_NAME_RE.match(fn)
         if m and m.group(2) == p2:
-            files.append(os.path.join(POSTAI_DIR, fn))
+            files.append(os.path.join(postai_dir, fn))
     return sorted(files)
 
 def load_json_compat(path):
@@ -278,10 +1643,12 @@ def compute_level_bbs(total_chips: int):
 class Learner:
     """
     内部テーブル: (state|option) -> {n,q}
-    - latest_path に逐次保存
+    - latest_path に逐次保存（None ならディスクに触れないメモリ上だけの Learner: 並列学習のワーカー用）
     - final_path は終了時に保存（final_no をメタに併記）
+    - key_format: 状態キーの形式。読み込んだポリシーの形式を引き継ぐ（メタに key_format がない旧ファイルは 1）
+    - rng: rng を渡さない suggest 用。卓が作る Learner には卓の乱数から引いた seed の Random を渡す（省略時は OS の乱数）
     """
-    def __init__(self, player_id, latest_path, run_ts, persona, source_path=None, initial_no=0):
+    def __init__(self, player_id, latest_path, run_ts, persona, source_path=None, initial_no=0, rng=None):
         self.player_id = player_id
         self.latest_path = latest_path
         self.run_ts = run_ts
@@ -295,8 +1662,10 @@ class Learner:
             "source_meta": None,
             "saved_as": None,
             "initial_no": int(initial_no),
-            "cumulative_no_start": int(initial_no)
+            "cumulative_no_start": int(initial_no),
+            "key_format": POLICY_KEY_FORMAT,
         }
+        self.rng = rng if rng is not None else random.Random()
         self.eps = 0.06
         self.alpha = 0.22
         self.prior_bonus = 0.06
@@ -306,17 +1675,38 @@ class Learner:
             self.table.update(tbl)
             self.meta["source_filename"] = os.path.basename(source_path)
             self.meta["source_meta"] = m
+            if tbl:
+                self._adopt_key_format(m, source_path)
 
+        if self.latest_path is None:
+            return
         if os.path.exists(self.latest_path):
             tbl, m = load_json_compat(self.latest_path)
             if tbl:
                 self.table = tbl
+                self._adopt_key_format(m, self.latest_path)
                 if not self.meta["source_filename"]:
                     self.meta["source_filename"] = m.get("source_filename")
                     self.meta["source_meta"] = m
 
         self.save_latest(hands_played=0)
 
+    @property
+    def key_format(self):
+        return self.meta["key_format"]
+
+    @key_format.setter
+    def key_format(self, v):
+        self.meta["key_format"] = v
+
+    def _adopt_key_format(self, meta, path):
+        """読み込んだテーブルのキー形式で学習を続ける（新しい形式のキーでは旧テーブルの行に当たらないため）"""
+        fmt = int((meta or {}).get("key_format", 1))
+        if fmt != POLICY_KEY_FORMAT:
+            print(f"[policy] p{self.player_id:02d}: {os.path.basename(path)} は状態キー形式 {fmt}"
+                  f"（現行 {POLICY_KEY_FORMAT}）のため、形式 {fmt} のまま学習を続けます")
+        self.key_format = fmt
+
     def _key(self, state_key, option_key):
         return f"{state_key}|{option_key}"
 
@@ -324,19 +1714,24 @@ class Learner:
         k = self._key(state_key, option_key)
         return self.table.get(k, {"n":0, "q":0.0})
 
-    def suggest(self, state_key, option_keys, prior_key=None):
+    def suggest(self, state_key, option_keys, prior_key=None, rng=None):
         if not option_keys:
             return None
+        return self._pick(state_key, option_keys, prior_key, self.table.get, rng or self.rng)
+
+    def _pick(self, state_key, option_keys, prior_key, get, rng):
+        # 各オプションの (n, q) は 1 回だけ引く
+        empty = {"n":0, "q":0.0}
+        stats = [get(f"{state_key}|{k}", empty) for k in option_keys]
         # ε-greedy（未学習優先）
-        cold = [k for k in option_keys if self._get(state_key,k)["n"] < 3]
-        if cold and random.random() < self.eps*2:
-            return random.choice(cold)
-        if random.random() < self.eps:
-            return random.choice(option_keys)
+        cold = [k for k, st in zip(option_keys, stats) if st["n"] < 3]
+        if cold and rng.random() < self.eps*2:
+            return rng.choice(cold)
+        if rng.random() < self.eps:
+            return rng.choice(option_keys)
         # UCB風 + prior
         best_k, best_score = None, -1e9
-        for k in option_keys:
-            st = self._get(state_key, k)
+        for k, st in zip(option_keys, stats):
             score = st["q"] + 0.1/(st["n"]+1)
             if prior_key and k == prior_key:
                 score += self.prior_bonus
@@ -347,21 +1742,27 @@ class Learner:
     def update_from_hand(self, traces, rewards_bb, bb_size=1):
         if not traces:
             return
+        self._update([tr for tr in traces if tr.pid == self.player_id], rewards_bb, bb_size)
+
+    def update_from_hands(self, batch):
+        """[(自分の traces, rewards, bb_size), ...] を順にまとめて反映（並列学習のワーカー用）"""
+        for traces, rewards_bb, bb_size in batch:
+            self._update(traces, rewards_bb, bb_size)
+
+    def _update(self, traces, rewards_bb, bb_size):
+        table = self.table
+        r = rewards_bb.get(self.player_id, 0) / max(1, bb_size)
+        r = max(-50.0, min(50.0, r))
         for tr in traces:
-            pid = tr["pid"]
-            if pid != self.player_id:
-                continue
-            state_key = tr["state"]
-            opt = tr["option"]
-            r = rewards_bb.get(pid, 0) / max(1, bb_size)
-            r = max(-50.0, min(50.0, r))
-            k = self._key(state_key, opt)
-            st = self.table.get(k, {"n":0,"q":0.0})
+            k = self._key(tr.state, tr.option)
+            st = table.get(k, {"n":0,"q":0.0})
             st["n"] += 1
             st["q"] += self.alpha * (r - st["q"])
-            self.table[k] = st
+            table[k] = st
 
     def save_latest(self, hands_played):
+        if self.latest_path is None:
+            return
         meta = dict(self.meta)
         meta["latest"] = True
         meta["hands_played_run"] = hands_played
@@ -375,28 +1776,306 @@ class Learner:
         meta["final_no"] = int(final_no)
         save_json_with_meta(final_path, self.table, meta)
 
+# ======== 記録（公開アクション・判断・ポット配分） ========
+# ストリートと行動の種類は小さな整数で持つ（STREETS[i] / ACTION_TYPES[i] が名前）
+STREETS = ("PREFLOP", "FLOP", "TURN", "RIVER")
+ACTION_TYPES = ("blind", "fold", "check", "call", "bet", "raise", "allin")
+STREET_NO = {name: i for i, name in enumerate(STREETS)}
+ACTION_NO = {name: i for i, name in enumerate(ACTION_TYPES)}
+ST_PREFLOP = STREET_NO["PREFLOP"]
+A_BLIND, A_FOLD, A_CHECK, A_CALL, A_BET, A_RAISE, A_ALLIN = range(len(ACTION_TYPES))
+AGGRESSIVE_ACTIONS = frozenset((A_BET, A_RAISE, A_ALLIN))
+
+PublicAction = namedtuple("PublicAction", "street by type amount to_total")   # to_total は bet / raise のみ
+Decision = namedtuple("Decision", "pid state option")   # 学習用の判断（state|option が Learner のキー）
+PotAward = namedtuple("PotAward", "amount winners")     # ポット 1 つの配分（winners は pid のタプル）
+
+def action_info(a):
+    """PublicAction -> ログ用の dict {type, amount[, to_total]}"""
+    info = {"type": ACTION_TYPES[a.type], "amount": a.amount}
+    if a.to_total is not None:
+        info["to_total"] = a.to_total
+    return info
+
+def action_history(actions, k):
+    """公開アクションの deque の末尾 k 件をログ用 dict にする（deque 全体はコピーしない）"""
+    n = min(k, len(actions))
+    return [{"street": STREETS[a.street], "by": a.by, **action_info(a)}
+            for a in (actions[i] for i in range(-n, 0))]
+
+# ======== 卓の状態（座席ごとの配列 + 増分更新の座席集合） ========
+class TableState:
+    """
+    スタック・ラウンド内ベット・投入額・フラグを座席順の配列で持ち、
+    生存 / 手札あり / アクション可能（非オールイン）の座席集合をフラグ更新のたびに増分で保つ。
+    players_of() などの座席順リストは集合が変わるまでキャッシュする
+    """
+    def __init__(self, n):
+        self.n = n
+        self.stack = [0] * n
+        self.bet = [0] * n            # ラウンド内ベット
+        self.committed = [0] * n      # ハンド内の投入総額
+        self.folded = bytearray(n)
+        self.allin = bytearray(n)
+        self.eliminated = bytearray(n)
+        self.alive = set(range(n))
+        self.alive_mask = (1 << n) - 1   # 生存座席のビット列（座席配置キャッシュのキー）
+        self.in_hand = set(range(n))
+        self.active = set(range(n))
+        self.seat_of = {}             # pid -> 座席
+        self.players = [None] * n
+        self._lists = {}
+
+    def register(self, player):
+        self.players[player.seat_index] = player
+        self.seat_of[player.id] = player.seat_index
+
+    def _refresh(self, s):
+        if self.eliminated[s]:
+            self.alive.discard(s)
+            self.alive_mask &= ~(1 << s)
+        else:
+            self.alive.add(s)
+            self.alive_mask |= 1 << s
+        if self.eliminated[s] or self.folded[s]:
+            self.in_hand.discard(s)
+        else:
+            self.in_hand.add(s)
+        if s in self.in_hand and not self.allin[s]:
+            self.active.add(s)
+        else:
+            self.active.discard(s)
+        self._lists.clear()
+
+    def snapshot(self):
+        return (self.stack[:], self.bet[:], self.committed[:], bytes(self.folded), bytes(self.allin),
+                bytes(self.eliminated), set(self.alive), set(self.in_hand), set(self.active), self.alive_mask)
+
+    def restore(self, snap):
+        # 配列はその場で書き戻す（SeatValues / PotLedger が同じ list を参照している）
+        stack, bet, committed, folded, allin, eliminated, alive, in_hand, active, alive_mask = snap
+        self.stack[:] = stack
+        self.bet[:] = bet
+        self.committed[:] = committed
+        self.folded[:] = folded
+        self.allin[:] = allin
+        self.eliminated[:] = eliminated
+        self.alive, self.in_hand, self.active = set(alive), set(in_hand), set(active)
+        self.alive_mask = alive_mask
+        self._lists.clear()
+
+    def set_flag(self, flags, s, v):
+        if flags[s] != v:
+            flags[s] = v
+            self._refresh(s)
+
+    def players_of(self, name):
+        """'alive' / 'in_hand' / 'active' の座席順プレイヤーリスト（呼び出し側で変更しないこと）"""
+        lst = self._lists.get(name)
+        if lst is None:
+            lst = self._lists[name] = [self.players[s] for s in sorted(getattr(self, name))]
+        return lst
+
+# ======== 座席配置（生存座席とボタンから決まる並びの表） ========
+# next_seat: 座席 -> 左隣の生存座席、positions: 座席 -> ポジション名、
+# preflop_order: BB の左から（HU は SB から）の生存座席、postflop_order: ボタンの左からの生存座席（端数チップの配分順も同じ）
+TableGeometry = namedtuple("TableGeometry", "next_seat positions sb_seat bb_seat preflop_order postflop_order")
+
+_GEOMETRY = {}   # (座席数, alive_mask, button) -> TableGeometry
+
+def table_geometry(n, alive_mask, button):
+    key = (n, alive_mask, button)
+    geo = _GEOMETRY.get(key)
+    if geo is not None:
+        return geo
+    alive = [s for s in range(n) if alive_mask >> s & 1]
+    nxt = []
+    for s in range(n):
+        j = (s + 1) % n
+        while alive and not alive_mask >> j & 1:
+            j = (j + 1) % n
+        nxt.append(j)
+
+    def ring(start):
+        order = [start]
+        j = nxt[start]
+        while j != start:
+            order.append(j)
+            j = nxt[j]
+        return tuple(order)
+
+    sb_seat = nxt[button]
+    bb_seat = nxt[sb_seat]
+    positions = {}
+    if len(alive) >= 2:
+        if len(alive) == 2:
+            order = [sb_seat, bb_seat]
+        else:
+            order = list(ring(nxt[bb_seat])[:len(alive) - 3]) + [button, sb_seat, bb_seat]
+        positions = dict(zip(order, preflop_positions_for_n(len(alive))))
+    preflop = ring(sb_seat) if len(alive) == 2 else ring(nxt[bb_seat])
+    geo = _GEOMETRY[key] = TableGeometry(tuple(nxt), positions, sb_seat, bb_seat, preflop, ring(sb_seat))
+    return geo
+
+class SeatValues:
+    """pid -> 値 の dict 互換ビュー（実体は TableState の座席順配列）"""
+    __slots__ = ("vals", "seat_of")
+
+    def __init__(self, vals, seat_of):
+        self.vals = vals
+        self.seat_of = seat_of
+
+    def __getitem__(self, pid):
+        return self.vals[self.seat_of[pid]]
+
+    def __setitem__(self, pid, v):
+        self.vals[self.seat_of[pid]] = v
+
+    def get(self, pid, default=None):
+        s = self.seat_of.get(pid)
+        return default if s is None else self.vals[s]
+
+    def keys(self):
+        return self.seat_of.keys()
+
+    def __iter__(self):
+        return iter(self.seat_of)
+
+    def __len__(self):
+        return len(self.seat_of)
+
+    def values(self):
+        return self.vals
+
+    def items(self):
+        return ((pid, self.vals[s]) for pid, s in self.seat_of.items())
+
+    def clear_values(self):
+        for s in range(len(self.vals)):
+            self.vals[s] = 0
+
+class PotLedger:
+    """
+    層状のサイドポット台帳。チップが投入されるたびに該当する層へ加算し、
+    オールイン / フォールドした額で層を分割する（そのプレイヤーはそれ以上投入しないため）。
+    層 k は投入額 (levels[k-1], levels[k]] の区間、最後の層は上限なし
+    フォールド額でも分割するのは、ショーダウン時の分配（端数の配り方）を
+    全員の最終投入額で区切る従来の計算と一致させるため
+    """
+    def __init__(self, table):
+        self.table = table
+        self.reset()
+
+    def reset(self):
+        self.levels = []        # 層の上限（昇順）
+        self.amounts = [0]      # 層ごとの額
+        self.contrib = [set()]  # 層ごとの投入者 pid
+
+    def add(self, pid, before, after):
+        """pid の投入額が before -> after に増えた"""
+        k = bisect.bisect_right(self.levels, before)
+        lo = self.levels[k - 1] if k else 0
+        while before < after:
+            hi = self.levels[k] if k < len(self.levels) else after
+            part = min(after, hi) - max(before, lo)
+            if part > 0:
+                self.amounts[k] += part
+                self.contrib[k].add(pid)
+            before = max(before, hi)
+            lo = hi
+            k += 1
+
+    def cap(self, level):
+        """level で層を分割（オールイン / フォールドしたプレイヤーの最終投入額）"""
+        if level <= 0:
+            return
+        k = bisect.bisect_left(self.levels, level)
+        if k < len(self.levels) and self.levels[k] == level:
+            return
+        lo = self.levels[k - 1] if k else 0
+        committed, seat_of = self.table.committed, self.table.seat_of
+        upper = {pid for pid in self.contrib[k] if committed[seat_of[pid]] > level}
+        low_amt = sum(min(committed[seat_of[pid]], level) - lo for pid in self.contrib[k])
+        self.levels.insert(k, level)
+        self.amounts.insert(k + 1, self.amounts[k] - low_amt)
+        self.amounts[k] = low_amt
+        self.contrib.insert(k + 1, upper)
+
+    def snapshot(self):
+        return (self.levels[:], self.amounts[:], [set(c) for c in self.contrib])
+
+    def restore(self, snap):
+        levels, amounts, contrib = snap
+        self.levels, self.amounts, self.contrib = levels[:], amounts[:], [set(c) for c in contrib]
+
+    def pots(self):
+        """現在の層 -> [{"amount", "eligible"(フォールドしていない投入者)}]（額 0 の層は除く）"""
+        folded, seat_of = self.table.folded, self.table.seat_of
+        return [{"amount": amt, "eligible": set(pid for pid in sorted(c) if not folded[seat_of[pid]])}
+                for amt, c in zip(self.amounts, self.contrib) if amt > 0]
+
+    def total(self):
+        return sum(self.amounts)
+
+# 手番 1 回ぶんの合法手と額の範囲（betting_round が 1 度だけ計算してポリシと共有）
+#   legal: ソート済みのアクション名 tuple / min_total, max_total: bet・raise 後のラウンド内ベット総額の下限・上限
+TurnOptions = namedtuple("TurnOptions", "pid legal to_call min_total max_total")
+
 # ======== プレイヤー/ポリシ ========
 class Player:
-    def __init__(self, pid, name, seat_index, stack, persona=None):
+    """座席の薄いビュー。stack とフラグの実体は TableState の配列"""
+    def __init__(self, pid, name, seat_index, stack, persona=None, table=None):
         self.id = pid
         self.name = name
         self.seat_index = seat_index
+        self.table = table if table is not None else TableState(seat_index + 1)
+        self.table.register(self)
         self.stack = stack
         self.rebuy_used = 0
-        self.is_folded = False
-        self.is_allin = False
-        self.is_eliminated = False
         self.hole = None
         self.persona = persona or {"style":"bal","bluff":0.5,"size_pref":"bal"}
 
+    @property
+    def stack(self):
+        return self.table.stack[self.seat_index]
+
+    @stack.setter
+    def stack(self, v):
+        self.table.stack[self.seat_index] = v
+
+    @property
+    def is_folded(self):
+        return bool(self.table.folded[self.seat_index])
+
+    @is_folded.setter
+    def is_folded(self, v):
+        self.table.set_flag(self.table.folded, self.seat_index, bool(v))
+
+    @property
+    def is_allin(self):
+        return bool(self.table.allin[self.seat_index])
+
+    @is_allin.setter
+    def is_allin(self, v):
+        self.table.set_flag(self.table.allin, self.seat_index, bool(v))
+
+    @property
+    def is_eliminated(self):
+        return bool(self.table.eliminated[self.seat_index])
+
+    @is_eliminated.setter
+    def is_eliminated(self, v):
+        self.table.set_flag(self.table.eliminated, self.seat_index, bool(v))
+
 class PolicyBase:
     def act(self, game, player):
         raise NotImplementedError
 
 class HumanConsole(PolicyBase):
     def act(self, game, player):
-        legal = list(game.legal_actions(player.id))
-        to_call = max(0, game.current_max_bet - game.bet_in_round.get(player.id, 0))
+        opts = game.turn_options(player.id)
+        legal = list(opts.legal)
+        to_call = opts.to_call
         hole = ' '.join(card_to_str(c) for c in (player.hole or []))
         game.out(f"\n--- Your turn: {player.name} (stack {player.stack}) ---")
         game.out(f"Street: {game.street}  Board: {' '.join(map(card_to_str, game.board)) or '(none)'}")
@@ -438,13 +2117,34 @@ CALL_VS_OPEN = {
     "AQo","AJo","KQo","KJo","QJo","JTo"
 }
 
-def hole_to_combo(hole):
-    (r1, s1), (r2, s2) = hole
-    a, b = sorted([r1, r2], reverse=True)
-    if a == b:
-        return RANK_TO_CHAR[a] + RANK_TO_CHAR[b]
-    suited = (s1 == s2)
-    return f"{RANK_TO_CHAR[a]}{RANK_TO_CHAR[b]}{'s' if suited else 'o'}"
+PREMIUM = {"AA","KK","QQ","AKs","AKo"}
+JAM_4BET = {"AA","KK","AKs","AKo"}
+
+# 判定はコンボ番号（combo_id）に対するビットマップ引き
+EARLY_OPEN_BITS   = range_bits(EARLY_OPEN)
+LATE_OPEN_BITS    = range_bits(LATE_OPEN)
+SB_OPEN_BITS      = range_bits(SB_OPEN)
+THREE_BET_BITS    = range_bits(THREE_BET)
+CALL_VS_OPEN_BITS = range_bits(CALL_VS_OPEN)
+JAM_4BET_BITS     = range_bits(JAM_4BET)
+
+# _state_pre のハンド分類（表による spec 補正前）
+HAND_CATEGORY = [
+    "premium" if label in PREMIUM else
+    "strong" if label in EARLY_OPEN else
+    "spec" if label in LATE_OPEN or label.endswith("s") else "trash"
+    for label in COMBO_LABELS
+]
+
+# 固定レンジ外でも、プリフロップ・エクイティ表（あれば）で公平な取り分の何倍かを見て広げる
+PREFLOP_EQ_OPEN_RATIO = {"EARLY": 1.45, "LATE": 1.25, "SB": 1.25}
+PREFLOP_EQ_SPEC_RATIO = 1.15
+
+def in_open_range(cid, open_bits, n_players, pos_grp):
+    if open_bits >> cid & 1:
+        return True
+    r = preflop_equity_ratio(cid, n_players)
+    return r is not None and r >= PREFLOP_EQ_OPEN_RATIO[pos_grp]
 
 def eff_stack_bb(game, player):
     m = player.stack
@@ -462,39 +2162,50 @@ class RangeAI(PolicyBase):
         self.learner = learner
 
     def act(self, game, player):
+        prior_key, state_key, proposals = self.propose(game, player)
+        chosen_key = self.learner.suggest(state_key, list(proposals.keys()), prior_key=prior_key, rng=game.rng)
+        return self.resolve(game, player, state_key, proposals, chosen_key)
+
+    def propose(self, game, player):
+        """(prior_key, state_key, proposals) — Learner に選ばせる前の候補"""
         if game.street == "PREFLOP":
-            prior_key, state_key, proposals = self.preflop_proposals(game, player)
-        else:
-            prior_key, state_key, proposals = self.postflop_proposals(game, player)
-        option_keys = list(proposals.keys())
-        chosen_key = self.learner.suggest(state_key, option_keys, prior_key=prior_key)
+            return self.preflop_proposals(game, player)
+        return self.postflop_proposals(game, player)
+
+    def resolve(self, game, player, state_key, proposals, chosen_key):
         action, to_total = proposals.get(chosen_key, ("check", None))
         game.record_decision(player.id, state_key, chosen_key)
         return action, to_total
 
-    def _persona_bias_pick(self, player, keys_small, keys_bal, keys_big):
+    def estimate_equity(self, game, player, samples=2000, time_budget=None, target_ci=None):
+        """現在のボードで、手札に残っている相手人数に対するエクイティ（拡張・解析用）"""
+        n_opp = max(1, len(game.in_hand_players()) - 1)
+        return equity_mc(player.hole, game.board, n_opponents=n_opp, samples=samples,
+                         time_budget=time_budget, target_ci=target_ci)
+
+    def _persona_bias_pick(self, game, player, keys_small, keys_bal, keys_big):
         pref = player.persona.get("size_pref","bal")
-        if pref == "small" and keys_small: return random.choice(keys_small)
-        if pref == "big"   and keys_big:   return random.choice(keys_big)
+        if pref == "small" and keys_small: return game.rng.choice(keys_small)
+        if pref == "big"   and keys_big:   return game.rng.choice(keys_big)
         pool = keys_bal or keys_small or keys_big
-        return random.choice(pool) if pool else None
+        return game.rng.choice(pool) if pool else None
 
     def preflop_proposals(self, game, player):
-        legal = set(game.legal_actions(player.id))
+        opts = game.turn_options(player.id)
+        legal = set(opts.legal)
         pos_map = game.get_position_label_map()
         pos = pos_map.get(player.seat_index, "UTG")
-        combo = hole_to_combo(player.hole)
-        my_bet = game.bet_in_round.get(player.id, 0)
-        to_call = max(0, game.current_max_bet - my_bet)
-        raised_already = any(a["street"] == "PREFLOP" and a["type"] in ("bet","raise","allin")
+        cid = combo_id(player.hole)
+        to_call = opts.to_call
+        raised_already = any(a.street == ST_PREFLOP and a.type in AGGRESSIVE_ACTIONS
                              for a in game.public_actions)
         raise_cnt = sum(1 for a in game.public_actions
-                        if a["street"] == "PREFLOP" and a["type"] in ("bet","raise","allin"))
+                        if a.street == ST_PREFLOP and a.type in AGGRESSIVE_ACTIONS)
         depth_bb = eff_stack_bb(game, player)
         n_act = len(game.in_hand_players())
         ncat = "N2" if n_act == 2 else ("N3-4" if n_act <= 4 else "N5+")
 
-        state_key = self._state_pre(game, player, combo, pos, raised_already, raise_cnt, depth_bb, to_call, ncat)
+        state_key = self._state_pre(game, player, cid, pos, raised_already, raise_cnt, depth_bb, to_call, ncat)
         proposals = {}
         def add_open(bb_size):
             if "raise" in legal:
@@ -531,19 +2242,19 @@ class RangeAI(PolicyBase):
             if not raised_already and "check" in legal:
                 prior_key = "check"
             else:
-                if combo in THREE_BET and "raise" in legal:
+                if THREE_BET_BITS >> cid & 1 and "raise" in legal:
                     grid = THREEBET_SIZE_BB_OOP
                     for sz in grid: add_3bet(sz)
                     small=f"raise@3b{grid[0]:.1f}bb"; bal=f"raise@3b{grid[1]:.1f}bb"; big=f"raise@3b{grid[-1]:.1f}bb"
                     prior_key = prefer_aggressive(small, bal, big)
-                elif combo in CALL_VS_OPEN and "call" in legal:
+                elif CALL_VS_OPEN_BITS >> cid & 1 and "call" in legal:
                     prior_key = "call"
                 elif "fold" in legal:
                     prior_key = "fold"
 
         elif pos in SBpos:
             if not raised_already:
-                if combo in SB_OPEN and "raise" in legal:
+                if in_open_range(cid, SB_OPEN_BITS, n_act, "SB") and "raise" in legal:
                     for sz in OPEN_SIZE_BB: add_open(sz)
                     small=f"raise@open{OPEN_SIZE_BB[0]:.1f}bb"
                     bal=f"raise@open{OPEN_SIZE_BB[2]:.1f}bb"
@@ -552,21 +2263,21 @@ class RangeAI(PolicyBase):
                 else:
                     prior_key = "fold" if "fold" in legal else "check"
             else:
-                if combo in THREE_BET and "raise" in legal:
+                if THREE_BET_BITS >> cid & 1 and "raise" in legal:
                     if eff_stack_bb(game, player) <= 18 and "allin" in legal:
                         prior_key = "allin"
                     else:
                         for sz in THREEBET_SIZE_BB_OOP: add_3bet(sz)
                         prior_key = f"raise@3b{THREEBET_SIZE_BB_OOP[1]:.1f}bb"
-                elif combo in CALL_VS_OPEN and "call" in legal:
+                elif CALL_VS_OPEN_BITS >> cid & 1 and "call" in legal:
                     prior_key = "call"
                 else:
                     prior_key = "fold" if "fold" in legal else "call"
 
         else:
             if not raised_already:
-                open_set = EARLY_OPEN if pos in EARLY else LATE_OPEN
-                if combo in open_set and "raise" in legal:
+                open_bits = EARLY_OPEN_BITS if pos in EARLY else LATE_OPEN_BITS
+                if in_open_range(cid, open_bits, n_act, "EARLY" if pos in EARLY else "LATE") and "raise" in legal:
                     for sz in OPEN_SIZE_BB: add_open(sz)
                     small=f"raise@open{OPEN_SIZE_BB[0]:.1f}bb"
                     bal=f"raise@open{OPEN_SIZE_BB[2]:.1f}bb"
@@ -576,7 +2287,7 @@ class RangeAI(PolicyBase):
                     prior_key = "fold" if "fold" in legal else "check"
             else:
                 if raise_cnt >= 2:
-                    if combo in {"AA","KK","AKs","AKo"} and "allin" in legal:
+                    if JAM_4BET_BITS >> cid & 1 and "allin" in legal:
                         prior_key = "allin"
                     else:
                         for sz in FOURBET_SIZE_BB: add_4bet(sz)
@@ -585,14 +2296,14 @@ class RangeAI(PolicyBase):
                         else:
                             prior_key = "fold" if "fold" in legal else "call"
                 else:
-                    if combo in THREE_BET and "raise" in legal:
+                    if THREE_BET_BITS >> cid & 1 and "raise" in legal:
                         if eff_stack_bb(game, player) <= 20 and "allin" in legal:
                             prior_key = "allin"
                         else:
                             grid = THREEBET_SIZE_BB_IP if pos in {"CO","BTN"} else THREEBET_SIZE_BB_OOP
                             for sz in grid: add_3bet(sz)
                             prior_key = f"raise@3b{grid[1]:.1f}bb"
-                    elif combo in CALL_VS_OPEN and "call" in legal:
+                    elif CALL_VS_OPEN_BITS >> cid & 1 and "call" in legal:
                         if to_call > 6*game.bb and player.stack < 20*game.bb and "fold" in legal:
                             prior_key = "fold"
                         else:
@@ -602,33 +2313,31 @@ class RangeAI(PolicyBase):
 
         return prior_key, state_key, proposals
 
-    def _state_pre(self, game, player, combo, pos, raised_already, raise_cnt, depth_bb, to_call, ncat):
+    def _state_pre(self, game, player, cid, pos, raised_already, raise_cnt, depth_bb, to_call, ncat):
         pos_grp = "SB" if pos in {"SB","BTN/SB"} else ("BB" if pos=="BB" else ("LATE" if pos in {"CO","BTN"} else "EARLY"))
-        if combo in {"AA","KK","QQ","AKs","AKo"}:
-            hcat = "premium"
-        elif combo in EARLY_OPEN:
-            hcat = "strong"
-        elif combo in LATE_OPEN or combo.endswith("s"):
+        hcat = HAND_CATEGORY[cid]
+        if hcat == "trash" and (preflop_equity_ratio(cid, len(game.in_hand_players())) or 0.0) >= PREFLOP_EQ_SPEC_RATIO:
             hcat = "spec"
-        else:
-            hcat = "trash"
         dcat = "short" if depth_bb <= 15 else ("mid" if depth_bb <= 30 else "deep")
         face = "unopen" if not raised_already else ("multi" if raise_cnt >= 2 else "vs_open")
         tc = "zero" if to_call == 0 else ("small" if to_call <= 4*game.bb else "big")
         return f"P|{pos_grp}|{hcat}|{face}|{dcat}|{tc}|{ncat}"
 
     def postflop_proposals(self, game, player):
-        legal = set(game.legal_actions(player.id))
-        my_bet = game.bet_in_round.get(player.id, 0)
-        to_call = max(0, game.current_max_bet - my_bet)
+        rng = game.rng
+        opts = game.turn_options(player.id)
+        legal = set(opts.legal)
+        my_bet = game.bet_in_round[player.id]
+        to_call = opts.to_call
         pot = max(pot_size(game), game.bb * 2)
-        cards = list(player.hole) + list(game.board)
-        sc, _ = best_of_seven(cards)
-        cls = sc[0]
+        ctx = game.board_ctx
+        cls = ctx.hand_class(player.hole)
         street = game.street
-        fdraw = has_flush_draw(cards) if street in ("FLOP","TURN") else False
-        oesd  = has_4run_oesd(cards)  if street in ("FLOP","TURN") else False
-        gut   = has_gutshot_draw(cards) if street in ("FLOP","TURN") else False
+        if street in ("FLOP","TURN"):
+            dr = ctx.draws(player.hole)
+            fdraw, oesd, gut = dr.flush4, dr.run4, dr.window4
+        else:
+            fdraw = oesd = gut = False
 
         monster   = cls >= 6
         verygood  = cls in (4,5) or (cls == 3)
@@ -643,6 +2352,12 @@ class RangeAI(PolicyBase):
         n_act = len(game.in_hand_players())
         ncat = "N2" if n_act == 2 else ("N3-4" if n_act <= 4 else "N5+")
         state_key = f"{street[0]}|{mc}|{draw}|{rb}|{ncat}"
+        if self.learner.key_format >= 2:
+            state_key += f"|{texture_class(ctx.texture())}"
+        if self.learner.key_format >= 3:
+            bk = ctx.bucket(player.hole)
+            if bk is not None:
+                state_key += f"|B{bk}"
 
         proposals = {}
         if "fold" in legal:  proposals["fold"]  = ("fold", None)
@@ -705,7 +2420,7 @@ class RangeAI(PolicyBase):
                 prior_key = choose_bet_prior(0.75)
         elif verygood:
             if to_call > 0:
-                if "raise" in legal and random.random() < 0.5:
+                if "raise" in legal and rng.random() < 0.5:
                     prior_key = choose_raise_prior("2.5x")
                 elif "call" in proposals:
                     prior_key = "call"
@@ -725,12 +2440,12 @@ class RangeAI(PolicyBase):
             if to_call > 0:
                 if to_call <= 0.25 * pot and "call" in proposals:
                     prior_key = "call"
-                elif "raise" in legal and random.random() < 0.3:
+                elif "raise" in legal and rng.random() < 0.3:
                     prior_key = choose_raise_prior("min")
                 else:
                     prior_key = "fold" if "fold" in proposals else "call"
             else:
-                if "bet" in legal and random.random() < 0.6:
+                if "bet" in legal and rng.random() < 0.6:
                     prior_key = choose_bet_prior(0.50)
                 else:
                     prior_key = "check"
@@ -741,13 +2456,13 @@ class RangeAI(PolicyBase):
                 else:
                     prior_key = "fold" if "fold" in proposals else "call"
             else:
-                if "bet" in legal and random.random() < 0.5:
+                if "bet" in legal and rng.random() < 0.5:
                     prior_key = choose_bet_prior(0.50)
                 else:
                     prior_key = "check"
         else:
             if to_call == 0:
-                if "bet" in legal and random.random() < 0.25:
+                if "bet" in legal and rng.random() < 0.25:
                     prior_key = choose_bet_prior(0.50)
                 else:
                     prior_key = "check"
@@ -756,6 +2471,125 @@ class RangeAI(PolicyBase):
 
         return prior_key, state_key, proposals
 
+# ======== 探索ポリシー（情報集合 MCTS） ========
+class ISMCTSPolicy(PolicyBase):
+    """
+    情報集合モンテカルロ木探索。反復ごとに相手のホールと山を見えていないカードから引き直し（決定化）、
+    ハンドの最後まで打ってから Game.restore で巻き戻す。
+    木のノードはハンド開始からの公開アクション列 (street, by, type, amount) で、同じハンド内の次の判断でも再利用する
+    （額まで含めるので、サイズの違うベット・レイズは別のノードになる）。
+    各ノードでは手番プレイヤー自身の収支（bb 単位、±50bb で打ち切り）で UCB1。
+    乱数は判断ごとに game.rng から 1 回だけ引いた seed の専用 Random を使い、seed 指定の卓では
+    反復回数を seeded_iters に固定する（反復数が時間で揺れても卓の乱数列と結果が変わらない）
+    """
+    def __init__(self, time_budget=SEARCH_TIME_BUDGET, max_iters=5000, c=0.7, seeded_iters=SEARCH_SEEDED_ITERS):
+        self.time_budget = time_budget
+        self.max_iters = max_iters
+        self.seeded_iters = seeded_iters
+        self.c = c
+        self.tree = {}          # 公開アクション列 -> {ラベル: [n, 報酬和]}
+        self.hand_id = None
+        self.iterations = 0     # 直近の判断での反復回数
+
+    @staticmethod
+    def actions(game, player):
+        """探索で使う抽象アクション: ラベル -> (action, target_total)"""
+        opts = game.turn_options(player.id)
+        acts = {a: (a, None) for a in opts.legal if a in ("fold", "check", "call", "allin")}
+        kind = "bet" if "bet" in opts.legal else ("raise" if "raise" in opts.legal else None)
+        if kind:
+            pot = pot_size(game) + opts.to_call
+            for frac in SEARCH_BET_FRACS:
+                tgt = max(opts.min_total, game.current_max_bet + int(pot * frac))
+                if tgt < opts.max_total:
+                    acts[f"{kind}{int(frac * 100)}"] = (kind, tgt)
+        return acts
+
+    def act(self, game, player):
+        if game.hand_id != self.hand_id:
+            self.tree = {}
+            self.hand_id = game.hand_id
+        acts = self.actions(game, player)
+        if len(acts) == 1:
+            return next(iter(acts.values()))
+        root_key = tuple(a[:4] for a in game.public_actions)   # (street, by, type, amount)
+        root_stacks = [p.stack for p in game.players]
+        rng = random.Random(game.rng.getrandbits(64))
+        seeded = game.config.seed is not None
+        snap = game.snapshot()
+        headless, game.headless = game.headless, True
+        deadline = time.perf_counter() + self.time_budget
+        it = 0
+        try:
+            while it < (self.seeded_iters if seeded else self.max_iters) and (
+                    seeded or it == 0 or time.perf_counter() < deadline):
+                self._determinize(game, player, rng)
+                self._simulate(game, root_key, root_stacks, rng)
+                game.restore(snap)
+                it += 1
+        finally:
+            game.restore(snap)
+            game.headless = headless
+        self.iterations = it
+        root = self.tree.get(root_key, {})
+        best = max(acts, key=lambda l: root[l][0] if l in root else 0)
+        return acts[best]
+
+    @staticmethod
+    def _determinize(game, me, rng):
+        known = set(me.hole) | set(game.board)
+        unseen = [c for c in range(52) if c not in known]
+        rng.shuffle(unseen)
+        i = 0
+        for pid in game.preflop_participants:
+            if pid != me.id:
+                game.players[pid - 1].hole = unseen[i:i + 2]
+                i += 2
+        game.deck = unseen[i:]
+        game.hand_strengths = None
+
+    def _select(self, node, acts, rng):
+        fresh = [l for l in acts if l not in node]
+        if fresh:
+            l = rng.choice(fresh)
+            node[l] = [0, 0.0]
+            return l
+        log_t = math.log(sum(node[l][0] for l in acts))
+        c = self.c
+        return max(acts, key=lambda l: node[l][1] / node[l][0] + c * math.sqrt(log_t / node[l][0]))
+
+    def _simulate(self, game, key, root_stacks, rng):
+        """決定化した状態からハンドの最後まで木に沿って打ち、通ったノードに報酬を積む"""
+        path = []
+        while True:
+            steps = game.betting_round()
+            p = next(steps, None)
+            while p is not None:
+                node = self.tree.setdefault(key, {})
+                acts = self.actions(game, p)
+                label = self._select(node, acts, rng)
+                path.append((node, label, p.seat_index))
+                try:
+                    p = steps.send(acts[label])
+                except StopIteration:
+                    p = None
+                key += (game.public_actions[-1][:4],)
+            if len(game.table.in_hand) == 1:
+                game.award_single()
+                break
+            if game.action_closed():
+                game.run_out_board()
+            if game.street == "RIVER":
+                game.showdown_and_award()
+                break
+            game.deal_next_street()
+        bb = max(1, game.bb)
+        stacks = game.table.stack
+        for node, label, seat in path:
+            st = node[label]
+            st[0] += 1
+            st[1] += max(-50.0, min(50.0, (stacks[seat] - root_stacks[seat]) / bb)) / 50.0
+
 # ======== 統計（CSV 出力管理） ========
 class StatsManager:
     def __init__(self, base_dir, run_ts):
@@ -765,13 +2599,12 @@ class StatsManager:
         self.cumu_dir = os.path.join(self.base_dir, "cumulative")
         self.player_no_run = os.path.join(self.run_dir, "player_no")
         self.player_no_cumu = os.path.join(self.base_dir, "player_no")
-        for d in [self.run_dir, self.cumu_dir, self.player_no_run, self.player_no_cumu]:
-            os.makedirs(d, exist_ok=True)
         self.data = {
             "winner": defaultdict(lambda: {"w":0,"t":0,"l":0,"total":0}),
             "all_dealt": defaultdict(lambda: {"w":0,"t":0,"l":0,"total":0}),
             "flop_players": defaultdict(lambda: {"w":0,"t":0,"l":0,"total":0}),
         }
+        self.by_texture = defaultdict(lambda: defaultdict(lambda: {"w":0,"t":0,"l":0,"total":0}))
         self.by_n = {
             "winner": defaultdict(lambda: defaultdict(lambda: {"w":0,"t":0,"l":0,"total":0})),
             "all_dealt": defaultdict(lambda: defaultdict(lambda: {"w":0,"t":0,"l":0,"total":0})),
@@ -790,11 +2623,38 @@ class StatsManager:
             return
         outcome_dict["total"] += 1
 
-    def add(self, category, combo, n_players, outcome):
-        d = self.data[category][combo]
+    def add(self, category, cid, n_players, outcome, texture=None):
+        """cid はコンボ番号（combo_id）。文字列化は CSV 書き出し時のみ"""
+        d = self.data[category][cid]
         self._apply(d, outcome)
-        dn = self.by_n[category][n_players][combo]
+        dn = self.by_n[category][n_players][cid]
         self._apply(dn, outcome)
+        if texture is not None:
+            self._apply(self.by_texture[texture][cid], outcome)
+
+    # --- プロセス間の受け渡し（並列学習） ---
+    def export(self):
+        """集計をただの dict にする（pickle 可能）"""
+        plain = lambda m: {cid: dict(rec) for cid, rec in m.items()}
+        return {
+            "data": {cat: plain(m) for cat, m in self.data.items()},
+            "by_n": {cat: {n: plain(m) for n, m in nm.items()} for cat, nm in self.by_n.items()},
+            "by_texture": {tex: plain(m) for tex, m in self.by_texture.items()},
+        }
+
+    def merge(self, exported):
+        def add(dst, src):
+            for cid, rec in src.items():
+                d = dst[cid]
+                for f in ("w", "t", "l", "total"):
+                    d[f] += rec[f]
+        for cat, m in exported["data"].items():
+            add(self.data[cat], m)
+        for cat, nm in exported["by_n"].items():
+            for n, m in nm.items():
+                add(self.by_n[cat][n], m)
+        for tex, m in exported["by_texture"].items():
+            add(self.by_texture[tex], m)
 
     # --- CSV I/O ---
     def _merge_existing_csv(self, path, new_map):
@@ -808,27 +2668,32 @@ class StatsManager:
                     parts = line.strip().split(",")
                     if len(parts) < 6: 
                         continue
-                    combo = parts[0]
+                    cid = COMBO_INDEX.get(parts[0])
+                    if cid is None:
+                        continue
                     w,t,l,total = map(int, parts[1:5])
-                    if combo not in merged:
-                        merged[combo] = {"w":0,"t":0,"l":0,"total":0}
-                    merged[combo]["w"] += w
-                    merged[combo]["t"] += t
-                    merged[combo]["l"] += l
-                    merged[combo]["total"] += total
+                    if cid not in merged:
+                        merged[cid] = {"w":0,"t":0,"l":0,"total":0}
+                    merged[cid]["w"] += w
+                    merged[cid]["t"] += t
+                    merged[cid]["l"] += l
+                    merged[cid]["total"] += total
         except Exception:
             pass
         return merged
 
     @staticmethod
-    def _write_csv(path, mapping):
+    def _write_csv(path, mapping, n_players=None):
+        # 人数別ファイルはプリフロップ・エクイティ表（あれば）の真値を列として併記
+        with_eq = n_players is not None and bool(_preflop_equity_table())
         with open(path, "w", encoding="utf-8") as f:
-            f.write("combo,wins,ties,losses,total,win_rate\n")
-            for combo in sorted(mapping.keys()):
-                rec = mapping[combo]
+            f.write("combo,wins,ties,losses,total,win_rate" + (",table_equity\n" if with_eq else "\n"))
+            for cid in sorted(mapping.keys(), key=COMBO_LABELS.__getitem__):
+                rec = mapping[cid]
                 total = max(1, rec["total"])
                 wr = (rec["w"] + 0.5*rec["t"]) / total
-                f.write(f"{combo},{rec['w']},{rec['t']},{rec['l']},{rec['total']},{wr:.6f}\n")
+                eq = f",{preflop_equity(cid, n_players):.6f}" if with_eq else ""
+                f.write(f"{COMBO_LABELS[cid]},{rec['w']},{rec['t']},{rec['l']},{rec['total']},{wr:.6f}{eq}\n")
 
     def _dump_category(self, cat_name):
         # 実行ごと
@@ -849,124 +2714,227 @@ class StatsManager:
             os.makedirs(d_cumu, exist_ok=True)
             run_n = os.path.join(d_run, f"N{n}.csv")
             cumu_n = os.path.join(d_cumu, f"N{n}.csv")
-            self._write_csv(run_n, cmap)
+            self._write_csv(run_n, cmap, n)
             merged_n = self._merge_existing_csv(cumu_n, cmap)
-            self._write_csv(cumu_n, merged_n)
+            self._write_csv(cumu_n, merged_n, n)
+
+    def _dump_textures(self):
+        # フロップ・テクスチャ別（flop_players の内訳）
+        d_run = os.path.join(self.run_dir, "flop_texture")
+        d_cumu = os.path.join(self.base_dir, "flop_texture")
+        os.makedirs(d_run, exist_ok=True)
+        os.makedirs(d_cumu, exist_ok=True)
+        for name, cmap in self.by_texture.items():
+            self._write_csv(os.path.join(d_run, f"{name}.csv"), cmap)
+            cumu = os.path.join(d_cumu, f"{name}.csv")
+            self._write_csv(cumu, self._merge_existing_csv(cumu, cmap))
 
     def finalize(self):
+        for d in [self.run_dir, self.cumu_dir, self.player_no_run, self.player_no_cumu]:
+            os.makedirs(d, exist_ok=True)
         for cat in ["winner","all_dealt","flop_players"]:
             self._dump_category(cat)
+        self._dump_textures()
 
 # ======== ゲーム ========
+class GameConfig:
+    """
+    1 卓ぶんの設定と出力先。未指定の項目は生成した時点のモジュール設定値（NUM_PLAYERS, ROUNDS, VERBOSE など）。
+    seed を指定するとその卓の乱数（配牌・persona・初期ポリシー選択・Learner の探索・RangeAI の揺らぎ）が再現できる。
+    persist=False の卓はディスクに何も書かない（headless 扱い。初期ポリシーの読み込みだけは行い、Learner はメモリ上だけ）
+    """
+    def __init__(self, num_players=None, starting_stack=None, sb=None, bb=None, max_rebuys=None,
+                 human_ids=None, search_ids=None, headless=None, rounds=None, verbose=None,
+                 run_ts=None, log_dir=None, postai_dir=None, seed=None, persist=True):
+        self.num_players = NUM_PLAYERS if num_players is None else num_players
+        self.starting_stack = STARTING_STACK if starting_stack is None else starting_stack
+        self.sb = SB if sb is None else sb
+        self.bb = BB if bb is None else bb
+        self.max_rebuys = MAX_REBUYS if max_rebuys is None else max_rebuys
+        self.human_ids = set(HUMAN_IDS if human_ids is None else human_ids)
+        self.search_ids = set(SEARCH_IDS if search_ids is None else search_ids)
+        self.headless = HEADLESS if headless is None else headless
+        self.rounds = ROUNDS if rounds is None else rounds
+        self.verbose = VERBOSE if verbose is None else verbose
+        self.run_ts = RUN_TS if run_ts is None else run_ts
+        self.log_dir = LOG_DIR if log_dir is None else log_dir
+        self.postai_dir = POSTAI_DIR if postai_dir is None else postai_dir
+        self.seed = seed
+        self.persist = persist
+
+    def replace(self, **changes):
+        """changes（None は無視）だけ差し替えたコピー"""
+        cfg = GameConfig.__new__(GameConfig)
+        cfg.__dict__.update(self.__dict__)
+        for k, v in changes.items():
+            if v is not None:
+                if not hasattr(cfg, k):
+                    raise TypeError(f"unknown GameConfig field: {k}")
+                setattr(cfg, k, set(v) if k in ("human_ids", "search_ids") else v)
+        return cfg
+
+    def log_path(self, path):
+        """LOG_DIR 基準の既定パス（ALL_LOG など）をこの設定の log_dir に置き換える"""
+        return os.path.join(self.log_dir, os.path.basename(path))
+
+    def postai_path(self, path):
+        return os.path.join(self.postai_dir, os.path.basename(path))
+
+NEXT_STREET = {"PREFLOP": ("FLOP", 3), "FLOP": ("TURN", 1), "TURN": ("RIVER", 1)}
+
+# ハンド途中の状態のコピー（Game.snapshot / restore）。ログ・ファイル・学習・統計は含まない
+GameSnapshot = namedtuple("GameSnapshot", [
+    "table", "pot", "holes", "deck", "board", "street", "current_max_bet", "last_raise_size",
+    "last_raiser_seat", "actor_seat", "to_act", "turn", "event_no", "hand_had_allin",
+    "hand_awards", "hand_strengths", "public_actions", "n_traces", "first_action", "vpip",
+    "flop_participants",
+])
+
+# 1 ハンドの結果（Game.simulate / simulate が yield する）。
+# deltas: {pid: スタック増減}、winners: ポットごとの勝者 pid のタプル（メインポットから順）、
+# end_street: 決着したストリート、allin: オールインがあったか、decisions: そのハンドの判断（Decision のリスト）
+HandResult = namedtuple("HandResult", "hand_id deltas winners end_street allin decisions")
+
 class Game:
-    def __init__(self, num_players=NUM_PLAYERS, starting_stack=STARTING_STACK, sb=SB, bb=BB,
-                 human_ids=HUMAN_IDS, max_rebuys=MAX_REBUYS):
+    """
+    1 卓。設定・出力先・乱数はすべてこのインスタンスが持つ（config / self.rng）ので、複数の卓を同じプロセスで同時に動かせる。
+    個別の引数は config（省略時は既定の GameConfig）の該当項目を上書きする
+    """
+    def __init__(self, num_players=None, starting_stack=None, sb=None, bb=None,
+                 human_ids=None, max_rebuys=None, headless=None,
+                 learners=None, stats=None, search_ids=None, config=None):
+        cfg = (config or GameConfig()).replace(
+            num_players=num_players, starting_stack=starting_stack, sb=sb, bb=bb, human_ids=human_ids,
+            max_rebuys=max_rebuys, headless=headless, search_ids=search_ids)
+        num_players, starting_stack, max_rebuys = cfg.num_players, cfg.starting_stack, cfg.max_rebuys
+        human_ids, search_ids = cfg.human_ids, cfg.search_ids
+        headless = cfg.headless or not cfg.persist
         assert 2 <= num_players <= 10
-        self.sb, self.bb = sb, bb
+        if headless and human_ids:
+            raise ValueError("headless / persist=False tables cannot have human players (human_ids)")
+        self.config = cfg
+        self.rng = random.Random(cfg.seed)   # この卓専用の乱数（seed=None なら OS の乱数で初期化）
+        self.headless = headless      # 学習・統計・ポリシー保存のみ（人間プレイヤーとは併用できない）
+        self.verbose = cfg.verbose
+        self.learning_sink = None     # list を入れると学習更新を溜めるだけにする（並列学習のワーカーがまとめて反映）
+        self.sb, self.bb = cfg.sb, cfg.bb
         self.starting_stack = starting_stack
         self.max_rebuys = max_rebuys
-        self.run_ts = RUN_TS
+        self.run_ts = cfg.run_ts
+        if cfg.persist:
+            os.makedirs(cfg.log_dir, exist_ok=True)
+            os.makedirs(cfg.postai_dir, exist_ok=True)
 
         # ブラインドレベル準備
         total_chips = starting_stack * (max_rebuys + 1) * num_players
         self.level_bbs = compute_level_bbs(total_chips)  # L1..L10 の BB
-        self.level_step = max(1, ROUNDS // 10)
+        self.level_step = max(1, cfg.rounds // 10)
 
-        # プレイヤーと persona
+        # プレイヤーと persona（状態の実体は座席順配列の TableState）
+        self.table = TableState(num_players)
         self.players = []
         for i in range(num_players):
             pid = i + 1
             persona = self._random_persona()
-            self.players.append(Player(pid, f"Player{pid}", i, starting_stack, persona=persona))
+            self.players.append(Player(pid, f"Player{pid}", i, starting_stack, persona=persona, table=self.table))
+        self.by_id = {p.id: p for p in self.players}
 
         # 累積No 管理
         self.player_initial_no = {}   # {pid: 初期No}
         self.player_alive_hands = {}  # {pid: 今回の加算分（生存していたハンド数）}
 
-        # プレイヤーごとの Learner を構築（初期ロード）
+        # プレイヤーごとの Learner を構築（初期ロード）。learners を渡すと他の卓と共有する
         self.learners = {}
         for p in self.players:
+            if learners is not None:
+                learner = self.learners[p.id] = learners[p.id]
+                p.persona = learner.persona or p.persona
+                self.player_initial_no[p.id] = int(learner.meta.get("initial_no", 0))
+                self.player_alive_hands[p.id] = 0
+                continue
             p2 = f"{p.id:02d}"
-            latest_path = os.path.join(POSTAI_DIR, f"policy_memory_latest_p{p2}.json")
+            latest_path = os.path.join(cfg.postai_dir, f"policy_memory_latest_p{p2}.json") if cfg.persist else None
             source_path = self._choose_initial_policy_path(p.id)
             initial_no = infer_initial_no_from_source(source_path)
             self.player_initial_no[p.id] = initial_no
             self.player_alive_hands[p.id] = 0
             self.learners[p.id] = Learner(player_id=p.id, latest_path=latest_path,
                                           run_ts=self.run_ts, persona=p.persona,
-                                          source_path=source_path, initial_no=initial_no)
+                                          source_path=source_path, initial_no=initial_no,
+                                          rng=random.Random(self.rng.getrandbits(64)))
 
-        # ポリシー（RangeAI or Human）
+        # ポリシー（RangeAI / Human / 探索）
         self.policies = {
-            p.id: (HumanConsole() if p.id in human_ids else RangeAI(self.learners[p.id]))
+            p.id: (HumanConsole() if p.id in human_ids else
+                   ISMCTSPolicy() if p.id in search_ids else RangeAI(self.learners[p.id]))
             for p in self.players
         }
 
         self.button_index = 0
+        self._geo = None              # 座席配置のキャッシュ（淘汰かボタン移動でキーが変わったときだけ引き直す）
+        self._geo_mask = self._geo_button = None
         self.deck = []
         self.board = []
+        self.board_ctx = BoardContext()   # ボード集計（全員共有・増分更新）
         self.hand_id = 0
         self.hands_played = 0
         self.event_no = 0
         self.street = "INIT"
-        self.bet_in_round = {}
-        self.committed_total = {}
+        self.bet_in_round = SeatValues(self.table.bet, self.table.seat_of)        # pid -> ラウンド内ベット
+        self.committed_total = SeatValues(self.table.committed, self.table.seat_of)  # pid -> ハンド内投入額
+        self.pot = PotLedger(self.table)   # 投入のたびに更新されるサイドポット
         self.current_max_bet = 0
-        self.last_raise_size = bb
+        self.last_raise_size = self.bb
+        self.to_act = set()     # このラウンドでまだ行動が必要な pid（空になったらラウンド終了）
+        self.turn = None        # 手番中プレイヤーの TurnOptions
         self.last_raiser_seat = None
         self.public_actions = deque(maxlen=400)
 
-        # JSONログ
-        self.logs = {p.id: open(os.path.join(LOG_DIR, f"player_{p.id}.jsonl"), "a", encoding="utf-8")
-                     for p in self.players}
-        self.training_log = open(TRAINING_LOG_PATH, "a", encoding="utf-8")
-
-        # テキストログ
-        self.text_logs = {
-            "all": open(ALL_LOG, "a", encoding="utf-8"),
-            "end_preflop": open(END_PREFLOP_LOG, "a", encoding="utf-8"),
-            "end_flop": open(END_FLOP_LOG, "a", encoding="utf-8"),
-            "end_turn": open(END_TURN_LOG, "a", encoding="utf-8"),
-            "end_river": open(END_RIVER_LOG, "a", encoding="utf-8"),
-            "allin": open(ALLIN_LOG, "a", encoding="utf-8"),
-        }
+        # 出力先（HandSink）。ファイルは sink が最初に書くときに開く。run() は default_sinks() を付ける
+        self.sinks = []
 
         # 実行時統計
-        self.stats = StatsManager(LOG_DIR, self.run_ts)
+        self.stats = stats if stats is not None else StatsManager(cfg.log_dir, self.run_ts)
 
         # 一時
         self.hand_lines = []
         self.hand_all_ai = False
         self.hand_end_stage = None
         self.hand_had_allin = False
+        self.allin_equity_line = None
+        self.runout_equity = None     # {pid: エクイティ} オールインで手番が閉じた時点（ALLIN_RUNOUT_EQUITY）
         self.preflop_participants = []
         self.flop_participants = []
         self.stack_before = {}
         self.learning_traces = []
         self.first_action = {}  # {pid: 最初の判断（blind除く）}
         self.vpip = defaultdict(bool)  # {pid: 一度でも call/bet/raise/allin したか}
-        self.hand_pot_winners = []  # [[pid,...], ...] 各ポットの勝者一覧（実プレイ）
+        self.hand_awards = []       # [PotAward, ...] 各ポットの配分（実プレイ）
+        self.hand_strengths = None  # {pid: 強さ} ハンド終了時に 1 回だけ一括評価
+        self.last_result = None     # 直前のハンドの HandResult
 
         # 実行開始時に persona 一覧を出力
-        self._print_personas()
+        if not headless:
+            self._print_personas()
 
     # ---- 初期ポリシー選択 ----
     def _choose_initial_policy_path(self, pid):
         p2 = f"{pid:02d}"
         # Player1 は前回勝者を最優先
-        if pid == 1 and os.path.exists(WINNER_POLICY_PATH):
-            return WINNER_POLICY_PATH
-        cands = list_policy_files_for_player(p2)
+        winner_path = self.config.postai_path(WINNER_POLICY_PATH)
+        if pid == 1 and os.path.exists(winner_path):
+            return winner_path
+        cands = list_policy_files_for_player(p2, self.config.postai_dir)
         if cands:
-            return random.choice(cands)
+            return self.rng.choice(cands)
         return None
 
     # ---- persona ----
     def _random_persona(self):
         styles = ["agg","bal","con"]
-        size_pref = random.choices(["small","bal","big"], weights=[2,5,3])[0]
-        style = random.choices(styles, weights=[3,5,2])[0]
-        bluff = {"agg":0.65,"bal":0.5,"con":0.35}[style] + random.uniform(-0.05,0.05)
+        size_pref = self.rng.choices(["small","bal","big"], weights=[2,5,3])[0]
+        style = self.rng.choices(styles, weights=[3,5,2])[0]
+        bluff = {"agg":0.65,"bal":0.5,"con":0.35}[style] + self.rng.uniform(-0.05,0.05)
         return {"style":style, "bluff":max(0,min(1,bluff)), "size_pref":size_pref}
 
     def _print_personas(self):
@@ -977,91 +2945,66 @@ class Game:
 
     # ---- 出力・学習ログ ----
     def out(self, msg):
-        if VERBOSE:
+        if self.headless:
+            return
+        if self.verbose:
             print(msg)
         self.hand_lines.append(msg)
-
-    def training_write(self, payload: dict):
-        if self.training_log:
-            self.training_log.write(json.dumps(payload, ensure_ascii=False) + "\n")
-            try: self.training_log.flush()
-            except: pass
+        for sink in self.sinks:
+            sink.line(self, msg)
 
     def record_decision(self, pid, state_key, option_key):
-        self.learning_traces.append({"pid": pid, "state": state_key, "option": option_key})
+        self.learning_traces.append(Decision(pid, state_key, option_key))
 
     # ---- 基本ユーティリティ ----
     def is_human_player(self, pid):
         return isinstance(self.policies[pid], HumanConsole)
 
+    # 以下の 3 つは TableState のキャッシュ済みリスト（呼び出し側で変更しないこと）
     def alive_players(self):
-        return [p for p in self.players if not p.is_eliminated]
+        return self.table.players_of("alive")
 
     def in_hand_players(self):
-        return [p for p in self.alive_players() if not p.is_folded]
+        return self.table.players_of("in_hand")
 
     def active_for_action(self):
-        return [p for p in self.in_hand_players() if not p.is_allin]
+        return self.table.players_of("active")
+
+    def geometry(self):
+        """現在の生存座席とボタンに対する TableGeometry（キャッシュ。呼び出し側で変更しないこと）"""
+        t = self.table
+        if self._geo_mask != t.alive_mask or self._geo_button != self.button_index:
+            self._geo = table_geometry(t.n, t.alive_mask, self.button_index)
+            self._geo_mask, self._geo_button = t.alive_mask, self.button_index
+        return self._geo
 
     def seat_after(self, seat_idx):
-        n = len(self.players)
-        j = (seat_idx + 1) % n
-        while self.players[j].is_eliminated:
-            j = (j + 1) % n
-        return j
+        return self.geometry().next_seat[seat_idx]
+
+    def _first_active(self, order):
+        table = self.table
+        for s in order:
+            if not (table.eliminated[s] or table.folded[s] or table.allin[s]):
+                return s
+        return None
 
     def first_left_of_button(self):
-        j = self.seat_after(self.button_index)
-        start = j
-        while True:
-            p = self.players[j]
-            if (not p.is_eliminated) and (not p.is_folded) and (not p.is_allin):
-                return j
-            j = self.seat_after(j)
-            if j == start:
-                return None
+        return self._first_active(self.geometry().postflop_order)
 
     def find_blinds(self):
-        sb_seat = self.seat_after(self.button_index)
-        bb_seat = self.seat_after(sb_seat)
-        return sb_seat, bb_seat
+        geo = self.geometry()
+        return geo.sb_seat, geo.bb_seat
 
-    def preflop_first_actor_seat(self, sb_seat, bb_seat):
-        alive = [p for p in self.players if not p.is_eliminated]
-        if len(alive) == 2:
-            p = self.players[sb_seat]
-            return None if (p.is_folded or p.is_allin) else sb_seat
-        j = self.seat_after(bb_seat)
-        start = j
-        while True:
-            p = self.players[j]
-            if (not p.is_eliminated) and (not p.is_folded) and (not p.is_allin):
-                return j
-            j = self.seat_after(j)
-            if j == start:
-                return None
+    def preflop_first_actor_seat(self):
+        geo = self.geometry()
+        if len(self.table.alive) == 2:
+            p = self.players[geo.sb_seat]
+            return None if (p.is_folded or p.is_allin) else geo.sb_seat
+        return self._first_active(geo.preflop_order)
 
     def get_position_label_map(self):
-        alive_seats = [p.seat_index for p in self.alive_players()]
-        n = len(alive_seats)
-        labels = preflop_positions_for_n(n)
-        sb_seat, bb_seat = self.find_blinds()
-        order = []
-        if n == 2:
-            order = [self.players[sb_seat].seat_index, self.players[bb_seat].seat_index]
-        else:
-            j = self.seat_after(bb_seat)
-            cnt = 0
-            while cnt < n - 3:
-                order.append(self.players[j].seat_index)
-                j = self.seat_after(j); cnt += 1
-            order += [self.players[self.button_index].seat_index,
-                      self.players[sb_seat].seat_index,
-                      self.players[bb_seat].seat_index]
-        pos_map = {}
-        for seat, label in zip(order, labels):
-            pos_map[seat] = label
-        return pos_map
+        """座席 -> ポジション名（キャッシュした dict。呼び出し側で変更しないこと）"""
+        return self.geometry().positions
 
     # ---- レベル関連 ----
     def current_level(self):
@@ -1074,14 +3017,28 @@ class Game:
 
     # ---- ルール/ログ ----
     def legal_actions(self, pid):
-        p = next(pp for pp in self.players if pp.id == pid)
-        if p.is_folded or p.is_allin or p.is_eliminated:
-            return []
-        my_bet = self.bet_in_round.get(pid, 0)
+        return list(self.turn_options(pid).legal)
+
+    def turn_options(self, pid):
+        """手番中のプレイヤーならキャッシュ済みの TurnOptions、それ以外はその場で計算"""
+        t = self.turn
+        if t is not None and t.pid == pid:
+            return t
+        return self._turn_options(pid)
+
+    def _turn_options(self, pid):
+        p = self.by_id[pid]
+        my_bet = self.bet_in_round[pid]
         to_call = max(0, self.current_max_bet - my_bet)
+        if self.current_max_bet == 0:
+            min_total = max(self.bb, 1)
+        else:
+            min_total = self.current_max_bet + self.last_raise_size
+        if p.seat_index not in self.table.active:
+            return TurnOptions(pid, (), to_call, min_total, my_bet)
         legal = set()
         # 非オールインのアクティブ人数
-        actives_non_allin = len(self.active_for_action())
+        actives_non_allin = len(self.table.active)
         no_bet_raise = (actives_non_allin <= 1)
 
         if to_call == 0:
@@ -1095,13 +3052,12 @@ class Game:
             legal.add("fold")
             if p.stack > 0:
                 legal.add("call"); legal.add("allin")
-                min_total = max(self.current_max_bet + self.last_raise_size, my_bet + self.bb)
-                if (not no_bet_raise) and (p.stack + my_bet >= min_total):
+                if (not no_bet_raise) and (p.stack + my_bet >= max(min_total, my_bet + self.bb)):
                     legal.add("raise")
-        return sorted(list(legal))
+        return TurnOptions(pid, tuple(sorted(legal)), to_call, min_total, my_bet + p.stack)
 
     def snapshot_for_observer(self, observer_id, acting_id, action_dict):
-        obs = next(p for p in self.players if p.id == observer_id)
+        obs = self.by_id[observer_id]
         visible_players = self.alive_players()
         pos_map = self.get_position_label_map() if self.street in ("PREFLOP", "FLOP", "TURN", "RIVER") else {}
         snap = {
@@ -1116,30 +3072,28 @@ class Game:
             "stacks": {p.id: p.stack for p in visible_players},
             "bets_in_round": {p.id: self.bet_in_round.get(p.id, 0) for p in visible_players},
             "committed_total": {p.id: self.committed_total.get(p.id, 0) for p in visible_players},
-            "pot_total": sum(p["amount"] for p in getattr(self, "pots", [])) if hasattr(self, "pots") else 0,
-            "pots_detail": [{"amount": p["amount"], "eligible": list(p["eligible"])} for p in getattr(self, "pots", [])],
+            "pot_total": self.pot.total(),
+            "pots_detail": [{"amount": p["amount"], "eligible": sorted(p["eligible"])} for p in self.pot.pots()],
             "to_call_observer": max(0, self.current_max_bet - self.bet_in_round.get(observer_id, 0)),
             "min_raise_size": self.last_raise_size,
             "legal_actions_observer": self.legal_actions(observer_id),
             "action_taken": {"by": acting_id, **action_dict} if action_dict else None,
             "rebuy_used": {p.id: p.rebuy_used for p in self.players},
             "busts_remaining": {p.id: max(0, self.max_rebuys - p.rebuy_used) for p in self.players},
-            "public_action_history": list(self.public_actions)[-12:],
+            "public_action_history": action_history(self.public_actions, 12),
         }
         return snap
 
     def log_event(self, acting_id, action_dict):
-        for p in self.players:
-            if p.is_eliminated:
-                continue
-            row = self.snapshot_for_observer(p.id, acting_id, action_dict)
-            self.logs[p.id].write(json.dumps(row, ensure_ascii=False) + "\n")
-        for f in self.logs.values():
-            try: f.flush()
-            except: pass
+        if self.headless:
+            return
+        for sink in self.sinks:
+            sink.event(self, acting_id, action_dict)
 
     # ---- CUI ----
     def show_street_header(self):
+        if self.headless:
+            return
         if self.street == "PREFLOP":
             lv = self.current_level()
             self.out(f"[H{self.hand_id}] PREFLOP  (BTN seat={self.button_index})  [Level {lv}  SB={self.sb} BB={self.bb}]")
@@ -1148,6 +3102,8 @@ class Game:
             self.out(f"[H{self.hand_id}] {self.street}  Board: {b}")
 
     def echo_action(self, player, info):
+        if self.headless:
+            return
         pot_now = sum(self.committed_total.values())
         amt = info.get("amount", "")
         if amt == 0: amt = ""
@@ -1164,33 +3120,38 @@ class Game:
         self.hand_all_ai = all(not self.is_human_player(p.id) for p in self.alive_players())
         self.hand_end_stage = None
         self.hand_had_allin = False
+        self.allin_equity_line = None
+        self.runout_equity = None
         self.preflop_participants = []
         self.flop_participants = []
-        self.stack_before = {p.id: p.stack for p in self.players}
         self.learning_traces = []
         self.first_action.clear()
         self.vpip.clear()
-        self.hand_pot_winners = []
+        self.hand_awards = []
+        self.hand_strengths = None
 
         # リバイ／淘汰
         for p in self.players:
             if p.is_eliminated: continue
             if p.stack <= 0:
                 if p.rebuy_used < self.max_rebuys:
-                    p.stack = STARTING_STACK
+                    p.stack = self.starting_stack
                     p.rebuy_used += 1
                 else:
                     p.is_eliminated = True
+        self.stack_before = {p.id: p.stack for p in self.players}   # リバイ後（収支にリバイ額を含めない）
         if len(self.alive_players()) < 2:
             return False
 
         self.hand_id += 1
         self.event_no = 0
         self.street = "PREFLOP"
-        self.deck = make_deck()
+        self.deck = make_deck(self.rng)
         self.board = []
-        self.bet_in_round = {p.id: 0 for p in self.alive_players()}
-        self.committed_total = {p.id: 0 for p in self.alive_players()}
+        self.board_ctx.reset()
+        self.bet_in_round.clear_values()
+        self.committed_total.clear_values()
+        self.pot.reset()
         self.current_max_bet = 0
         self.last_raise_size = self.bb
         self.last_raiser_seat = None
@@ -1212,78 +3173,150 @@ class Game:
         self.post_blind(self.players[bb_seat], self.bb)
         self.current_max_bet = max(self.bet_in_round.values())
 
-        self.actor_seat = self.preflop_first_actor_seat(sb_seat, bb_seat)
-        self.has_acted = {p.id: False for p in self.active_for_action()}
+        self.actor_seat = self.preflop_first_actor_seat()
+        self.to_act = {p.id for p in self.active_for_action()}
 
-        self.out("=" * 12 + f" HAND {self.hand_id} START " + "=" * 12)
+        if not self.headless:
+            self.out("=" * 12 + f" HAND {self.hand_id} START " + "=" * 12)
         self.show_street_header()
         return True
 
-    def post_blind(self, player, amount):
+    # ---- 状態のコピー / 巻き戻し（探索用。ハンドの途中でのみ有効） ----
+    def snapshot(self):
+        """ハンド途中の状態をコピーする。restore で何度でも巻き戻せる（ログ・学習・統計には触れない）"""
+        return GameSnapshot(
+            self.table.snapshot(), self.pot.snapshot(), [p.hole for p in self.players],
+            self.deck[:], self.board[:], self.street, self.current_max_bet, self.last_raise_size,
+            self.last_raiser_seat, self.actor_seat, set(self.to_act), self.turn, self.event_no,
+            self.hand_had_allin, list(self.hand_awards), self.hand_strengths,
+            self.public_actions.copy(), len(self.learning_traces), dict(self.first_action),
+            self.vpip.copy(), list(self.flop_participants),
+        )
+
+    def restore(self, snap):
+        self.table.restore(snap.table)
+        self.pot.restore(snap.pot)
+        for p, hole in zip(self.players, snap.holes):
+            p.hole = hole
+        self.deck = snap.deck[:]
+        self.board = snap.board[:]
+        if self.board_ctx.cards != self.board:
+            self.board_ctx.reset()
+            for c in self.board:
+                self.board_ctx.add(c)
+        self.street = snap.street
+        self.current_max_bet = snap.current_max_bet
+        self.last_raise_size = snap.last_raise_size
+        self.last_raiser_seat = snap.last_raiser_seat
+        self.actor_seat = snap.actor_seat
+        self.to_act = set(snap.to_act)
+        self.turn = snap.turn
+        self.event_no = snap.event_no
+        self.hand_had_allin = snap.hand_had_allin
+        self.hand_awards = list(snap.hand_awards)
+        self.hand_strengths = snap.hand_strengths
+        self.public_actions = snap.public_actions.copy()
+        del self.learning_traces[snap.n_traces:]
+        self.first_action = dict(snap.first_action)
+        self.vpip = snap.vpip.copy()
+        self.flop_participants = list(snap.flop_participants)
+
+    def commit_chips(self, player, amount):
+        """スタックから最大 amount を投入し、ラウンド内ベット・投入額・ポット台帳を更新。実際の投入額を返す"""
         pay = min(amount, player.stack)
-        player.stack -= pay
-        self.bet_in_round[player.id] = self.bet_in_round.get(player.id, 0) + pay
-        self.committed_total[player.id] = self.committed_total.get(player.id, 0) + pay
-        if player.stack == 0:
+        s = player.seat_index
+        t = self.table
+        before = t.committed[s]
+        t.stack[s] -= pay
+        t.bet[s] += pay
+        t.committed[s] = before + pay
+        self.pot.add(player.id, before, before + pay)
+        if t.stack[s] == 0:
             player.is_allin = True
             self.hand_had_allin = True
-        self.public_actions.append({"street": "PREFLOP", "by": player.id, "type": "blind", "amount": pay})
-        self.out(f"[H{self.hand_id} PREFLOP] {player.name} posts blind {pay}  (stack {player.stack})")
+            self.pot.cap(before + pay)
+        return pay
+
+    def post_blind(self, player, amount):
+        pay = self.commit_chips(player, amount)
+        self.public_actions.append(PublicAction(ST_PREFLOP, player.id, A_BLIND, pay, None))
+        if not self.headless:
+            self.out(f"[H{self.hand_id} PREFLOP] {player.name} posts blind {pay}  (stack {player.stack})")
 
     def reveal_board(self, n):
         for _ in range(n):
-            self.board.append(self.deck.pop())
+            c = self.deck.pop()
+            self.board.append(c)
+            self.board_ctx.add(c)
+
+    def action_closed(self):
+        """
+        2 人以上残っていて、行動できるのが 1 人以下で、その 1 人も最大ベットに揃っている（以降はチェックのみ）。
+        HU で SB がブラインドでオールインした場合など、手番が回らずに to_act が残っていても閉じている
+        """
+        t = self.table
+        if len(t.in_hand) < 2 or len(t.active) > 1:
+            return False
+        return not self.to_act or all(t.bet[s] >= self.current_max_bet for s in t.active)
+
+    def run_out_board(self):
+        """残りのボードを一度に配ってリバーへ（ヘッダ表示は 1 回だけ）"""
+        if self.street == "PREFLOP":
+            self.flop_participants = [p.id for p in self.in_hand_players()]
+        self.street = "RIVER"
+        self.reveal_board(5 - len(self.board))
+        self.show_street_header()
+
+    def deal_next_street(self):
+        """次のストリートへ: ボードを配ってラウンド状態をリセット"""
+        self.street, n = NEXT_STREET[self.street]
+        self.reveal_board(n)
+        self.show_street_header()
+        if self.street == "FLOP":
+            self.flop_participants = [p.id for p in self.in_hand_players()]
+        self.reset_round_for_next_street()
 
     def betting_round(self):
-        if (not self.active_for_action()) or (self.actor_seat is None):
+        """
+        1 ストリートぶんのベッティングを状態機械として進める（ジェネレータ）。
+        手番ごとにプレイヤーを yield し、(action, target_total) を send で受け取る。
+        to_act が空になればラウンド終了（行動ごとに O(1) 判定）。
+        最大ベットが上がると apply_action が他のアクティブ全員を to_act に戻す
+        """
+        table = self.table
+        if (not table.active) or (self.actor_seat is None):
             return
-        iter_guard = 0
-        while True:
-            iter_guard += 1
-            if iter_guard > 1000:
-                self.out("!! Guard tripped in betting_round (possible logic loop).")
-                return
-            if len([p for p in self.in_hand_players()]) == 1:
-                return
-            if all(p.is_allin or p.is_folded for p in self.in_hand_players()):
-                return
-
-            p = self.players[self.actor_seat]
-            while (p.is_eliminated or p.is_folded or p.is_allin):
+        while len(table.in_hand) > 1 and table.active:
+            while self.actor_seat not in table.active:
                 self.actor_seat = self.seat_after(self.actor_seat)
-                p = self.players[self.actor_seat]
+            p = self.players[self.actor_seat]
 
-            pol = self.policies[p.id]
-            legal_before = set(self.legal_actions(p.id))
-            action, target_total = pol.act(self, p)
-            if action not in legal_before:
-                if "check" in legal_before: action, target_total = "check", None
-                elif "call" in legal_before: action, target_total = "call", None
-                elif "fold" in legal_before: action, target_total = "fold", None
-                elif "allin" in legal_before: action, target_total = "allin", None
+            self.turn = opts = self._turn_options(p.id)
+            action, target_total = yield p
+            if action not in opts.legal:
+                if "check" in opts.legal: action, target_total = "check", None
+                elif "call" in opts.legal: action, target_total = "call", None
+                elif "fold" in opts.legal: action, target_total = "fold", None
+                elif "allin" in opts.legal: action, target_total = "allin", None
 
             self.event_no += 1
-            info = self.apply_action(p, action, target_total)
-            self.public_actions.append({"street": self.street, "by": p.id, **info})
-            self.log_event(p.id, info)
-            self.echo_action(p, info)
-
-            actives = self.active_for_action()
-            if actives:
-                all_acted = all(self.has_acted.get(pp.id, False) for pp in actives)
-                all_matched = all(self.bet_in_round.get(pp.id, 0) == self.current_max_bet
-                                  for pp in self.in_hand_players() if not pp.is_allin)
-                if all_acted and all_matched:
-                    return
-            else:
+            rec = self.apply_action(p, action, target_total)
+            self.turn = None
+            self.public_actions.append(rec)
+            if not self.headless:
+                info = action_info(rec)
+                self.log_event(p.id, info)
+                self.echo_action(p, info)
+
+            if not self.to_act:
                 return
-
             self.actor_seat = self.seat_after(self.actor_seat)
 
     def apply_action(self, player, action, target_total):
+        """1 手を反映して PublicAction を返す"""
         pid = player.id
         my_bet = self.bet_in_round.get(pid, 0)
-        info = {"type": action}
+        paid, new_total = 0, None
 
         # 最初の判断を記録（blind は除外）
         if pid not in self.first_action and action not in ("blind",):
@@ -1292,47 +3325,36 @@ class Game:
             self.vpip[pid] = True
 
         def commit(amount):
-            pay = min(amount, player.stack)
-            player.stack -= pay
-            self.bet_in_round[pid] = self.bet_in_round.get(pid, 0) + pay
-            self.committed_total[pid] = self.committed_total.get(pid, 0) + pay
-            if player.stack == 0:
-                player.is_allin = True
-                self.hand_had_allin = True
-            return pay
+            return self.commit_chips(player, amount)
 
+        def reopen():
+            # 最大ベットが上がった: 自分以外のアクティブ全員がもう一度行動する
+            self.to_act = {pp.id for pp in self.active_for_action()}
+            self.to_act.discard(pid)
+
+        self.to_act.discard(pid)
         if action == "fold":
             player.is_folded = True
-            self.has_acted.pop(pid, None)
-            info["amount"] = 0
+            self.pot.cap(self.committed_total[pid])
 
         elif action == "check":
-            self.has_acted[pid] = True
-            info["amount"] = 0
+            pass
 
         elif action == "call":
             to_call = max(0, self.current_max_bet - my_bet)
             paid = commit(to_call)
-            self.has_acted[pid] = True
-            info["amount"] = paid
 
         elif action == "allin":
             paid = commit(player.stack)
             prev_max = self.current_max_bet
-            new_total = self.bet_in_round[pid]
-            if new_total > prev_max:
-                raise_amt = new_total - prev_max
+            allin_total = self.bet_in_round[pid]
+            if allin_total > prev_max:
+                raise_amt = allin_total - prev_max
                 if raise_amt >= self.last_raise_size:
                     self.last_raise_size = raise_amt
                     self.last_raiser_seat = player.seat_index
-                    self.has_acted = {pp.id: False for pp in self.active_for_action()}
-                    self.has_acted[pid] = True
-                else:
-                    self.has_acted[pid] = True
-                self.current_max_bet = new_total
-            else:
-                self.has_acted[pid] = True
-            info["amount"] = paid
+                self.current_max_bet = allin_total
+                reopen()
 
         elif action in ("bet", "raise"):
             if target_total is None:
@@ -1348,193 +3370,169 @@ class Game:
             prev_max = self.current_max_bet
             new_total = self.bet_in_round[pid]
             raise_amt = new_total - prev_max
-            reopened = False
-            if new_total > prev_max and raise_amt >= self.last_raise_size:
-                self.last_raise_size = raise_amt
-                self.last_raiser_seat = player.seat_index
-                reopened = True
-            self.current_max_bet = max(self.current_max_bet, new_total)
-
-            if reopened:
-                self.has_acted = {pp.id: False for pp in self.active_for_action()}
-                self.has_acted[pid] = True
-            else:
-                self.has_acted[pid] = True
-
-            info["amount"] = paid
-            info["to_total"] = new_total
-
-        else:
-            self.has_acted[pid] = True
-            info["amount"] = 0
+            if new_total > prev_max:
+                if raise_amt >= self.last_raise_size:
+                    self.last_raise_size = raise_amt
+                    self.last_raiser_seat = player.seat_index
+                self.current_max_bet = new_total
+                reopen()
 
-        return info
+        return PublicAction(STREET_NO[self.street], pid, ACTION_NO[action], paid, new_total)
 
     def reset_round_for_next_street(self):
         self.current_max_bet = 0
         self.last_raise_size = self.bb
         self.last_raiser_seat = None
         self.actor_seat = self.first_left_of_button()
-        for p in self.alive_players():
-            self.bet_in_round[p.id] = 0
-        self.has_acted = {p.id: False for p in self.active_for_action()}
+        self.bet_in_round.clear_values()
+        self.to_act = {p.id for p in self.active_for_action()}
 
     def award_single(self):
         total = sum(self.committed_total.values())
-        winner = [p for p in self.in_hand_players()][0]
+        winner = self.in_hand_players()[0]
         winner.stack += total
-        self.hand_pot_winners.append([winner.id])
-        self.out(f"-> {winner.name} wins uncontested pot of {total}")
-        self.log_event(winner.id, {"type": "win_uncontested", "amount": total})
-
-    def build_pots(self):
-        resid = dict(self.committed_total)
-        pots = []
-        while True:
-            contributors = [pid for pid, amt in resid.items() if amt > 0]
-            if not contributors:
-                break
-            x = min(resid[pid] for pid in contributors)
-            pot_amount = x * len(contributors)
-            eligible = set(pid for pid in contributors
-                           if not next(pp for pp in self.players if pp.id == pid).is_folded)
-            pots.append({"amount": pot_amount, "eligible": eligible})
-            for pid in contributors:
-                resid[pid] -= x
-        self.pots = pots
+        self.hand_awards.append(PotAward(total, (winner.id,)))
+        if not self.headless:
+            self.out(f"-> {winner.name} wins uncontested pot of {total}")
+            self.log_event(winner.id, {"type": "win_uncontested", "amount": total})
 
     def distribute_order_from_button(self):
-        ids = []
-        j = self.seat_after(self.button_index)
-        start = j
-        while True:
-            p = self.players[j]
-            if not p.is_eliminated and not p.is_folded:
-                ids.append(p.id)
-            j = self.seat_after(j)
-            if j == start:
-                break
-        return ids
+        table = self.table
+        return [self.players[s].id for s in self.geometry().postflop_order if not table.folded[s]]
+
+    def _hand_strengths(self):
+        """配られた全員の最終的な強さ（ショーダウン・What-if 共通、1 ハンド 1 回の一括評価）"""
+        if self.hand_strengths is None:
+            holes = {pid: self.players[pid - 1].hole for pid in self.preflop_participants}
+            self.hand_strengths, _ = showdown_batch(self.board, holes)
+        return self.hand_strengths
 
     def showdown_and_award(self):
-        self.build_pots()
+        pots = self.pot.pots()
+        strengths = self._hand_strengths()
         scores = {}
-        if self.hand_all_ai and REVEAL_IF_ALL_AI:
+        reveal = self.hand_all_ai and REVEAL_IF_ALL_AI and not self.headless
+        if reveal:
             self.out("Showdown:")
         for p in self.in_hand_players():
-            sc, used5 = best_of_seven(list(p.hole) + list(self.board))
+            sc = strengths[p.id]
             scores[p.id] = sc
-            if self.hand_all_ai and REVEAL_IF_ALL_AI:
+            if self.headless:
+                continue
+            if reveal:
+                used5 = used_five(list(p.hole) + list(self.board), sc)
                 self.out(f"  {p.name}: {' '.join(card_to_str(c) for c in p.hole)}  -> {hand_label(sc)} [{pretty_used5(used5)}]")
             self.log_event(0, {"type": "showdown_eval","player_id": p.id,"hole": [card_to_str(c) for c in p.hole],"hand_class": hand_label(sc)})
-        total_pots = sum(p["amount"] for p in getattr(self, "pots", []))
+        total_pots = self.pot.total()
         total_commit = sum(self.committed_total.values())
         if total_pots != total_commit:
             self.out(f"!! WARNING: pot mismatch pots={total_pots} committed={total_commit}")
-        for idx, pot in enumerate(self.pots):
+        for idx, pot in enumerate(pots):
             elig = [pid for pid in pot["eligible"]
-                    if not next(pp for pp in self.players if pp.id == pid).is_folded]
+                    if not self.by_id[pid].is_folded]
             if not elig:
                 continue
-            best_score, winners = None, []
-            for pid in elig:
-                sc = scores.get(pid)
-                if sc is None: continue
-                if best_score is None or sc > best_score:
-                    best_score, winners = sc, [pid]
-                elif sc == best_score:
-                    winners.append(pid)
+            winners, _ = winners_of(scores, elig)
             share = pot["amount"] // len(winners)
             odd = pot["amount"] - share * len(winners)
             order = [pid for pid in self.distribute_order_from_button() if pid in winners]
             for pid in winners:
-                next(p for p in self.players if p.id == pid).stack += share
+                self.by_id[pid].stack += share
             for i in range(odd):
                 pid = order[i % len(order)]
-                next(p for p in self.players if p.id == pid).stack += 1
-            names = ", ".join(next(p for p in self.players if p.id == pid).name for pid in winners)
-            self.out(f"-> Pot#{idx+1} {pot['amount']} awarded to {names}")
-            self.hand_pot_winners.append(list(winners))
-            self.log_event(0, {"type": "award", "pot_index": idx + 1, "amount": pot["amount"], "winners": winners})
+                self.by_id[pid].stack += 1
+            self.hand_awards.append(PotAward(pot["amount"], tuple(winners)))
+            if not self.headless:
+                names = ", ".join(self.by_id[pid].name for pid in winners)
+                self.out(f"-> Pot#{idx+1} {pot['amount']} awarded to {names}")
+                self.log_event(0, {"type": "award", "pot_index": idx + 1, "amount": pot["amount"], "winners": winners})
 
     # ---- what-if ----
     def _ensure_river_board(self):
         while len(self.board) < 5 and self.deck:
-            self.board.append(self.deck.pop())
+            c = self.deck.pop()
+            self.board.append(c)
+            self.board_ctx.add(c)
 
     def _what_if_winners(self, pid_list):
         if len(pid_list) < 2:
             return [], None, {}
-        scores = {}
-        for pid in pid_list:
-            p = next(pp for pp in self.players if pp.id == pid)
-            sc, _ = best_of_seven(list(p.hole) + list(self.board))
-            scores[pid] = sc
-        best_sc, winners = None, []
-        for pid, sc in scores.items():
-            if best_sc is None or sc > best_sc:
-                best_sc, winners = sc, [pid]
-            elif sc == best_sc:
-                winners.append(pid)
-        return winners, best_sc, scores
+        strengths = self._hand_strengths()
+        winners, best_sc = winners_of(strengths, pid_list)
+        return winners, best_sc, {pid: strengths[pid] for pid in pid_list}
 
     def compute_what_if_and_print(self):
         self._ensure_river_board()
         winners1, sc1, _ = self._what_if_winners(self.preflop_participants)
+        winners2, sc2, _ = self._what_if_winners(self.flop_participants)
+        if self.headless:
+            return winners1, winners2
         if winners1:
-            names = ", ".join(next(p for p in self.players if p.id == pid).name for pid in winners1)
+            names = ", ".join(self.by_id[pid].name for pid in winners1)
             if self.hand_all_ai and REVEAL_IF_ALL_AI:
                 self.out(f"[What-if] No folds (all dealt): {names} -> {hand_label(sc1)}")
             else:
                 self.out(f"[What-if] No folds (all dealt): {names}")
-        winners2, sc2, _ = self._what_if_winners(self.flop_participants)
         if winners2:
-            names = ", ".join(next(p for p in self.players if p.id == pid).name for pid in winners2)
+            names = ", ".join(self.by_id[pid].name for pid in winners2)
             if self.hand_all_ai and REVEAL_IF_ALL_AI:
                 self.out(f"[What-if] Flop players no further folds: {names} -> {hand_label(sc2)}")
             else:
                 self.out(f"[What-if] Flop players no further folds: {names}")
         return winners1, winners2
 
-    # ---- テキストログ ----
-    def _write_text_logs_for_hand(self):
-        text = "\n".join(self.hand_lines) + ("\n" if self.hand_lines and self.hand_lines[-1] != "" else "")
-        self.text_logs["all"].write(text); self.text_logs["all"].flush()
-        if self.hand_end_stage == "PREFLOP":
-            self.text_logs["end_preflop"].write(text); self.text_logs["end_preflop"].flush()
-        elif self.hand_end_stage == "FLOP":
-            self.text_logs["end_flop"].write(text); self.text_logs["end_flop"].flush()
-        elif self.hand_end_stage == "TURN":
-            self.text_logs["end_turn"].write(text); self.text_logs["end_turn"].flush()
-        elif self.hand_end_stage == "RIVER":
-            self.text_logs["end_river"].write(text); self.text_logs["end_river"].flush()
-        if self.hand_had_allin:
-            self.text_logs["allin"].write(text); self.text_logs["allin"].flush()
+    # ---- オールイン時の厳密エクイティ（allin.log 用） ----
+    def _note_allin_equity(self):
+        if self.headless or self.allin_equity_line is not None or not (self.hand_all_ai and REVEAL_IF_ALL_AI):
+            return
+        live = self.in_hand_players()
+        if len(live) < 2 or len(self.active_for_action()) > 1:
+            return
+        eqs = self._live_equities(live)
+        if eqs is None:
+            return
+        body = " / ".join(f"{p.name} {e * 100:.1f}%" for p, e in zip(live, eqs))
+        b = " ".join(card_to_str(c) for c in self.board) or "-"
+        self.allin_equity_line = f"[All-in equity] {self.street} {b}: {body}"
+
+    def _live_equities(self, live):
+        """残っている全員のランアウト・エクイティ（全列挙）。プリフロップは HU 行列があるときだけ"""
+        if not self.board:
+            e = headsup_equity(live[0].hole, live[1].hole) if len(live) == 2 else None
+            return None if e is None else [e, 1.0 - e]
+        return [r.equity for r in equity_exact([p.hole for p in live], self.board)]
+
+    def _record_runout_equity(self):
+        live = self.in_hand_players()
+        eqs = self._live_equities(live)
+        if eqs is not None:
+            self.runout_equity = {p.id: e for p, e in zip(live, eqs)}
 
     # ---- 統計更新（コンボ別 winner / what-if） ----
     def _update_combo_stats(self, winners_all_dealt, winners_flop):
         # all_dealt
         n0 = len(self.preflop_participants)
         for pid in self.preflop_participants:
-            p = next(pp for pp in self.players if pp.id == pid)
-            combo = hole_to_combo(p.hole)
+            p = self.by_id[pid]
+            cid = combo_id(p.hole)
             if pid in winners_all_dealt:
                 outcome = "win" if len(winners_all_dealt) == 1 else "tie"
             else:
                 outcome = "loss"
-            self.stats.add("all_dealt", combo, n0, outcome)
+            self.stats.add("all_dealt", cid, n0, outcome)
 
         # flop_players
         if self.flop_participants:
             n1 = len(self.flop_participants)
+            tex = TEXTURE_CLASS_NAMES[texture_class(board_texture(self.board[:3]))]
             for pid in self.flop_participants:
-                p = next(pp for pp in self.players if pp.id == pid)
-                combo = hole_to_combo(p.hole)
+                p = self.by_id[pid]
+                cid = combo_id(p.hole)
                 if pid in winners_flop:
                     outcome = "win" if len(winners_flop) == 1 else "tie"
                 else:
                     outcome = "loss"
-                self.stats.add("flop_players", combo, n1, outcome)
+                self.stats.add("flop_players", cid, n1, outcome, texture=tex)
 
         # winner（実プレイ）
         # ルール: そのハンドで最初の判断が fold かつ VPIP=False -> スキップ
@@ -1543,7 +3541,8 @@ class Game:
         nW = len(self.preflop_participants)  # 人数別は all_dealt の人数で分類
         # 各プレイヤーが勝ったポットが「単独のみか/分割含むか」を検出
         pot_win_map = defaultdict(lambda: {"solo":0, "split":0})
-        for winners in self.hand_pot_winners:
+        for award in self.hand_awards:
+            winners = award.winners
             if not winners: 
                 continue
             if len(winners) == 1:
@@ -1553,8 +3552,8 @@ class Game:
                     pot_win_map[pid]["split"] += 1
 
         for pid in self.preflop_participants:
-            p = next(pp for pp in self.players if pp.id == pid)
-            combo = hole_to_combo(p.hole)
+            p = self.by_id[pid]
+            cid = combo_id(p.hole)
 
             # 「最初が fold かつ VPIP なし」→スキップ
             first = self.first_action.get(pid, None)
@@ -1563,104 +3562,82 @@ class Game:
 
             if p.is_folded:
                 if self.vpip[pid]:
-                    self.stats.add("winner", combo, nW, "loss")
+                    self.stats.add("winner", cid, nW, "loss")
                 else:
                     # 参加していない fold（VPIP なし）は何も加算しない
                     pass
             else:
                 wins = pot_win_map.get(pid, {"solo":0,"split":0})
                 if wins["solo"] > 0:
-                    self.stats.add("winner", combo, nW, "win")
+                    self.stats.add("winner", cid, nW, "win")
                 elif wins["split"] > 0:
-                    self.stats.add("winner", combo, nW, "tie")
+                    self.stats.add("winner", cid, nW, "tie")
                 else:
                     # ショーダウン負け
-                    self.stats.add("winner", combo, nW, "loss")
+                    self.stats.add("winner", cid, nW, "loss")
 
     # ---- 学習更新（各プレイヤー別Learner） ----
-    def _apply_learning_update(self):
-        rewards = {p.id: (p.stack - self.stack_before.get(p.id, p.stack)) for p in self.players}
-        for pid, learner in self.learners.items():
+    def _apply_learning_update(self, rewards):
+        if self.learning_sink is not None:
+            self.learning_sink.append((self.learning_traces, rewards, self.bb))
+            return
+        for learner in self.learners.values():
             learner.update_from_hand(self.learning_traces, rewards, bb_size=self.bb)
-            learner.save_latest(hands_played=self.hands_played)
 
     # ---- 1ハンド ----
     def play_hand(self):
+        """1 ハンドを各自のポリシーで最後まで進める"""
+        steps = self.hand_steps()
+        try:
+            p = next(steps)
+            while True:
+                p = steps.send(self.policies[p.id].act(self, p))
+        except StopIteration as e:
+            return e.value
+
+    def hand_steps(self):
+        """
+        1 ハンドぶんのジェネレータ。手番のプレイヤーを yield し、send された (action, target_total) で進める。
+        終了時の戻り値は play_hand と同じ（ハンドを開始できなければ False）
+        """
         if not self.start_hand():
             return False
 
-        # PREFLOP
-        self.betting_round()
-        if len(self.in_hand_players()) == 1:
-            self.hand_end_stage = "PREFLOP"
-            self.award_single()
-            winners1, winners2 = self.compute_what_if_and_print()
-            self._update_combo_stats(winners1, winners2)
-            self._apply_learning_update()
-            self.move_button()
-            self.print_stacks()
-            self._write_text_logs_for_hand()
-            self.hands_played += 1
-            return True
-
-        # FLOP
-        self.street = "FLOP"
-        self.reveal_board(3)
-        self.show_street_header()
-        self.flop_participants = [p.id for p in self.in_hand_players()]
-        self.reset_round_for_next_street()
-        self.betting_round()
-        if len(self.in_hand_players()) == 1:
-            self.hand_end_stage = "FLOP"
-            self.award_single()
-            winners1, winners2 = self.compute_what_if_and_print()
-            self._update_combo_stats(winners1, winners2)
-            self._apply_learning_update()
-            self.move_button()
-            self.print_stacks()
-            self._write_text_logs_for_hand()
-            self.hands_played += 1
-            return True
-
-        # TURN
-        self.street = "TURN"
-        self.reveal_board(1)
-        self.show_street_header()
-        self.reset_round_for_next_street()
-        self.betting_round()
-        if len(self.in_hand_players()) == 1:
-            self.hand_end_stage = "TURN"
-            self.award_single()
-            winners1, winners2 = self.compute_what_if_and_print()
-            self._update_combo_stats(winners1, winners2)
-            self._apply_learning_update()
-            self.move_button()
-            self.print_stacks()
-            self._write_text_logs_for_hand()
-            self.hands_played += 1
-            return True
-
-        # RIVER
-        self.street = "RIVER"
-        self.reveal_board(1)
-        self.show_street_header()
-        self.reset_round_for_next_street()
-        self.betting_round()
+        while True:
+            yield from self.betting_round()
+            if self.street == "RIVER":
+                self.hand_end_stage = "RIVER"
+                self.showdown_and_award()
+                break
+            self._note_allin_equity()
+            if len(self.in_hand_players()) == 1:
+                self.hand_end_stage = self.street
+                self.award_single()
+                break
+            if self.action_closed():
+                # オールインで手番が閉じた: 残りのストリートのベッティングを飛ばして一度に配る
+                if ALLIN_RUNOUT_EQUITY:
+                    self._record_runout_equity()
+                self.run_out_board()
+                self.hand_end_stage = "RIVER"
+                self.showdown_and_award()
+                break
+            self.deal_next_street()
 
-        # SHOWDOWN
-        self.hand_end_stage = "RIVER"
-        self.showdown_and_award()
         winners1, winners2 = self.compute_what_if_and_print()
         self._update_combo_stats(winners1, winners2)
-        self._apply_learning_update()
-
+        deltas = {p.id: (p.stack - self.stack_before.get(p.id, p.stack)) for p in self.players}
+        self.last_result = HandResult(self.hand_id, deltas, tuple(a.winners for a in self.hand_awards),
+                                      self.hand_end_stage, self.hand_had_allin, self.learning_traces)
+        self._apply_learning_update(deltas)
         self.move_button()
         self.print_stacks()
-        self._write_text_logs_for_hand()
         self.hands_played += 1
         return True
 
     def print_stacks(self):
+        if self.headless:
+            return
         s = " | ".join(f"{p.name}:{p.stack}(R{p.rebuy_used}){'X' if p.is_eliminated else ''}" for p in self.players)
         self.out(f"Stacks: {s}")
 
@@ -1679,7 +3656,7 @@ class Game:
             final_no = initial_no + added
             final_no_map[p.id] = final_no
             final_name = f"policy_memory_{self.run_ts}_p{p2}_No{final_no:08d}.json"
-            final_path = os.path.join(POSTAI_DIR, final_name)
+            final_path = os.path.join(self.config.postai_dir, final_name)
             learner.save_final(final_path, hands_played=self.hands_played, final_no=final_no)
             learner.save_latest(hands_played=self.hands_played)
 
@@ -1688,7 +3665,7 @@ class Game:
         w_learner = self.learners[winner.id]
         w_final_no = final_no_map.get(winner.id, self.player_initial_no.get(winner.id, 0))
         # winner.json を更新（cumulative_no を明示）
-        save_json_with_meta(WINNER_POLICY_PATH, w_learner.table, {
+        save_json_with_meta(self.config.postai_path(WINNER_POLICY_PATH), w_learner.table, {
             **w_learner.meta,
             "winner_of_run_ts": self.run_ts,
             "winner_player_id": winner.id,
@@ -1727,36 +3704,470 @@ class Game:
             "persona": self.players[winner.id - 1].persona,
             "final_no": str(int(w_final_no)).zfill(8)
         }
-        with open(WINNER_HISTORY_PATH, "a", encoding="utf-8") as f:
+        with open(self.config.postai_path(WINNER_HISTORY_PATH), "a", encoding="utf-8") as f:
             f.write(json.dumps(hist, ensure_ascii=False) + "\n")
 
     # ---- 実行 ----
-    def run(self, hands=ROUNDS):
-        for _ in range(hands):
+    def simulate(self, hands=None):
+        """
+        1 ハンドごとに HandResult を yield する（最大 hands、省略時は config.rounds）。途中で止めてもよい。
+        各ハンドの結果は yield の前に self.sinks の add に渡す（close は呼び出し側）
+        """
+        for _ in range(self.config.rounds if hands is None else hands):
             if len(self.alive_players()) < 2:
                 self.out("Game ends: less than 2 players remain.")
-                break
-            ok = self.play_hand()
-            if not ok:
+                return
+            if not self.play_hand():
                 self.out("Game ends.")
-                break
+                return
+            for sink in self.sinks:
+                sink.add(self, self.last_result)
+            yield self.last_result
+
+    def default_sinks(self):
+        """run() の既定の出力先。persist=False なら何も書かない。ヘッドレスではテキスト・観測ログを省く"""
+        if not self.config.persist:
+            return []
+        sinks = [] if self.headless else [TextLogSink(), ObservationLogSink()]
+        sinks += [PolicySink(every=HEADLESS_SAVE_EVERY if self.headless else 1), StatsSink()]
+        return sinks
+
+    def run(self, hands=None, sinks=None):
+        """hands ハンド打ち、ログ・ポリシー・統計を sinks（省略時は default_sinks()）に書き出す"""
+        t0 = time.perf_counter()
+        self.sinks = self.default_sinks() if sinks is None else list(sinks)
+        try:
+            for _ in self.simulate(hands):
+                pass
+        finally:
+            for sink in self.sinks:
+                sink.close(self)
+
+        dt = time.perf_counter() - t0
+        mode = "headless" if self.headless else "normal"
+        print(f"=== {self.hands_played} hands in {dt:.1f}s ({self.hands_played / max(dt, 1e-9):.1f} hands/s, {mode}) ===")
+
+# ======== 学習（卓を作り直しながら所定ハンド数） ========
+def train(hands, num_players=None, config=None):
+    """
+    1 プロセスで hands ハンド自己対戦する。卓が決着したら同じ Learner・統計のまま新しい卓で続ける（train_parallel と同じ数え方）。
+    出力は simulate() と同じ PolicySink / StatsSink で、最後の卓を代表に、ハンド数は全卓の合計で記録
+    """
+    t0 = time.perf_counter()
+    cfg = (config or GameConfig()).replace(num_players=num_players, headless=True)
+    played = 0
+    for _ in simulate(hands, cfg, sinks=[PolicySink(every=HEADLESS_SAVE_EVERY), StatsSink()], persist=cfg.persist):
+        played += 1
+
+    dt = time.perf_counter() - t0
+    print(f"=== {played} hands in {dt:.1f}s ({played / max(dt, 1e-9):.1f} hands/s, headless) ===")
+
+# ======== 並列学習（マルチプロセス） ========
+def _train_worker(conn, config, hands, sync_every, tables, profiles):
+    """
+    ワーカー: メモリ上の Learner でヘッドレス自己対戦を hands ハンド行う（卓が終われば新しい卓で続ける）。
+    sync_every ハンドごとに、触れたキーの (前回の同期から増えた回数, q) を送り、合流後の値を受け取る。ファイルには書かない
+    """
+    rng = random.Random(config.seed)   # 卓を作り直すたびにここから seed を引く
+    learners = {}
+    for pid, tbl in tables.items():
+        persona, key_format = profiles[pid]
+        learners[pid] = Learner(pid, None, config.run_ts, persona, rng=random.Random(rng.getrandbits(64)))
+        learners[pid].key_format = key_format
+        learners[pid].table = tbl
+    synced_n = {pid: {k: v["n"] for k, v in l.table.items()} for pid, l in learners.items()}   # 最後に同期した回数
+    stats = StatsManager(config.log_dir, config.run_ts)
+    sink = []
+    touched = {pid: set() for pid in learners}
+    alive_hands = defaultdict(int)
+    g = None
+    played = 0
+
+    def delta():
+        d = {}
+        for pid, keys in touched.items():
+            if keys:
+                tbl, base = learners[pid].table, synced_n[pid]
+                d[pid] = {k: (tbl[k]["n"] - base.get(k, 0), tbl[k]["q"]) for k in keys}
+                keys.clear()
+        return d
+
+    while played < hands:
+        if g is None or len(g.alive_players()) < 2:
+            if g is not None:
+                for pid, n in g.player_alive_hands.items():
+                    alive_hands[pid] += n
+            g = Game(config=config.replace(seed=rng.getrandbits(64), persist=False), learners=learners, stats=stats)
+            g.learning_sink = sink
+        if not g.play_hand():
+            continue    # 淘汰で 2 人未満になった: 次のループで新しい卓を作る
+        played += 1
+        for traces, rewards, bb in sink:
+            mine = defaultdict(list)
+            for tr in traces:
+                mine[tr.pid].append(tr)
+            for pid, trs in mine.items():
+                learners[pid].update_from_hands([(trs, rewards, bb)])
+                touched[pid].update(f"{tr.state}|{tr.option}" for tr in trs)
+        sink.clear()
+        if played % sync_every == 0 and played < hands:
+            conn.send(("sync", delta(), played))
+            for pid, entries in conn.recv().items():
+                tbl, base = learners[pid].table, synced_n[pid]
+                for k, (n, q) in entries.items():
+                    tbl[k] = {"n": n, "q": q}
+                    base[k] = n
+
+    stacks = None
+    if g is not None:
+        for pid, n in g.player_alive_hands.items():
+            alive_hands[pid] += n
+        stacks = [p.stack for p in g.players]
+    conn.send(("done", delta(), played, stats.export(), dict(alive_hands), stacks))
+    conn.close()
+
+def _merge_delta(learners, delta):
+    """
+    1 ワーカーの {pid: {key: (dn, q)}}（前回の同期から増えた回数と現在の q）を回数重み付き平均で Learner に合流させる。
+    合流したキーを {pid: set} で返す
+    """
+    merged = {}
+    for pid, entries in delta.items():
+        tbl = learners[pid].table
+        keys = merged[pid] = set()
+        for k, (dn, q) in entries.items():
+            if dn <= 0:
+                continue
+            base = tbl.get(k)
+            if base is None:
+                tbl[k] = {"n": dn, "q": q}
+            else:
+                n = base["n"] + dn
+                tbl[k] = {"n": n, "q": (base["n"] * base["q"] + dn * q) / n}
+            keys.add(k)
+    return merged
 
-        # 終了時にポリシー保存＆勝者記録
-        self._save_final_policies_and_winner()
-        # CSV 統計の書き出し
-        self.stats.finalize()
-
-        # 後片付け
-        for f in self.logs.values():
-            try: f.flush(); f.close()
-            except: pass
-        try: self.training_log.flush(); self.training_log.close()
-        except: pass
-        for f in self.text_logs.values():
-            try: f.flush(); f.close()
-            except: pass
+def train_parallel(workers, hands, num_players=None, sync_every=PARALLEL_SYNC_EVERY, config=None):
+    """
+    W プロセスで自己対戦し、各ワーカーが sync_every ハンドごとに送る差分を届いた順に合流させ、
+    そのワーカーにだけ合流後の値（自分の差分 + 前回から他のワーカーが合流させたキー）を返す。ほかのワーカーは待たない。
+    policy_memory_latest の保存は PARALLEL_SAVE_SECONDS 秒ごと。
+    出力（policy_memory_*, winner.json, winner_history.jsonl, 統計 CSV）は通常の学習と同じ
+    """
+    t0 = time.perf_counter()
+    cfg = (config or GameConfig()).replace(num_players=num_players, human_ids=set(), headless=True)
+    workers = max(0, min(workers, hands))   # 割り当てが 0 ハンドになるワーカーは作らない
+    g = Game(config=cfg)
+    tables = {pid: l.table for pid, l in g.learners.items()}
+    profiles = {pid: (l.persona, l.key_format) for pid, l in g.learners.items()}
+    conns, procs = [], []
+    for w in range(workers):
+        n_w = hands // workers + (1 if w < hands % workers else 0)
+        parent, child = multiprocessing.Pipe()
+        proc = multiprocessing.Process(
+            target=_train_worker, daemon=True,
+            args=(child, cfg.replace(seed=g.rng.getrandbits(64)), n_w, sync_every, tables, profiles))
+        proc.start()
+        child.close()
+        conns.append(parent)
+        procs.append(proc)
+
+    results = []
+    running = list(conns)
+    pending = {c: defaultdict(set) for c in conns}   # 他のワーカーから合流して、まだ c に送っていないキー
+    played = {c: 0 for c in conns}
+    saved_at = time.perf_counter()
+    while running:
+        for c in multiprocessing.connection.wait(running):
+            m = c.recv()
+            merged = _merge_delta(g.learners, m[1])
+            played[c] = m[2]
+            for other in running:
+                if other is not c:
+                    for pid, keys in merged.items():
+                        pending[other][pid] |= keys
+            if m[0] == "done":
+                results.append(m)
+                running.remove(c)
+                continue
+            for pid, keys in merged.items():
+                pending[c][pid] |= keys
+            reply = {}
+            for pid, keys in pending[c].items():
+                tbl = g.learners[pid].table
+                reply[pid] = {k: (tbl[k]["n"], tbl[k]["q"]) for k in keys}
+            pending[c].clear()
+            c.send(reply)
+        if time.perf_counter() - saved_at >= PARALLEL_SAVE_SECONDS:
+            saved_at = time.perf_counter()
+            for learner in g.learners.values():
+                learner.save_latest(hands_played=sum(played.values()))
+    for proc in procs:
+        proc.join()
+
+    # 統計は全ワーカー分を合算。ポリシー・勝者は最大スタックの卓を代表にし、ハンド数は合計
+    g.hands_played = sum(r[2] for r in results)
+    if g.hands_played:
+        alive_hands = defaultdict(int)
+        for _, _, _, st, ah, _ in results:
+            g.stats.merge(st)
+            for pid, n in ah.items():
+                alive_hands[pid] += n
+        lead_stacks = max((r[5] for r in results if r[5] is not None), key=max)
+        for p, stack in zip(g.players, lead_stacks):
+            p.stack = stack
+        g.player_alive_hands = dict(alive_hands)
+        for out in (PolicySink(), StatsSink()):
+            out.close(g)
+
+    dt = time.perf_counter() - t0
+    print(f"=== {g.hands_played} hands in {dt:.1f}s ({g.hands_played / max(dt, 1e-9):.1f} hands/s, "
+          f"{workers} workers) ===")
+
+# ======== ライブラリ API（ハンド結果のストリーム） ========
+class HandSink:
+    """
+    Game.run / simulate() の出力先。line は表示行ごと、event は観測イベントごと（どちらもヘッドレスでは来ない）、
+    add はハンドごと、close はストリームの終了時（途中で止めた場合も。卓が無ければ game=None）
+    """
+    def line(self, game, msg):
+        pass
+
+    def event(self, game, acting_id, action_dict):
+        pass
+
+    def add(self, game, result):
+        pass
+
+    def close(self, game):
+        pass
+
+def _open_append(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return open(path, "a", encoding="utf-8")
+
+class ResultLogSink(HandSink):
+    """HandResult を 1 行 1 ハンドの JSONL に追記する"""
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def add(self, game, result):
+        if self.f is None:
+            self.f = _open_append(self.path)
+        self.f.write(json.dumps(result._asdict(), ensure_ascii=False) + "\n")
+
+    def close(self, game):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+class TextLogSink(HandSink):
+    """ハンドの表示行を logs/all.log と、終わった街別の end_*.log・オールインのあった allin.log に追記する"""
+    STAGE_LOGS = {"PREFLOP": END_PREFLOP_LOG, "FLOP": END_FLOP_LOG, "TURN": END_TURN_LOG, "RIVER": END_RIVER_LOG}
+
+    def __init__(self):
+        self.files = {}
+
+    def _write(self, game, path, text):
+        f = self.files.get(path)
+        if f is None:
+            f = self.files[path] = _open_append(game.config.log_path(path))
+        f.write(text)
+        f.flush()
+
+    def add(self, game, result):
+        lines = game.hand_lines
+        text = "\n".join(lines) + ("\n" if lines and lines[-1] != "" else "")
+        self._write(game, ALL_LOG, text)
+        if result.end_street in self.STAGE_LOGS:
+            self._write(game, self.STAGE_LOGS[result.end_street], text)
+        if result.allin:
+            if game.allin_equity_line:
+                text += game.allin_equity_line + "\n"
+            self._write(game, ALLIN_LOG, text)
+
+    def close(self, game):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+class ObservationLogSink(HandSink):
+    """行動のたびに、残っている各プレイヤー視点のスナップショットを logs/player_<id>.jsonl に追記する"""
+    def __init__(self):
+        self.files = {}
+
+    def event(self, game, acting_id, action_dict):
+        for p in game.players:
+            if p.is_eliminated:
+                continue
+            f = self.files.get(p.id)
+            if f is None:
+                f = self.files[p.id] = _open_append(os.path.join(game.config.log_dir, f"player_{p.id}.jsonl"))
+            f.write(json.dumps(game.snapshot_for_observer(p.id, acting_id, action_dict), ensure_ascii=False) + "\n")
+        for f in self.files.values():
+            f.flush()
+
+    def close(self, game):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+class StatsSink(HandSink):
+    """終了時にコンボ別の統計 CSV（stats/）を書き出す"""
+    def close(self, game):
+        if game is not None:
+            game.stats.finalize()
+
+class PolicySink(HandSink):
+    """
+    every ハンドごとに各 Learner の latest を保存し（None なら途中保存なし）、
+    終了時に policy_memory_*・policy_memory_winner.json・winner_history.jsonl を保存する
+    """
+    def __init__(self, every=None):
+        self.every = every
+        self.hands = 0
+
+    def add(self, game, result):
+        self.hands += 1
+        if self.every and self.hands % self.every == 0:
+            for learner in game.learners.values():
+                learner.save_latest(hands_played=self.hands)
+
+    def close(self, game):
+        if game is not None:
+            os.makedirs(game.config.postai_dir, exist_ok=True)
+            game._save_final_policies_and_winner()
+
+def simulate(hands=None, config=None, sinks=(), learners=None, persist=False):
+    """
+    自己対戦のハンド結果（HandResult）を 1 ハンドずつ yield するジェネレータ。
+    既定（persist=False）ではディスクに何も書かず、ファイル出力は sinks（ResultLogSink / TextLogSink / PolicySink など）で選ぶ。
+    卓が決着したら新しい卓で続け、合計 hands（省略時は config.rounds）ハンドまで。Learner と統計は卓をまたいで共有する。
+    hand_id は卓ごとに 1 から数え直す。close 時の卓は最後の卓で、ハンド数・生存ハンド数は全卓の合計
+    """
+    cfg = (config or GameConfig()).replace(human_ids=set(), persist=persist)
+    total = cfg.rounds if hands is None else hands
+    rng = random.Random(cfg.seed)   # 卓を作り直すたびにここから seed を引く
+    stats = None
+    g = None
+    n = 0
+    alive_hands = defaultdict(int)
+    try:
+        while n < total:
+            if g is not None:
+                for pid, k in g.player_alive_hands.items():
+                    alive_hands[pid] += k
+            g = Game(config=cfg.replace(seed=rng.getrandbits(64)), learners=learners, stats=stats)
+            g.sinks = list(sinks)
+            learners, stats = g.learners, g.stats
+            for result in g.simulate(total - n):
+                n += 1
+                yield result
+    finally:
+        if g is not None:
+            for pid, k in g.player_alive_hands.items():
+                alive_hands[pid] += k
+            g.hands_played = n
+            g.player_alive_hands = dict(alive_hands)
+        for sink in sinks:
+            sink.close(g)
 
 # ======== 実行 ========
+def _cmd_equity(a):
+    hole = parse_cards(a.hole)
+    board = parse_cards(a.board) if a.board else []
+    vs = [parse_cards(h) for h in a.vs]
+    if a.exact:
+        if not vs:
+            raise SystemExit("--exact requires at least one --vs hole")
+        res = equity_exact([hole] + vs, board)
+        for h, r in zip([hole] + vs, res):
+            print(f"{' '.join(map(card_to_str, h))}: equity={r.equity:.4f} win={r.win:.4f} tie={r.tie:.4f}")
+        print(f"board {' '.join(map(card_to_str, board)) or '-'} | {res[0].samples} runouts (exact)")
+        return
+    r = equity_mc(hole, board, n_opponents=max(a.opponents, len(vs)), opp_holes=vs,
+                  samples=a.samples, time_budget=a.time, target_ci=a.ci, workers=a.workers)
+    print(f"{' '.join(map(card_to_str, hole))} | board {' '.join(map(card_to_str, board)) or '-'}"
+          f" | vs {max(a.opponents, len(vs))}")
+    print(f"equity={r.equity:.4f} win={r.win:.4f} tie={r.tie:.4f} "
+          f"(n={r.samples}, ±{1.96 * r.stderr:.4f})")
+
+def _cmd_build_preflop(a):
+    t0 = time.perf_counter()
+    build_preflop_equity_table(samples=a.samples, workers=a.workers)
+    print(f"wrote {PREFLOP_EQUITY_PATH} ({time.perf_counter() - t0:.1f}s)")
+
+def _cmd_build_headsup(a):
+    t0 = time.perf_counter()
+    build_headsup_matrices(samples=0 if a.exact else a.samples, workers=a.workers)
+    print(f"wrote {HU_EQUITY_169_PATH}, {HU_EQUITY_1326_PATH} ({time.perf_counter() - t0:.1f}s)")
+
+def _cmd_build_buckets(a):
+    t0 = time.perf_counter()
+    for street in a.street:
+        street = street.upper()
+        if not a.recluster:
+            build_ehs_table(street, rollouts=a.rollouts, opponents=a.opponents, workers=a.workers)
+        centers = cluster_buckets(street, n_buckets=a.buckets)
+        print(f"{street}: {len(centers)} buckets, EHS² centers " + " ".join(f"{c:.3f}" for c in centers))
+    print(f"done ({time.perf_counter() - t0:.1f}s)")
+
+def _cmd_train(a):
+    cfg = GameConfig(num_players=a.players, human_ids=set(), headless=True, seed=a.seed)
+    if a.workers > 1:
+        train_parallel(a.workers, a.hands, sync_every=a.sync, config=cfg)
+    else:
+        train(a.hands, config=cfg)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        Game(num_players=NUM_PLAYERS, starting_stack=STARTING_STACK, sb=SB, bb=BB,
+             human_ids=HUMAN_IDS, max_rebuys=MAX_REBUYS).run(ROUNDS)
+        return
+    import argparse
+    ap = argparse.ArgumentParser(description="Roent Poker tools (引数なしで通常の対戦/学習)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("equity", help="モンテカルロでエクイティを推定 例: equity AsKd --board 'Qh Jh 2c'")
+    p.add_argument("hole")
+    p.add_argument("--board", default="")
+    p.add_argument("--opponents", type=int, default=1)
+    p.add_argument("--vs", action="append", default=[], help="既知の相手ホール（複数指定可）")
+    p.add_argument("--samples", type=int, default=100000)
+    p.add_argument("--time", type=float, default=None, help="時間上限（秒）")
+    p.add_argument("--ci", type=float, default=None, help="95%%信頼区間の半幅の目標")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--exact", action="store_true", help="--vs のホールに対して残りランアウトを全列挙（結果は tables/ にキャッシュ）")
+    p.set_defaults(func=_cmd_equity)
+    p = sub.add_parser("train", help="ヘッドレス自己対戦（表示・テキストログなし、学習・統計・ポリシー保存のみ）")
+    p.add_argument("--hands", type=int, default=ROUNDS, help="自己対戦の合計ハンド数（卓が決着したら新しい卓で続ける）")
+    p.add_argument("--players", type=int, default=NUM_PLAYERS)
+    p.add_argument("--workers", type=int, default=1, help="並列学習のプロセス数（各ワーカー 1 卓、--hands は全ワーカーの合計）")
+    p.add_argument("--sync", type=int, default=PARALLEL_SYNC_EVERY, help="学習テーブルを合流させる間隔（ワーカーごとのハンド数）")
+    p.add_argument("--seed", type=int, default=None, help="乱数シード（同じ値・同じ初期ポリシーなら同じ結果）")
+    p.set_defaults(func=_cmd_train)
+    p = sub.add_parser("build-preflop", help="169 分類 × 2〜10 人のプリフロップ・エクイティ表を生成")
+    p.add_argument("--samples", type=int, default=20000, help="1 セルあたりのサンプル数")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.set_defaults(func=_cmd_build_preflop)
+    p = sub.add_parser("build-headsup", help="ヘッズアップ・プリフロップ行列（169×169 / 1326×1326）を生成")
+    p.add_argument("--samples", type=int, default=20000, help="正規形 1 組あたりのサンプル数")
+    p.add_argument("--exact", action="store_true", help="全ランアウト列挙（非常に重い）")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.set_defaults(func=_cmd_build_headsup)
+    p = sub.add_parser("build-buckets", help="EHS / EHS² を計算して強さバケット表を生成（状態キーに |B<n> が付く）")
+    p.add_argument("--street", action="append", default=None, choices=["flop", "turn", "river"])
+    p.add_argument("--rollouts", type=int, default=30, help="1 正規番号あたりのランアウト数")
+    p.add_argument("--opponents", type=int, default=30, help="1 ランアウトあたりのランダム相手数")
+    p.add_argument("--buckets", type=int, default=8)
+    p.add_argument("--recluster", action="store_true", help="既存の EHS 表からバケットだけ作り直す")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.set_defaults(func=_cmd_build_buckets)
+    a = ap.parse_args(argv)
+    if getattr(a, "street", False) is None:
+        a.street = ["flop", "turn"]
+    a.func(a)
+
 if __name__ == "__main__":
-    Game(num_players=NUM_PLAYERS, starting_stack=STARTING_STACK, sb=SB, bb=BB,
-         human_ids=HUMAN_IDS, max_rebuys=MAX_REBUYS).run(ROUNDS)
+    main()
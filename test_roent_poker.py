@@ -0,0 +1,627 @@
+# test_roent_poker.py
+# roent_poker_gpt5_v1-0-13.py のテスト（pytest）
+# 実行: python -m pytest -q
+
+import os, sys, random, subprocess, importlib.util
+from array import array
+from collections import Counter, deque
+from itertools import combinations
+import pytest
+
+ENGINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "roent_poker_gpt5_v1-0-13.py")
+
+@pytest.fixture(scope="session")
+def engine(tmp_path_factory):
+    """エンジンを読み込む。import 時の logs/ postai/ と事前計算テーブルは一時ディレクトリに置く"""
+    work = tmp_path_factory.mktemp("engine")
+    cwd, table_dir = os.getcwd(), os.environ.get("ROENT_POKER_TABLE_DIR")
+    os.environ["ROENT_POKER_TABLE_DIR"] = str(work / "tables")
+    os.chdir(work)
+    try:
+        spec = importlib.util.spec_from_file_location("roent_poker_engine", ENGINE_PATH)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+    finally:
+        os.chdir(cwd)
+        if table_dir is None:
+            os.environ.pop("ROENT_POKER_TABLE_DIR", None)
+        else:
+            os.environ["ROENT_POKER_TABLE_DIR"] = table_dir
+    return mod
+
+def config(engine, tmp_path, **kw):
+    """ディスクに書かない卓の設定（ポリシーは空の一時ディレクトリから読む = 初期ポリシーなし）"""
+    return engine.GameConfig(log_dir=str(tmp_path / "logs"), postai_dir=str(tmp_path / "postai"), persist=False, **kw)
+
+def drive(game, action=("check", None)):
+    """1 ハンドを固定の行動で進め、手番を聞かれた (street, pid) の列を返す"""
+    asked = []
+    steps = game.hand_steps()
+    try:
+        p = next(steps)
+        while True:
+            asked.append((game.street, p.id))
+            p = steps.send(action)
+    except StopIteration:
+        pass
+    return asked
+
+# ======== 役評価 ========
+def brute_five(ranks, suits):
+    """5 枚の役を (役クラス, 比較用ランク列) で返す素朴な実装（eval7 とは独立）"""
+    groups = sorted(Counter(ranks).items(), key=lambda x: (x[1], x[0]), reverse=True)
+    order = [r for r, _ in groups]
+    counts = [n for _, n in groups]
+    flush = len(set(suits)) == 1
+    straight = None
+    if len(groups) == 5:
+        hi = max(ranks)
+        if hi - min(ranks) == 4:
+            straight = hi
+        elif sorted(ranks) == [2, 3, 4, 5, 14]:
+            straight = 5
+    if straight and flush:   return (8, [straight])
+    if counts[0] == 4:       return (7, order)
+    if counts[:2] == [3, 2]: return (6, order)
+    if flush:                return (5, order)
+    if straight:             return (4, [straight])
+    if counts[0] == 3:       return (3, order)
+    if counts[:2] == [2, 2]: return (2, order)
+    if counts[0] == 2:       return (1, order)
+    return (0, order)
+
+def brute_best(engine, cards):
+    return max(brute_five([engine.CARD_RANK[c] for c in five], [engine.CARD_SUIT[c] for c in five])
+               for five in combinations(cards, 5))
+
+def test_eval7_matches_brute_force(engine):
+    """7 枚の強さの大小・引き分けが 21 通りの総当たりと一致し、used5 は最強の 5 枚"""
+    rng = random.Random(1)
+    hands = [rng.sample(range(52), 7) for _ in range(3000)]
+    # 出にくい役も必ず含める: ロイヤル / ホイールのストレートフラッシュ、フォーカード、フルハウス、ホイール
+    mk = engine.make_card
+    hands += [[mk(r, s) for r, s in h] for h in (
+        [(14, "s"), (13, "s"), (12, "s"), (11, "s"), (10, "s"), (9, "s"), (2, "h")],
+        [(14, "d"), (2, "d"), (3, "d"), (4, "d"), (5, "d"), (13, "d"), (6, "c")],
+        [(9, "s"), (9, "h"), (9, "d"), (9, "c"), (14, "s"), (14, "h"), (13, "c")],
+        [(7, "s"), (7, "h"), (7, "d"), (4, "c"), (4, "s"), (4, "h"), (2, "c")],
+        [(14, "s"), (2, "h"), (3, "d"), (4, "c"), (5, "s"), (9, "h"), (12, "d")],
+    )]
+    fast = [engine.eval7(h) for h in hands]
+    slow = [brute_best(engine, h) for h in hands]
+    for h, f, b in zip(hands, fast, slow):
+        assert engine.hand_class(f) == b[0], h
+        sc, used = engine.best_of_seven(h)
+        assert sc == f and len(used) == 5 and set(used) <= set(h)
+        assert brute_best(engine, used) == b, h
+    ordered = sorted(zip(slow, fast))
+    for (x, a), (y, b) in zip(ordered, ordered[1:]):
+        assert a == b if x == y else a < b, (x, y)
+
+# ======== ドロー ========
+def cards(engine, text):
+    """'Ah Kd' -> カード列"""
+    return [engine.make_card("23456789TJQKA".index(t[0]) + 2, t[1]) for t in text.split()]
+
+def counted_outs(engine, hole, board):
+    """残りの 1 枚で、ホールを使うストレート / フラッシュ以上が新たに完成するカードを数える"""
+    seen = set(hole) | set(board)
+    n = 0
+    for c in range(52):
+        if c in seen:
+            continue
+        sc = engine.eval7([*hole, *board, c])
+        if engine.hand_class(sc) not in (4, 5, 8):
+            continue
+        if len(board) + 1 >= 5 and engine.eval7([*board, c]) >= sc:
+            continue   # ボードだけで同じ役になる
+        n += 1
+    return n
+
+def test_board_only_flush_is_not_a_draw(engine):
+    """ボードに同スート 4 枚・ホールは別スート: フラッシュドローもアウツもない"""
+    hole, board = cards(engine, "2c 7d"), cards(engine, "As Ks 9s 4s")
+    dr = engine.analyze_draws(hole, board)
+    assert not dr.flush4 and not dr.flush_draw and dr.outs == 0
+    assert engine.draw_labels(dr) == []
+    dr = engine.analyze_draws(cards(engine, "2s 7d"), cards(engine, "As Ks 9s"))
+    assert dr.flush_draw and dr.outs == 9
+
+def test_board_only_straight_is_not_a_draw(engine):
+    """ボードの 4 連続はホールが関わらなければドローではない。ホールで上に伸ばせば OESD"""
+    board = cards(engine, "5h 6d 7c 8s")
+    dr = engine.analyze_draws(cards(engine, "2c Kd"), board)
+    assert not (dr.run4 or dr.oesd or dr.gutshot) and dr.outs == 0
+    dr = engine.analyze_draws(cards(engine, "2c 9d"), cards(engine, "6d 7c 8s"))
+    assert dr.oesd and dr.outs == 8
+
+def test_draw_outs_match_enumeration(engine):
+    """アウツ数が残りカードの総当たりと一致し、BoardContext の増分計算とも一致する"""
+    rng = random.Random(5)
+    checked = 0
+    while checked < 400:
+        n_board = rng.choice((3, 4))
+        deal = rng.sample(range(52), 2 + n_board)
+        hole, board = deal[:2], deal[2:]
+        if engine.hand_class(engine.eval7(deal)) >= 4:
+            continue
+        dr = engine.analyze_draws(hole, board)
+        ctx = engine.BoardContext()
+        for c in board:
+            ctx.add(c)
+        assert ctx.draws(hole) == dr
+        assert dr.outs == counted_outs(engine, hole, board), (hole, board, dr)
+        checked += 1
+
+# ======== スート同型インデクサ ========
+def permute_suits(cards, perm):
+    return tuple((c & ~3) | perm[c & 3] for c in cards)
+
+@pytest.mark.parametrize("n_board, size", [(0, 169), (3, 1286792), (4, 13960050), (5, 123156254)])
+def test_hand_indexer_class_sizes(engine, n_board, size):
+    assert engine.hand_indexer(n_board).size == size
+
+def test_hand_indexer_preflop_is_169_combos(engine):
+    """ホール 1326 通りの番号は 169 種類で、169 分類（combo_id）と 1 対 1"""
+    ix = engine.hand_indexer(0)
+    seen = {}
+    for hole in combinations(range(52), 2):
+        seen.setdefault(ix.index(hole), set()).add(engine.combo_id(hole))
+    assert sorted(seen) == list(range(169))
+    assert all(len(v) == 1 for v in seen.values())
+    assert len(set.union(*seen.values())) == 169
+
+@pytest.mark.parametrize("n_board", [0, 3, 4, 5])
+def test_hand_indexer_round_trip(engine, n_board):
+    """index(unindex(i)) == i、代表は同じ類に戻り、スートの付け替えで番号は変わらない"""
+    ix = engine.hand_indexer(n_board)
+    rng = random.Random(n_board)
+    for i in [0, ix.size - 1] + [rng.randrange(ix.size) for _ in range(300)]:
+        cards = ix.unindex(i)
+        assert len(set(cards)) == 2 + n_board
+        assert ix.index(cards) == i
+    for _ in range(300):
+        cards = rng.sample(range(52), 2 + n_board)
+        i = ix.index(cards)
+        assert 0 <= i < ix.size
+        assert ix.index(ix.unindex(i)) == i
+        perm = rng.sample(range(4), 4)
+        hole, board = permute_suits(cards[:2], perm), permute_suits(cards[2:], perm)
+        assert ix.index(hole[::-1] + tuple(rng.sample(board, len(board)))) == i
+
+
+# ======== ボードテクスチャ ========
+def test_texture_table_matches_direct_computation(engine):
+    """フロップ/ターン表の値はその場の計算と一致し、カードの並び・スートの付け替えで変わらない"""
+    rng = random.Random(12)
+    for n_board in (3, 4):
+        for _ in range(300):
+            board = rng.sample(range(52), n_board)
+            code = engine.texture_code(board)
+            assert code == engine._texture_code(board)
+            assert engine.texture_code(sorted(board, reverse=True)) == code
+            assert engine.texture_code(permute_suits(board, rng.sample(range(4), 4))) == code
+
+@pytest.mark.parametrize("board, cls, fields", [
+    ("Ah Kh 2h", "m", dict(suited=3, flush_possible=True, high=3)),
+    ("8c 8d 3s", "p", dict(pairing=1, suited=1, straight_possible=False)),
+    ("9s 8d 7c", "w", dict(connect=3, straight_possible=True, suited=1)),
+    ("Kc 7d 2s", "d", dict(pairing=0, suited=1, straight_possible=False, high=2)),
+    ("Qc Qd Qs 4c", "p", dict(pairing=3, suited=2, flush_draw_possible=True)),
+])
+def test_texture_examples(engine, board, cls, fields):
+    t = engine.board_texture(cards(engine, board))
+    assert engine.texture_class(t) == cls
+    assert {k: getattr(t, k) for k in fields} == fields
+
+
+@pytest.mark.parametrize("n_players, n_board", [(2, 3), (3, 4), (4, 5)])
+def test_equity_exact_invariant_under_suits_and_order(engine, n_players, n_board):
+    """スートの付け替え・プレイヤーの並べ替えでエクイティが変わらない（キャッシュ経由でも同じ）"""
+    rng = random.Random(n_players * 10 + n_board)
+    for _ in range(5):
+        cards = rng.sample(range(52), 2 * n_players + n_board)
+        holes = [tuple(cards[2 * i:2 * i + 2]) for i in range(n_players)]
+        board = tuple(cards[2 * n_players:])
+        base = engine.equity_exact(holes, board, cache=False)
+        assert sum(r.equity for r in base) == pytest.approx(1.0)
+        engine.equity_exact(holes, board)   # 正規形のキーで保存 -> 下の cached は読み出し
+        perm = rng.sample(range(4), 4)
+        order = rng.sample(range(n_players), n_players)
+        moved = engine.equity_exact([permute_suits(holes[i], perm) for i in order],
+                                    permute_suits(board, perm), cache=False)
+        cached = engine.equity_exact([permute_suits(holes[i], perm) for i in order],
+                                     permute_suits(board, perm))
+        for j, i in enumerate(order):
+            for r in (moved[j], cached[j]):
+                assert r.samples == base[i].samples
+                assert (r.win, r.tie, r.equity) == pytest.approx((base[i].win, base[i].tie, base[i].equity))
+
+# ======== 169 分類 ========
+@pytest.mark.parametrize("hole, label", [("As Kd", "AKo"), ("Kd As", "AKo"), ("Ah Kh", "AKs"),
+                                         ("7c 7d", "77"), ("2s 3s", "32s"), ("Tc 9h", "T9o")])
+def test_combo_labels(engine, hole, label):
+    h = cards(engine, hole)
+    assert engine.hole_to_combo(h) == label
+    assert engine.combo_id(h) == engine.COMBO_INDEX[label]
+
+def test_combo_ids_cover_1326_holes(engine):
+    """1326 通りのホールが 169 分類に ペア 6 / スーテッド 4 / オフスート 12 ずつ入り、順不同で同じ番号"""
+    counts = Counter()
+    for c1, c2 in combinations(range(52), 2):
+        cid = engine.combo_id((c1, c2))
+        assert cid == engine.combo_id((c2, c1))
+        counts[engine.COMBO_LABELS[cid]] += 1
+    assert len(counts) == 169
+    for label, n in counts.items():
+        assert n == (6 if len(label) == 2 else 4 if label.endswith("s") else 12), label
+
+def test_range_bits_match_label_sets(engine):
+    bits = engine.range_bits(engine.CALL_VS_OPEN)
+    for hole in combinations(range(52), 2):
+        assert bool(bits >> engine.combo_id(hole) & 1) == (engine.hole_to_combo(hole) in engine.CALL_VS_OPEN)
+
+# ======== HU プリフロップ行列 ========
+def test_headsup_matrix_is_symmetric(engine, tmp_path, monkeypatch, capsys):
+    """A/K/2 のホールだけで行列を作る: eq[a][b] + eq[b][a] = 1、読み出しも一致し、強弱の向きが正しい"""
+    holes = [h for h in engine.HOLES_1326 if all(engine.CARD_RANK[c] in (14, 13, 2) for c in h)]
+    monkeypatch.setattr(engine, "HOLES_1326", holes)
+    monkeypatch.setattr(engine, "HU_EQUITY_1326_PATH", str(tmp_path / "hu_1326.bin"))
+    monkeypatch.setattr(engine, "HU_EQUITY_169_PATH", str(tmp_path / "hu_169.bin"))
+    m169, m1326 = engine.build_headsup_matrices(samples=300, workers=1, seed=9)
+    labels = ["AA", "KK", "22", "AKs", "AKo", "A2s", "A2o", "K2s", "K2o"]
+    for a in labels:
+        for b in labels:
+            ia, ib = engine.COMBO_INDEX[a], engine.COMBO_INDEX[b]
+            assert m169[ia * 169 + ib] + m169[ib * 169 + ia] == pytest.approx(1.0, abs=1e-6)
+            assert engine.headsup_equity_169(a, b) == pytest.approx(m169[ia * 169 + ib])
+    for i in range(len(holes)):
+        for j in range(len(holes)):
+            if i != j and not set(holes[i]) & set(holes[j]):
+                assert m1326[i * 1326 + j] + m1326[j * 1326 + i] == pytest.approx(1.0, abs=1e-6)
+    assert engine.headsup_equity_169("AA", "22") > 0.7
+    assert engine.headsup_equity_169("KK", "AKo") > 0.6
+    assert engine.headsup_equity_169("AKs", "AKo") > 0.5
+
+# ======== 強さバケット（EHS） ========
+def test_ehs_orders_made_hands_above_air(engine):
+    """フロップの EHS / EHS² はセット > オーバーペア > エアの順"""
+    vals = []
+    for hole, board in (("7c 7d", "7s Kh 2d"), ("Ac Ad", "7s Kh 2d"), ("4c 3d", "7s Kh Qd")):
+        i = engine.hand_index(cards(engine, hole), cards(engine, board))
+        _, (ehs, ehs2) = engine._ehs_chunk(3, i, i + 1, 40, 40, 11)
+        assert 0.0 <= ehs2 <= ehs <= 1.0
+        vals.append((ehs, ehs2))
+    assert vals[0] > vals[1] > vals[2]
+
+def test_buckets_are_monotone_in_ehs2(engine, tmp_path, monkeypatch):
+    """クラスタリング後のバケット番号は EHS² について単調（弱い順に 0..n-1 を全部使う）"""
+    monkeypatch.setattr(engine, "_street_path", lambda kind, street: str(tmp_path / f"{kind}_{street.lower()}.bin"))
+    rng = random.Random(11)
+    ehs2 = [rng.betavariate(2, 3) for _ in range(4000)]
+    table = array("f", [v for x in ehs2 for v in (x, x)])
+    with open(tmp_path / "ehs_flop.bin", "wb") as f:
+        f.write(engine.EHS_MAGIC + (3).to_bytes(4, "little") + len(ehs2).to_bytes(4, "little"))
+        table.tofile(f)
+    centers = engine.cluster_buckets("FLOP", n_buckets=6)
+    assert centers == sorted(centers)
+    buckets = (tmp_path / "buckets_flop.bin").read_bytes()[12:]
+    pairs = sorted(zip(table[1::2], buckets))
+    assert all(b1 <= b2 for (_, b1), (_, b2) in zip(pairs, pairs[1:]))
+    assert set(buckets) == set(range(6))
+
+# ======== サイドポット ========
+def rebuilt_pots(game):
+    """従来の build_pots: ハンド内の最終投入額を小さい順に剥がしてポットを組み直す"""
+    resid = dict(game.committed_total.items())
+    pots = []
+    while True:
+        live = [pid for pid, a in resid.items() if a > 0]
+        if not live:
+            return pots
+        x = min(resid[pid] for pid in live)
+        pots.append({"amount": x * len(live), "eligible": {pid for pid in live if not game.by_id[pid].is_folded}})
+        for pid in live:
+            resid[pid] -= x
+
+def test_pot_ledger_matches_rebuilt_pots(engine, tmp_path, monkeypatch):
+    """投入のたびに更新する PotLedger が、ショーダウン時点で従来の組み直しと同じポットになる"""
+    showdown, apply_action = engine.Game.showdown_and_award, engine.Game.apply_action
+    side_pots = []
+    def checked_showdown(self):
+        assert self.pot.pots() == rebuilt_pots(self)
+        side_pots.append(len(self.pot.pots()) > 1)
+        return showdown(self)
+    def checked_apply(self, *args):
+        r = apply_action(self, *args)
+        assert self.pot.total() == sum(self.committed_total.values())
+        return r
+    monkeypatch.setattr(engine.Game, "showdown_and_award", checked_showdown)
+    monkeypatch.setattr(engine.Game, "apply_action", checked_apply)
+    for n, seed in ((3, 5), (6, 2), (10, 1)):
+        list(engine.simulate(300, config(engine, tmp_path, num_players=n, seed=seed, starting_stack=60)))
+    assert any(side_pots)
+
+# ======== 記録（PublicAction / Decision / PotAward） ========
+def test_action_history_is_last_k_actions(engine):
+    PA = engine.PublicAction
+    actions = deque(maxlen=5)
+    for i in range(8):
+        actions.append(PA(i % 4, i + 1, engine.A_RAISE if i % 2 else engine.A_CALL, 10 * i, 20 * i if i % 2 else None))
+    hist = engine.action_history(actions, 3)
+    assert hist == [{"street": engine.STREETS[a.street], "by": a.by, "type": engine.ACTION_TYPES[a.type],
+                     "amount": a.amount, **({"to_total": a.to_total} if a.to_total is not None else {})}
+                    for a in list(actions)[-3:]]
+    assert len(engine.action_history(actions, 12)) == 5
+    assert engine.action_history(deque(), 4) == []
+
+def test_hand_records_agree_with_pots_and_learners(engine, tmp_path):
+    """PotAward の合計は投入総額、HandResult の勝者はポットごとの勝者、Decision は学習表のキーになる"""
+    g = engine.Game(config=config(engine, tmp_path, num_players=5, seed=25))
+    for _ in range(40):
+        g.play_hand()
+        r = g.last_result
+        assert sum(a.amount for a in g.hand_awards) == sum(g.committed_total.values())
+        assert r.winners == tuple(a.winners for a in g.hand_awards)
+        assert all(isinstance(w, tuple) and w for w in r.winners)
+        assert all(isinstance(d, engine.Decision) for d in r.decisions)
+        for d in r.decisions:
+            assert g.learners[d.pid]._key(d.state, d.option) in g.learners[d.pid].table
+        if len(g.alive_players()) < 2:
+            break
+
+# ======== 座席配置 ========
+def walked_geometry(n, alive):
+    """生存座席の集合から座席を 1 つずつ歩いて求めた配置（キャッシュ導入前と同じ手順）"""
+    def after(s):
+        j = (s + 1) % n
+        while j not in alive:
+            j = (j + 1) % n
+        return j
+    def ring(start):
+        order = [start]
+        while after(order[-1]) != start:
+            order.append(after(order[-1]))
+        return tuple(order)
+    return after, ring
+
+def test_table_geometry_matches_seat_walk(engine):
+    rng = random.Random(24)
+    for _ in range(300):
+        n = rng.randint(2, 10)
+        alive = set(rng.sample(range(n), rng.randint(2, n)))
+        button = rng.choice(sorted(alive))
+        geo = engine.table_geometry(n, sum(1 << s for s in alive), button)
+        after, ring = walked_geometry(n, alive)
+        sb, bb = after(button), after(after(button))
+        assert (geo.sb_seat, geo.bb_seat) == (sb, bb)
+        assert all(geo.next_seat[s] == after(s) for s in alive)
+        assert geo.postflop_order == ring(sb)
+        assert geo.preflop_order == (ring(sb) if len(alive) == 2 else ring(after(bb)))
+        order = [sb, bb] if len(alive) == 2 else [*ring(after(bb))[:len(alive) - 3], button, sb, bb]
+        assert geo.positions == dict(zip(order, engine.preflop_positions_for_n(len(alive))))
+
+def test_game_geometry_follows_eliminations(engine, tmp_path):
+    """淘汰・ボタン移動のたびに Game.geometry() が現在の生存座席の配置を返す"""
+    g = engine.Game(config=config(engine, tmp_path, num_players=6, seed=8, starting_stack=60, max_rebuys=0))
+    sizes = set()
+    for _ in g.simulate(200):
+        alive = {p.seat_index for p in g.alive_players()}
+        if len(alive) < 2:
+            break
+        sizes.add(len(alive))
+        after, _ = walked_geometry(6, alive)
+        assert g.find_blinds() == (after(g.button_index), after(after(g.button_index)))
+        assert g.geometry() == engine.table_geometry(6, sum(1 << s for s in alive), g.button_index)
+    assert len(sizes) > 1
+
+# ======== 状態キー ========
+def at_flop_decision(game):
+    """全員チェック / コールでフロップ最初の手番まで進め、(steps, 手番のプレイヤー) を返す"""
+    steps = game.hand_steps()
+    p = next(steps)
+    while game.street == "PREFLOP":
+        p = steps.send(("call", None) if game.turn_options(p.id).to_call else ("check", None))
+    return steps, p
+
+def test_bucket_suffix_only_for_key_format_3(engine, tmp_path, monkeypatch):
+    """強さバケット表があっても |B<n> が付くのは形式 3 のポリシーだけ（旧形式のキーは変えない）"""
+    monkeypatch.setattr(engine.BoardContext, "bucket", lambda self, hole: 5)
+    g = engine.Game(config=config(engine, tmp_path, num_players=3, seed=4, human_ids=set()))
+    _, p = at_flop_decision(g)
+    policy = g.policies[p.id]
+    keys = {}
+    for fmt in (1, 2, 3):
+        policy.learner.key_format = fmt
+        keys[fmt] = policy.propose(g, p)[1]
+    assert engine.POLICY_KEY_FORMAT == 3
+    assert "|B" not in keys[1] and "|B" not in keys[2]
+    assert keys[2].startswith(keys[1] + "|") and keys[3] == keys[2] + "|B5"
+
+# ======== 探索（ISMCTS） ========
+def test_ismcts_bet_sizes_reach_distinct_nodes(engine, tmp_path):
+    """サイズの違うベットは別の子ノードになり、探索後の卓は探索前のまま"""
+    g = engine.Game(config=config(engine, tmp_path, num_players=2, seed=9, human_ids=set()))
+    _, p = at_flop_decision(g)
+    before = (list(g.table.stack), list(g.board), list(g.deck), list(g.public_actions), p.hole)
+    policy = engine.ISMCTSPolicy(seeded_iters=200)
+    action, total = policy.act(g, p)
+    assert (list(g.table.stack), list(g.board), list(g.deck), list(g.public_actions), p.hole) == before
+    assert policy.iterations == 200
+    acts = policy.actions(g, p)
+    assert (action, total) in acts.values()
+    bets = {l: a for l, a in acts.items() if a[0] == "bet"}
+    assert len(bets) == 2
+    root = tuple(a[:4] for a in g.public_actions)
+    children = {k[-1] for k in policy.tree if len(k) == len(root) + 1 and k[:-1] == root}
+    bet_children = {c for c in children if c[2] == engine.ACTION_NO["bet"]}
+    assert {c[3] for c in bet_children} == {t - g.bet_in_round[p.id] for _, t in bets.values()}
+
+# ======== 進行 ========
+def test_headsup_sb_allin_on_blind_runs_out_board(engine, tmp_path):
+    """HU で SB がブラインドでオールイン: BB に判断を聞かずにリバーまで配る"""
+    g = engine.Game(config=config(engine, tmp_path, num_players=2, seed=3))
+    sb_seat, _ = g.find_blinds()
+    g.players[sb_seat].stack = 1
+    assert drive(g) == []
+    assert g.hand_end_stage == "RIVER" and len(g.board) == 5
+    assert g.learning_traces == []
+    assert sum(p.stack for p in g.players) == 301
+
+# ======== 再現性 ========
+def test_seeded_tables_repeat_and_do_not_share_rng(engine, tmp_path):
+    """同じ seed なら同じハンド列。卓ごとの RNG なので 2 卓を交互に進めても結果は変わらない"""
+    def hands(results):
+        return [(r.deltas, r.winners, r.end_street) for r in results]
+    cfg = config(engine, tmp_path, num_players=6, seed=13)
+    first = hands(engine.simulate(150, cfg))
+    assert first == hands(engine.simulate(150, cfg))
+    assert first != hands(engine.simulate(150, cfg.replace(seed=14)))
+    table = cfg.replace(human_ids=set())
+    alone = hands(engine.Game(config=table).simulate(150))
+    a, b = engine.Game(config=table), engine.Game(config=table.replace(seed=14))
+    steps = a.simulate(150)
+    interleaved = [ra for _, ra in zip(b.simulate(150), steps)]   # b が先に決着しても a の手を失わない順
+    interleaved.extend(steps)
+    assert hands(interleaved) == alone
+
+def test_learner_rng_follows_table_seed(engine, tmp_path):
+    """卓が作る Learner の乱数（rng を渡さない suggest 用）も卓の seed で決まる"""
+    def draws(seed):
+        g = engine.Game(config=config(engine, tmp_path, num_players=3, seed=seed, human_ids=set()))
+        return [l.rng.random() for l in g.learners.values()]
+    assert draws(3) == draws(3) != draws(4)
+    assert len(set(draws(3))) == 3
+
+def test_import_and_simulate_write_nothing(tmp_path):
+    """import と simulate()（persist=False）はカレントディレクトリに何も作らない"""
+    work = tmp_path / "cwd"
+    work.mkdir()
+    code = ("import importlib.util; spec = importlib.util.spec_from_file_location('e', %r); "
+            "e = importlib.util.module_from_spec(spec); spec.loader.exec_module(e); "
+            "print(len(list(e.simulate(30, e.GameConfig(num_players=3, seed=1)))))" % ENGINE_PATH)
+    env = dict(os.environ, ROENT_POKER_TABLE_DIR=str(tmp_path / "tables"))
+    out = subprocess.run([sys.executable, "-c", code], cwd=work, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.split() == ["30"]
+    assert os.listdir(work) == []
+
+def test_seeded_runs_with_search_player_repeat(engine, tmp_path):
+    """seed を固定すれば探索プレイヤー（時間打ち切りの ISMCTS）がいても同じハンドになる"""
+    def run():
+        cfg = config(engine, tmp_path, num_players=3, seed=7, search_ids={2})
+        return [(r.deltas, r.winners, r.end_street) for r in engine.simulate(8, cfg)]
+    assert run() == run()
+
+# ======== チップ保存 ========
+def test_simulate_conserves_chips(engine, tmp_path):
+    """各ハンドの収支の合計は 0（リバイは収支に含めない）、卓のチップ総量はリバイぶんだけ増える"""
+    cfg = config(engine, tmp_path, num_players=6, seed=11)
+    rebuys = False
+    for r in engine.simulate(300, cfg):
+        assert sum(r.deltas.values()) == 0, r
+    g = engine.Game(config=cfg)
+    for r in g.simulate(200):
+        assert sum(r.deltas.values()) == 0, r
+        total = sum(p.stack for p in g.players)
+        assert total == g.starting_stack * (len(g.players) + sum(p.rebuy_used for p in g.players))
+        rebuys = rebuys or any(p.rebuy_used for p in g.players)
+    assert rebuys
+
+# ======== ヘッドレス ========
+def test_headless_matches_verbose_run_without_text_output(engine, tmp_path, capsys):
+    """headless でも結果と学習は通常の実行と同じで、テキストログ・表示は出さない（hands/s の 1 行だけ）"""
+    runs = {}
+    for headless in (False, True):
+        d = tmp_path / str(headless)
+        cfg = engine.GameConfig(num_players=4, seed=1, headless=headless, human_ids=set(), run_ts="t",
+                                log_dir=str(d / "logs"), postai_dir=str(d / "postai"))
+        capsys.readouterr()
+        g = engine.Game(config=cfg)
+        g.run(60)
+        runs[headless] = ([p.stack for p in g.players], {pid: l.table for pid, l in g.learners.items()},
+                          capsys.readouterr().out, sorted(os.listdir(d / "logs")))
+    verbose, headless = runs[False], runs[True]
+    assert headless[:2] == verbose[:2] and any(headless[1].values())
+    lines = headless[2].strip().splitlines()
+    assert len(lines) == 1 and "hands/s, headless" in lines[0]
+    assert "all.log" in verbose[3] and "all.log" not in headless[3]
+    assert not [f for f in headless[3] if f.endswith((".log", ".jsonl"))]
+    assert os.listdir(tmp_path / "True" / "postai")
+
+def test_headless_rejects_human_players(engine, tmp_path):
+    with pytest.raises(ValueError):
+        engine.Game(config=config(engine, tmp_path, num_players=3, human_ids={1}))
+    with pytest.raises(ValueError):
+        engine.Game(config=config(engine, tmp_path, num_players=3, human_ids={1}).replace(persist=True, headless=True))
+
+# ======== 出力（HandSink） ========
+class RecordingSink:
+    def __init__(self):
+        self.lines, self.hands, self.events, self.closed = [], [], 0, 0
+
+    def line(self, game, msg):
+        self.lines.append(msg)
+
+    def event(self, game, acting_id, action_dict):
+        self.events += 1
+
+    def add(self, game, result):
+        self.hands.append((result, len(self.lines)))
+
+    def close(self, game):
+        self.closed += 1
+
+def test_run_writes_logs_through_sinks(engine, tmp_path, capsys):
+    """Game.run のファイル出力は既定の sink 経由で、追加した sink にも同じ表示行・結果が流れる"""
+    d = tmp_path / "run"
+    cfg = engine.GameConfig(num_players=4, seed=3, human_ids=set(), verbose=False, run_ts="t",
+                            log_dir=str(d / "logs"), postai_dir=str(d / "postai"))
+    g = engine.Game(config=cfg)
+    rec = RecordingSink()
+    g.run(20, sinks=g.default_sinks() + [rec])
+    assert rec.closed == 1 and len(rec.hands) == g.hands_played > 0
+    expected, start = "", 0
+    for _, end in rec.hands:
+        expected += "\n".join(rec.lines[start:end]) + "\n"
+        start = end
+    assert (d / "logs" / "all.log").read_text(encoding="utf-8") == expected
+    rows = sum(len((d / "logs" / f"player_{i}.jsonl").read_text(encoding="utf-8").splitlines()) for i in range(1, 5))
+    assert rec.events > 0 and rows >= rec.events
+    assert any(f.startswith("policy_memory_t_") for f in os.listdir(d / "postai"))
+
+    e = tmp_path / "bare"
+    g = engine.Game(config=cfg.replace(log_dir=str(e / "logs"), postai_dir=str(e / "postai")))
+    g.run(20, sinks=[rec])
+    assert not os.path.exists(e / "logs") or not os.listdir(e / "logs")
+
+# ======== 学習 ========
+def test_train_counts_total_hands_across_tables(engine, tmp_path, capsys):
+    """--hands は合計ハンド数: HU 卓が途中で決着しても新しい卓で続けて所定数を打つ"""
+    cfg = config(engine, tmp_path, seed=5, starting_stack=20).replace(persist=True)
+    engine.train(400, num_players=2, config=cfg)
+    assert "=== 400 hands in" in capsys.readouterr().out
+
+def test_train_with_more_workers_than_hands(engine, tmp_path, monkeypatch, capsys):
+    """ワーカー数がハンド数より多くても落ちない（0 ハンドのワーカーは作らない）"""
+    monkeypatch.chdir(tmp_path)
+    engine.main(["train", "--workers", "3", "--hands", "2", "--players", "3", "--seed", "1"])
+    assert "=== 2 hands in" in capsys.readouterr().out
+
+def test_train_zero_hands(engine, tmp_path, capsys):
+    cfg = config(engine, tmp_path, seed=1).replace(persist=True)
+    engine.train(0, num_players=3, config=cfg)
+    engine.train_parallel(2, 0, num_players=3, config=cfg)
+    assert capsys.readouterr().out.count("=== 0 hands in") == 2
+    assert not [f for f in os.listdir(tmp_path / "postai") if "_No" in f]   # 終了時のポリシーは保存しない
+
+def test_merge_delta_is_order_independent(engine):
+    """ワーカーの差分は届いた順によらず同じ回数重み付き平均になる"""
+    def merged(order):
+        learners = {1: engine.Learner(1, None, "t", {})}
+        learners[1].table = {"s|a": {"n": 10, "q": 1.0}}
+        for d in order:
+            engine._merge_delta(learners, d)
+        return learners[1].table
+    a = {1: {"s|a": (5, 2.0), "s|b": (3, 0.5), "s|c": (0, 9.0)}}
+    b = {1: {"s|a": (5, 4.0)}}
+    assert merged([a, b]) == merged([b, a]) == {"s|a": {"n": 20, "q": 2.0}, "s|b": {"n": 3, "q": 0.5}}